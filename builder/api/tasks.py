@@ -5,6 +5,7 @@ Tasks for Celery workers
 import os
 import sys
 import logging
+import threading
 
 from celery import Celery, signals
 from celery.utils.log import get_task_logger
@@ -33,6 +34,9 @@ celery.conf.update(
 celery.conf.task_queues = (
     Queue('update', routing_key='update'),
 )
+# Each pool process builds its Rosetta as it starts (see init_worker_process), which takes longer
+# than celery's default of 4 seconds to report in.
+celery.conf.worker_proc_alive_timeout = 60
 # Tell celery not to mess with logging at all
 @signals.setup_logging.connect
 def setup_celery_logging(**kwargs):
@@ -41,15 +45,38 @@ celery.log.setup()
 
 logger = logging.getLogger(__name__)
 
+greent_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..')
+sys.path.insert(0, greent_path)
+
+# One Rosetta per worker process, shared by every task it runs.
+rosetta = None
+rosetta_lock = threading.Lock()
+
+def get_rosetta():
+    '''
+    This process's Rosetta, built the first time it is needed
+    '''
+    global rosetta
+    with rosetta_lock:
+        if rosetta is None:
+            rosetta = setup(os.path.join(greent_path, 'greent', 'greent.conf'))
+    return rosetta
+
+@signals.worker_process_init.connect
+def init_worker_process(**kwargs):
+    '''
+    Build Rosetta in each pool process once it has forked, before it takes any tasks, so that
+    processes never share the neo4j or redis connections it opens
+    '''
+    get_rosetta()
+
 @celery.task(bind=True, queue='update')
 def update_kg(self, question_json):
     '''
     Update the shared knowledge graph with respect to a question
     '''
     
-    greent_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..')
-    sys.path.insert(0, greent_path)
-    rosetta = setup(os.path.join(greent_path, 'greent', 'greent.conf'))
+    rosetta = get_rosetta()
 
     self.update_state(state='UPDATING KG')
     logger.info("Updating the knowledge graph...")
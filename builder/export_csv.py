@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+import argparse
+import logging
+import os
+import sys
+
+greent_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, greent_path)
+
+from greent.util import LoggingUtil
+from greent.export import CSVWriter, replay_messages
+
+logger = LoggingUtil.init_logging("builder.export_csv", level=logging.INFO)
+
+helpstring = """Rebuild the graph offline from writer message logs.  Each log holds the messages the writer
+consumed from the neo4j queue, one per line (see MESSAGE_LOG in builder/writer.py).  The nodes and edges in
+them are written to CSV files in the output directory, one per node type and one per edge label, and the
+neo4j-admin command that imports those files into a new database is printed."""
+
+def main():
+    parser = argparse.ArgumentParser(description=helpstring)
+    parser.add_argument('logs', nargs='+', help='Message log files to replay')
+    parser.add_argument('-o', '--output', help='Directory for the CSV files', default='import')
+    parser.add_argument('-d', '--database', help='Name of the database to import into', default='graph.db')
+    args = parser.parse_args()
+    with CSVWriter(args.output) as writer:
+        for log in args.logs:
+            logger.info(f"Replaying {log}")
+            with open(log) as messages:
+                replay_messages(messages, writer)
+    print(writer.import_command(args.database))
+
+if __name__ == '__main__':
+    main()
@@ -303,8 +303,19 @@ class Question(FromDictMixin):
             plans.append(transitions)
         return plans
 
-    def compile(self, rosetta):
-        plans = self.get_transitions(rosetta.type_graph, self.generate_concept_cypher())
+    @property
+    def shape(self):
+        """The question's topology: node ids, types and which nodes are named, and its edges.
+        Questions that differ only in their curies have the same shape, and so the same plan."""
+        nodes = [[n.id, n.type, bool(n.curie)] for n in self.machine_question['nodes']]
+        edges = [[e.source_id, e.target_id, e.min_length, e.max_length] for e in self.machine_question['edges']]
+        # Ids may be numbers or strings, so sort by their JSON.
+        return json.dumps({'nodes': sorted(nodes, key=json.dumps), 'edges': sorted(edges, key=json.dumps)})
+
+    def plan(self, concept_graph):
+        """Merge the concept-level plans into one map from source node id -> target node id -> transitions."""
+        # Enumerate concept-level plans over the in-memory type graph rather than with generate_concept_cypher.
+        plans = concept_graph.plans(self.machine_question['nodes'], self.machine_question['edges'])
 
         # merge plans
         plan = {n.id: {n.id: [] for n in self.machine_question['nodes']} for n in self.machine_question['nodes']}
@@ -316,7 +327,18 @@ class Question(FromDictMixin):
         # remove duplicate transitions
         for source_id in plan:
             for target_id in plan:
-                plan[source_id][target_id] = {t['op']:t for t in plan[source_id][target_id]}.values()
+                plan[source_id][target_id] = list({t['op']:t for t in plan[source_id][target_id]}.values())
+        return plan
+
+    def compile(self, rosetta):
+        # Plans are cached by question shape and the type graph's persisted version, so a rebuilt type graph gets new plans.
+        concept_graph = rosetta.type_graph.concept_graph()
+        shape = hashlib.sha1(self.shape.encode('utf-8')).hexdigest()
+        key = f"plan({shape},{concept_graph.version})"
+        plan = rosetta.cache.get(key)
+        if plan is None:
+            plan = self.plan(concept_graph)
+            rosetta.cache.set(key, plan)
 
         if not plan:
             raise RuntimeError('No viable programs.')
@@ -10,9 +10,8 @@ import json
 import pika
 
 from greent.util import LoggingUtil
-from greent.export import BufferedWriter
+from greent.export import BufferedWriter, WriterConsumer, writer_queues
 from builder.buildmain import setup
-from greent.graph_components import KNode, KEdge
 from builder.api import logging_config
 
 logger = LoggingUtil.init_logging("builder.writer", level=logging.DEBUG)
@@ -21,31 +20,24 @@ greent_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
 sys.path.insert(0, greent_path)
 rosetta = setup(os.path.join(greent_path, 'greent', 'greent.conf'))
 
+# Run one writer per shard: WRITER_SHARD picks this one's queue, out of writer.service.shards.
+service_config = rosetta.service_context.config.get('writer', {}).get('service', {})
+queue = writer_queues(service_config.get('shards', 1))[int(os.environ.get('WRITER_SHARD', 0))]
+
 connection = pika.BlockingConnection(pika.ConnectionParameters(host=os.environ['BROKER_HOST'],
     virtual_host='builder',
     credentials=pika.credentials.PlainCredentials(os.environ['BROKER_USER'], os.environ['BROKER_PASSWORD'])))
 channel = connection.channel()
 
-channel.queue_declare(queue='neo4j')
-
-writer = BufferedWriter(rosetta)
+# The consumer decides when to write, so that it only acknowledges messages once they are written.
+writer = BufferedWriter(rosetta, flush_thread=False)
 
-def callback(ch, method, properties, body):
-    body = body.decode()
-    # logger.info(f" [x] Received {body}")
-    if isinstance(body, str) and body == 'flush':
-        writer.flush()
-        return
-    graph = json.loads(body)
-    for node in graph['nodes']:
-        writer.write_node(KNode(node))
-    for edge in graph['edges']:
-        writer.write_edge(KEdge(edge))
+# With MESSAGE_LOG set, every message consumed is also appended to that file, one per line, so the
+# graph can be rebuilt offline later with builder/export_csv.py.
+message_log = open(os.environ['MESSAGE_LOG'], 'a', buffering=1) if os.environ.get('MESSAGE_LOG') else None
 
-channel.basic_consume(callback,
-                      queue='neo4j',
-                      no_ack=True)
+consumer = WriterConsumer(channel, queue, writer, service_config, message_log)
 
-logger.info(' [*] Waiting for messages.')
+logger.info(f' [*] Waiting for messages on {queue}.')
 print('To exit press CTRL+C')
-channel.start_consuming()
+consumer.run()
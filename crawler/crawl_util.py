@@ -17,10 +17,13 @@ def glom(conc_set, newgroups):
         for element in newset:
             conc_set[element] = newset
 
-def dump_cache(concord,rosetta):
-    for chem_id in concord:
-        key = f"synonymize({chem_id})"
-        if "'" in key:
-            print(key)
-        value = concord[chem_id]
-        rosetta.cache.set(key,value)
+def dump_cache(concord,rosetta,chunk_size=None):
+    """Put the equivalence sets in concord into the cache and, if one is configured, the local concordance index.
+    Members of an equivalence set share one set object (see glom), so each set is serialized once and
+    written under all of its members' keys, in pipelined chunks."""
+    if rosetta.service_context.concordance is not None:
+        rosetta.service_context.concordance.update(concord)
+    groups = {}
+    for identifier, synonyms in concord.items():
+        groups.setdefault(id(synonyms), (synonyms, []))[1].append(f"synonymize({identifier})")
+    rosetta.cache.bulk_set(((keys, synonyms) for synonyms, keys in groups.values()), chunk_size=chunk_size)
@@ -5,6 +5,7 @@ from gzip import decompress
 from collections import defaultdict
 from greent.graph_components import LabeledID
 from greent.util import LoggingUtil
+from crawler.crawl_util import dump_cache
 import logging
 
 logger = LoggingUtil.init_logging(__name__, level=logging.DEBUG)
@@ -48,10 +49,7 @@ def load_genes(rosetta):
     cache so that it will be found by subsequent synonymize calls.
     """
     ids_to_synonyms = synonymize_genes()
-    for gene_id in ids_to_synonyms:
-        key = f"synonymize({gene_id})"
-        value = ids_to_synonyms[gene_id]
-        rosetta.cache.set(key,value)
+    dump_cache(ids_to_synonyms,rosetta)
     logger.debug(f'Added {len(ids_to_synonyms)} gene symbols to the cache')
 
 def synonymize_genes():
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import logging
 import operator
@@ -5,12 +6,35 @@ import os
 import pickle
 import requests
 import redis
+import sys
+import threading
+from redis.exceptions import LockError
+import time
 import traceback
+import types
+import zlib
+from collections import OrderedDict
+from greent.graph_components import KNode, KEdge, LabeledID
 from greent.util import LoggingUtil
-from lru import LRU
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
 
 logger = LoggingUtil.init_logging(__name__, level=logging.DEBUG)
 
+class UnreadableRecord(ValueError):
+    """ A cache record this reader can't decode, e.g. one compressed with a codec that isn't installed here. """
+
 class CacheSerializer:
     """ Generic serializer. """
     def __init__(self):
@@ -18,25 +42,370 @@ class CacheSerializer:
 
 class PickleCacheSerializer(CacheSerializer):
     """ Use Python's default serialization. """
-    def __init__(self):
+    def __init__(self, **options):
+        """ Options meant for other serializers (compression etc.) don't apply. """
         pass
     def dumps(self, obj):
         return pickle.dumps (obj)
     def loads(self, str):
         return pickle.loads (str)
 
-class JSONCacheSerializer(CacheSerializer):
-    pass # would be nice
+class CompactCacheSerializer(CacheSerializer):
+    """ A compact, versioned codec for the things we actually cache: lists of (KEdge, KNode) results,
+    synonym sets of LabeledIDs and sets of completed targets.  Objects are flattened into tagged arrays
+    (no attribute names, no class paths) and packed with msgpack if it is installed, JSON otherwise.
+    Payloads larger than compression_threshold bytes are compressed with zstd, lz4 or zlib.
+
+    Each record starts with a small header (magic, version, encoding, compression), so records
+    from older versions - including plain pickles written before this serializer existed - can
+    still be read.  Values the codec doesn't understand are pickled inside the envelope.
+    """
+    MAGIC = b'\xc1G'
+    VERSION = 1
+    ENCODINGS = { 'msgpack': b'm', 'json': b'j', 'pickle': b'p' }
+    COMPRESSIONS = { None: b'n', 'zlib': b'g', 'zstd': b'z', 'lz4': b'l' }
+
+    def __init__(self, encoding=None, compression='zlib', compression_threshold=1024):
+        if encoding is None:
+            encoding = 'msgpack' if msgpack else 'json'
+        if encoding == 'msgpack' and not msgpack:
+            raise ValueError ("msgpack encoding requested but msgpack is not installed")
+        if compression == 'zstd' and not zstandard:
+            logger.warning ("zstandard is not installed. Falling back to zlib compression.")
+            compression = 'zlib'
+        if compression == 'lz4' and not lz4:
+            logger.warning ("lz4 is not installed. Falling back to zlib compression.")
+            compression = 'zlib'
+        if compression not in self.COMPRESSIONS:
+            raise ValueError (f"Unknown compression: {compression}")
+        self.encoding = encoding
+        self.compression = compression
+        self.compression_threshold = int(compression_threshold)
+
+    def is_native(self, rec):
+        """ True if rec was written by this serializer (rather than e.g. a legacy pickle). """
+        return rec[:2] == self.MAGIC
+
+    def dumps(self, obj):
+        encoding = self.encoding
+        try:
+            payload = self.pack (encode_cache_value (obj), encoding)
+        except (TypeError, OverflowError, ValueError):
+            # e.g. a value the codec doesn't know, or an int too big for msgpack.
+            encoding = 'pickle'
+            payload = pickle.dumps (obj)
+        compression = self.compression if len(payload) > self.compression_threshold else None
+        if compression == 'zstd':
+            payload = zstandard.ZstdCompressor ().compress (payload)
+        elif compression == 'lz4':
+            payload = lz4.frame.compress (payload)
+        elif compression == 'zlib':
+            payload = zlib.compress (payload)
+        header = self.MAGIC + bytes([self.VERSION]) + self.ENCODINGS[encoding] + self.COMPRESSIONS[compression]
+        return header + payload
+
+    def loads(self, rec):
+        if not self.is_native (rec):
+            return pickle.loads (rec)
+        version = rec[2]
+        if version > self.VERSION:
+            raise UnreadableRecord (f"Cache record version {version} is newer than this reader ({self.VERSION})")
+        encoding = rec[3:4]
+        compression = rec[4:5]
+        payload = rec[5:]
+        if compression == b'z' and not zstandard:
+            raise UnreadableRecord ("Cache record is compressed with zstd, but zstandard is not installed")
+        if compression == b'l' and not lz4:
+            raise UnreadableRecord ("Cache record is compressed with lz4, but lz4 is not installed")
+        if encoding == b'm' and not msgpack:
+            raise UnreadableRecord ("Cache record is encoded with msgpack, but msgpack is not installed")
+        if compression == b'z':
+            payload = zstandard.ZstdDecompressor ().decompress (payload)
+        elif compression == b'l':
+            payload = lz4.frame.decompress (payload)
+        elif compression == b'g':
+            payload = zlib.decompress (payload)
+        if encoding == b'p':
+            return pickle.loads (payload)
+        elif encoding == b'm':
+            return decode_cache_value (msgpack.unpackb (payload, raw=False, use_list=True))
+        return decode_cache_value (json.loads (payload.decode ('utf-8')))
+
+    def pack(self, value, encoding):
+        if encoding == 'msgpack':
+            return msgpack.packb (value, use_bin_type=True)
+        return json.dumps (value, separators=(',', ':')).encode ('utf-8')
+
+class JSONCacheSerializer(CompactCacheSerializer):
+    """ The compact codec, always encoded as JSON. """
+    def __init__(self, compression='zlib', compression_threshold=1024):
+        super(JSONCacheSerializer, self).__init__(encoding='json',
+                                                  compression=compression,
+                                                  compression_threshold=compression_threshold)
+
+serializers = {
+    'pickle'  : PickleCacheSerializer,
+    'compact' : CompactCacheSerializer,
+    'json'    : JSONCacheSerializer
+}
+
+# Fields written positionally by the compact codec.  Anything else on an object goes in a trailing dict.
+KNODE_FIELDS = ('id', 'name', 'type', 'properties', 'synonyms')
+KEDGE_FIELDS = ('source_id', 'target_id', 'provided_by', 'ctime', 'original_predicate', 'standard_predicate',
+                'input_id', 'publications', 'url', 'is_support', 'properties')
+
+def encode_cache_value(obj):
+    """ Flatten a cacheable value into lists and scalars.  Every container becomes a list whose first
+    element is a one letter tag, so plain strings and numbers never need one. """
+    if obj is None or isinstance(obj, (str, bool, int, float)):
+        return obj
+    if isinstance(obj, LabeledID):
+        return [ 'L', obj.identifier, obj.label ]
+    if isinstance(obj, KNode):
+        return [ 'N' ] + encode_fields (obj, KNODE_FIELDS)
+    if isinstance(obj, KEdge):
+        return [ 'E' ] + encode_fields (obj, KEDGE_FIELDS)
+    if isinstance(obj, list):
+        return [ 'l' ] + [ encode_cache_value (v) for v in obj ]
+    if isinstance(obj, tuple):
+        return [ 't' ] + [ encode_cache_value (v) for v in obj ]
+    if isinstance(obj, (set, frozenset)):
+        return [ 's' ] + [ encode_cache_value (v) for v in obj ]
+    if isinstance(obj, dict):
+        flat = [ 'd' ]
+        for k, v in obj.items ():
+            flat.append (encode_cache_value (k))
+            flat.append (encode_cache_value (v))
+        return flat
+    raise TypeError (f"Cannot encode {type(obj)}")
+
+def encode_fields(obj, fields):
+    values = vars(obj)
+    extra = { k: v for k, v in values.items () if k not in fields }
+    return [ encode_cache_value (values.get (f)) for f in fields ] + [ encode_cache_value (extra) if extra else None ]
+
+def decode_cache_value(flat):
+    if not isinstance(flat, list):
+        return flat
+    tag = flat[0]
+    if tag == 'L':
+        return new_object (LabeledID, { 'identifier': flat[1], 'label': flat[2] })
+    if tag == 'N':
+        return decode_fields (KNode, KNODE_FIELDS, flat)
+    if tag == 'E':
+        return decode_fields (KEdge, KEDGE_FIELDS, flat)
+    items = [ decode_cache_value (v) for v in flat[1:] ]
+    if tag == 'l':
+        return items
+    if tag == 't':
+        return tuple(items)
+    if tag == 's':
+        return set(items)
+    if tag == 'd':
+        return { items[i]: items[i+1] for i in range(0, len(items), 2) }
+    raise ValueError (f"Unknown cache value tag: {tag}")
+
+def decode_fields(cls, fields, flat):
+    values = { f: decode_cache_value (v) for f, v in zip(fields, flat[1:]) }
+    extra = decode_cache_value (flat[len(fields)+1])
+    if extra:
+        values.update (extra)
+    return new_object (cls, values)
+
+def new_object(cls, values):
+    """ Rebuild an object from its attributes without running its constructor. """
+    obj = cls.__new__ (cls)
+    obj.__dict__.update (values)
+    return obj
+
+class TierStats:
+    """ Hit, miss and eviction counters for one cache tier. """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock ()
+    def count(self, hits=0, misses=0, evictions=0):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+    def dump(self):
+        return { 'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions }
+
+class ExpiryPolicy:
+    """ Time to live, in seconds, for cache keys by key prefix.  The longest matching prefix wins.
+    A ttl of 0 or None means the entry never expires. """
+    def __init__(self, rules=None, default=None):
+        rules = rules or []
+        self.rules = sorted([ (r['prefix'], int(r['ttl']) if r.get('ttl') else None) for r in rules ],
+                            key=lambda rule: len(rule[0]), reverse=True)
+        self.default = int(default) if default else None
+    def ttl(self, key):
+        for prefix, ttl in self.rules:
+            if key.startswith (prefix):
+                return ttl
+        return self.default
+
+class MemoryTier:
+    """ In-process LRU of live values, bounded by the memory they hold (see object_size) rather than a count. """
+    def __init__(self, max_bytes=64*1024*1024):
+        self.max_bytes = int(max_bytes)
+        self.size = 0
+        self.entries = OrderedDict ()
+        self.stats = TierStats ()
+        self.lock = threading.Lock ()
+    def get(self, key):
+        """ Returns (found, value). """
+        with self.lock:
+            entry = self.entries.get (key)
+            if entry is not None:
+                value, size, expires = entry
+                if expires is None or expires > time.time ():
+                    self.entries.move_to_end (key)
+                    self.stats.count (hits=1)
+                    return True, value
+                self.remove (key)
+                self.stats.count (evictions=1)
+        self.stats.count (misses=1)
+        return False, None
+    def put(self, key, value, size, ttl=None):
+        with self.lock:
+            if key in self.entries:
+                self.remove (key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size, time.time () + ttl if ttl else None)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.remove (next(iter(self.entries)))
+                self.stats.count (evictions=1)
+    def remove(self, key):
+        value, size, expires = self.entries.pop (key)
+        self.size -= size
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.remove (key)
+    def clear(self):
+        with self.lock:
+            self.entries.clear ()
+            self.size = 0
+    def dump(self):
+        return dict(self.stats.dump (), entries=len(self.entries), bytes=self.size)
+
+class DiskTier:
+    """ Serialized entries in files under a directory.  Expiry is judged from the file's mtime.
+    When the directory grows past max_bytes, the least recently written files are removed. """
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.stats = TierStats ()
+        self.lock = threading.Lock ()
+        if not os.path.exists (self.path):
+            os.makedirs (self.path)
+        self.size = sum([ os.path.getsize (os.path.join (self.path, f)) for f in os.listdir (self.path) ])
+    def file_name(self, key):
+        return os.path.join (self.path, hashlib.sha1 (key.encode ('utf-8')).hexdigest ())
+    def get(self, key, ttl=None):
+        path = self.file_name (key)
+        try:
+            if ttl and os.path.getmtime (path) + ttl < time.time ():
+                self.delete (path)
+                self.stats.count (misses=1, evictions=1)
+                return None
+            with open(path, 'rb') as stream:
+                rec = stream.read ()
+        except (FileNotFoundError, OSError):
+            self.stats.count (misses=1)
+            return None
+        self.stats.count (hits=1)
+        return rec
+    def put(self, key, rec):
+        path = self.file_name (key)
+        with open(path, 'wb') as stream:
+            stream.write (rec)
+        with self.lock:
+            self.size += len(rec)
+        if self.max_bytes and self.size > self.max_bytes:
+            self.prune ()
+    def delete(self, path):
+        try:
+            size = os.path.getsize (path)
+            os.remove (path)
+            with self.lock:
+                self.size -= size
+        except OSError:
+            pass
+    def prune(self):
+        """ Remove the oldest files until we are back under 90% of max_bytes. """
+        with self.lock:
+            files = [ os.path.join (self.path, f) for f in os.listdir (self.path) ]
+            files = sorted([ (os.path.getmtime (f), os.path.getsize (f), f) for f in files ])
+            self.size = sum([ size for mtime, size, f in files ])
+            target = self.max_bytes * 0.9
+            for mtime, size, f in files:
+                if self.size <= target:
+                    break
+                try:
+                    os.remove (f)
+                    self.size -= size
+                    self.stats.count (evictions=1)
+                except OSError:
+                    pass
+    def dump(self):
+        return dict(self.stats.dump (), bytes=self.size)
+
+def entry_size(key, value):
+    """ Approximate memory held by a memory tier entry: its key plus its value (misses are cached too). """
+    return sys.getsizeof (key) + object_size (value)
+
+def object_size(value):
+    """ Approximate memory held by a Python value: sys.getsizeof of it and of everything it refers to
+    (the contents of containers and the attributes of objects such as KNode and KEdge), each object
+    counted once.  The serialized size is no guide: live objects take many times more. """
+    seen = set ()
+    size = 0
+    stack = [ value ]
+    while stack:
+        obj = stack.pop ()
+        if id(obj) in seen:
+            continue
+        seen.add (id(obj))
+        size += sys.getsizeof (obj)
+        if isinstance(obj, dict):
+            stack.extend (obj.keys ())
+            stack.extend (obj.values ())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend (obj)
+        elif hasattr(obj, '__dict__') and not isinstance(obj, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            stack.append (obj.__dict__)
+    return size
 
 class Cache:
-    """ Cache objects by configurable means. """
+    """ Cache objects by configurable means.
+    Lookups go through up to three tiers: an in-process memory tier bounded by bytes, an optional
+    on-disk tier, and redis.  Entries expire according to an ExpiryPolicy on key prefixes.
+    Without redis, the disk tier (at cache_path) is always used. """
     def __init__(self, cache_path="cache",
                  serializer=PickleCacheSerializer,
                  redis_host="localhost", redis_port=6379, redis_db=0,
-                 enabled=True):
+                 enabled=True,
+                 memory_max_bytes=64*1024*1024,
+                 disk_path=None, disk_max_bytes=None,
+                 expiry=None,
+                 lock_timeout=300,
+                 bulk_chunk_size=10000,
+                 negative_ttl=60):
         
-        """ Connect to cache. """
+        """ Connect to cache. serializer may be a serializer class or an instance.
+        expiry is an ExpiryPolicy; by default nothing expires.
+        lock_timeout bounds how long a single_flight computation may hold its key's lock.
+        bulk_chunk_size is the default number of keys per pipeline in bulk_set.
+        negative_ttl bounds how long the memory tier remembers a miss (0: misses aren't remembered), so a
+        long-lived process looks the key up again later. """
         self.enabled = enabled
+        self.redis_stats = TierStats ()
         try:
             self.redis = redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db)
             self.redis.get ('x')
@@ -46,10 +415,16 @@ class Cache:
             #logger.debug (traceback.format_exc ())
             logger.error(f"Failed to connect to redis at {redis_host}:{redis_port}/{redis_db}.")
         self.cache_path = cache_path
-        if not os.path.exists (self.cache_path):
-            os.makedirs (self.cache_path)
-        self.cache = LRU (1000) 
-        self.serializer = serializer ()
+        if disk_path is None and self.redis is None:
+            disk_path = cache_path
+        self.disk = DiskTier (disk_path, disk_max_bytes) if disk_path else None
+        self.cache = MemoryTier (memory_max_bytes)
+        self.expiry = expiry if expiry is not None else ExpiryPolicy ()
+        self.serializer = serializer () if isinstance(serializer, type) else serializer
+        self.lock_timeout = int(lock_timeout)
+        self.bulk_chunk_size = int(bulk_chunk_size)
+        self.negative_ttl = int(negative_ttl)
+        self.coalesced = TierStats ()
         
     def get(self, key):
         """ Get a cached item by key. """
@@ -57,32 +432,245 @@ class Cache:
         #    return None
         result = None
         if self.enabled:
-            if key in self.cache:
-                result = self.cache[key]
-            elif self.redis:
-                rec = self.redis.get (key)
-                result = self.serializer.loads (rec) if rec is not None else None
-                self.cache[key] = result
-            else:
-                path = os.path.join (self.cache_path, key)
-                if os.path.exists (path):
-                    with open(path, 'rb') as stream:
-                        result = self.serializer.loads (stream.read ())
-                        self.cache[key] = result
+            found, result = self.cache.get (key)
+            if not found:
+                result = self.load (key)
+        return result
+
+    def load(self, key):
+        """ Read an item from the disk and redis tiers, skipping the memory tier (which may hold a stale miss). """
+        ttl = self.expiry.ttl (key)
+        rec = self.disk.get (key, ttl) if self.disk else None
+        if rec is None and self.redis:
+            rec = self.redis.get (key)
+            self.redis_stats.count (hits=int(rec is not None), misses=int(rec is None))
+            if rec is not None and self.disk:
+                self.disk.put (key, rec)
+        result = self.decode (key, rec)
+        self.remember (key, result, ttl)
         return result
+
+    def remember(self, key, value, ttl):
+        """ Keep a value, or a miss, in the memory tier.  Misses are kept for at most negative_ttl seconds. """
+        if value is None:
+            if not self.negative_ttl:
+                self.cache.discard (key)
+                return
+            ttl = min (ttl, self.negative_ttl) if ttl else self.negative_ttl
+        self.cache.put (key, value, entry_size (key, value), ttl)
+
+    def decode(self, key, rec):
+        """ Deserialize a record, treating one this process can't read as a miss. """
+        if rec is None:
+            return None
+        try:
+            return self.serializer.loads (rec)
+        except UnreadableRecord as e:
+            logger.warning (f"Treating {key} as a cache miss: {e}")
+            return None
+
+    def single_flight(self, key, compute):
+        """ Get an item, computing and caching it on a miss.  While one worker (process or thread) is
+        computing a key, it holds a short-lived redis lock on it, and any other worker that misses on the
+        same key waits for that result instead of computing it again.  If the lock holder dies, its lock
+        expires after lock_timeout seconds and a waiting worker takes over.  coalesced counts the misses
+        answered by another worker's result (hits) and those computed here (misses).  With the cache
+        disabled, it just computes. """
+        if not self.enabled:
+            return compute ()
+        value = self.get (key)
+        if value is not None:
+            return value
+        if not self.redis:
+            value = compute ()
+            self.set (key, value)
+            return value
+        lock = self.redis.lock (f"inflight:{key}", timeout=self.lock_timeout)
+        poll_interval = 0.05
+        while True:
+            if lock.acquire (blocking=False):
+                try:
+                    # Someone may have finished between our miss and getting the lock.
+                    value = self.load (key)
+                    if value is None:
+                        self.coalesced.count (misses=1)
+                        value = compute ()
+                        self.set (key, value)
+                    else:
+                        self.coalesced.count (hits=1)
+                    return value
+                finally:
+                    try:
+                        lock.release ()
+                    except LockError:
+                        logger.warning (f"Lock on {key} expired before {key} was computed.")
+            time.sleep (poll_interval)
+            poll_interval = min(poll_interval * 2, 1.0)
+            value = self.load (key)
+            if value is not None:
+                self.coalesced.count (hits=1)
+                return value
     
     def set(self, key, value):
         """ Add an item to the cache. """
-        if self.enabled:
+        if self.enabled and value is not None:
+            rec = self.serializer.dumps (value)
+            ttl = self.expiry.ttl (key)
             if self.redis:
-                if value is not None:
-                    self.redis.set (key, self.serializer.dumps (value))
-                    self.cache[key] = value
-            else:
-                path = os.path.join (self.cache_path, key)
-                with open(path, 'wb') as stream:
-                    stream.write (self.serializer.dumps (value))
-                self.cache[key] = value
+                self.redis.set (key, rec, ex=ttl)
+            if self.disk:
+                self.disk.put (key, rec)
+            self.remember (key, value, ttl)
+
+    def get_many(self, keys):
+        """ Get many cached items at once.  Keys not in the memory or disk tiers are fetched
+        from redis with a single MGET.  Returns a dict from key to value, or None if not cached. """
+        result = { key : None for key in keys }
+        if self.enabled:
+            recs = {}
+            for key in result:
+                found, value = self.cache.get (key)
+                if found:
+                    result[key] = value
+                else:
+                    recs[key] = self.disk.get (key, self.expiry.ttl (key)) if self.disk else None
+            missing = [ key for key, rec in recs.items () if rec is None ]
+            if missing and self.redis:
+                for key, rec in zip(missing, self.redis.mget (missing)):
+                    recs[key] = rec
+                    if rec is not None and self.disk:
+                        self.disk.put (key, rec)
+                hits = sum([ 1 for key in missing if recs[key] is not None ])
+                self.redis_stats.count (hits=hits, misses=len(missing)-hits)
+            for key, rec in recs.items ():
+                value = self.decode (key, rec)
+                self.remember (key, value, self.expiry.ttl (key))
+                result[key] = value
+        return result
+
+    def set_many(self, mapping):
+        """ Add many items to the cache, sending them to redis in one pipeline. """
+        if self.enabled:
+            pipeline = self.redis.pipeline (transaction=False) if self.redis else None
+            for key, value in mapping.items ():
+                if value is None:
+                    continue
+                rec = self.serializer.dumps (value)
+                ttl = self.expiry.ttl (key)
+                if pipeline:
+                    pipeline.set (key, rec, ex=ttl)
+                if self.disk:
+                    self.disk.put (key, rec)
+                self.remember (key, value, ttl)
+            if pipeline:
+                pipeline.execute ()
+
+    def bulk_set(self, groups, chunk_size=None, log_interval=30):
+        """ Load many items, e.g. to warm the cache after a redis rebuild.  groups is an iterable of
+        (keys, value) pairs: each value is serialized once and stored under all of its keys.  Entries are
+        streamed to redis (and the disk tier) in pipelines of chunk_size keys, bypassing the memory tier.
+        Throughput is logged every log_interval seconds.  Returns counts of keys and values written,
+        bytes sent and seconds taken. """
+        chunk_size = int(chunk_size or self.bulk_chunk_size)
+        totals = { 'keys' : 0, 'values' : 0, 'bytes' : 0, 'seconds' : 0 }
+        if not self.enabled:
+            return totals
+        start = last_log = time.time ()
+        pipeline = self.redis.pipeline (transaction=False) if self.redis else None
+        pending = 0
+        for keys, value in groups:
+            if value is None:
+                continue
+            rec = self.serializer.dumps (value)
+            totals['values'] += 1
+            for key in keys:
+                if pipeline:
+                    pipeline.set (key, rec, ex=self.expiry.ttl (key))
+                if self.disk:
+                    self.disk.put (key, rec)
+                self.cache.discard (key)
+                totals['keys'] += 1
+                totals['bytes'] += len(rec)
+                pending += 1
+                if pending >= chunk_size:
+                    if pipeline:
+                        pipeline.execute ()
+                    pending = 0
+            if time.time () - last_log >= log_interval:
+                last_log = time.time ()
+                self.log_throughput (totals, last_log - start)
+        if pipeline and pending:
+            pipeline.execute ()
+        totals['seconds'] = time.time () - start
+        self.log_throughput (totals, totals['seconds'])
+        return totals
+
+    def log_throughput(self, totals, seconds):
+        seconds = max (seconds, 1e-6)
+        logger.info (f"bulk_set: {totals['keys']} keys ({totals['values']} values) in {seconds:.1f}s; "
+                     f"{totals['keys']/seconds:.0f} keys/s, {totals['bytes']/seconds/1024/1024:.1f} MB/s")
+
+    def stats(self):
+        """ Hit, miss and eviction counts for each tier.  For redis, evictions and expirations
+        are the server's totals. """
+        result = { 'memory' : self.cache.dump () }
+        if self.disk:
+            result['disk'] = self.disk.dump ()
+        if self.redis:
+            result['redis'] = self.redis_stats.dump ()
+            result['redis']['coalesced'] = self.coalesced.hits
+            try:
+                info = self.redis.info ('stats')
+                result['redis']['evictions'] = info.get ('evicted_keys', 0)
+                result['redis']['expirations'] = info.get ('expired_keys', 0)
+            except Exception:
+                pass
+        return result
+
+    def log_stats(self):
+        for tier, counts in self.stats ().items ():
+            logger.info (f"cache {tier}: {counts}")
+
+    def reserialize(self, pattern='*', batch_size=1000):
+        """ Rewrite existing redis entries (e.g. legacy pickles) with this cache's serializer.
+        Entries the serializer already wrote are left alone.  Returns the number of entries rewritten. """
+        if not self.redis or not hasattr(self.serializer, 'is_native'):
+            return 0
+        rewritten = 0
+        keys = []
+        for key in self.redis.scan_iter (match=pattern, count=batch_size):
+            keys.append (key)
+            if len(keys) >= batch_size:
+                rewritten += self.reserialize_keys (keys)
+                keys = []
+        if keys:
+            rewritten += self.reserialize_keys (keys)
+        logger.info (f"Reserialized {rewritten} cache entries matching {pattern}")
+        return rewritten
+
+    def reserialize_keys(self, keys):
+        """ Rewrite a batch of entries, each keeping the time it had left to live. """
+        reads = self.redis.pipeline (transaction=False)
+        reads.mget (keys)
+        for key in keys:
+            reads.pttl (key)
+        recs, *ttls = reads.execute ()
+        pipeline = self.redis.pipeline (transaction=False)
+        rewritten = 0
+        for key, rec, ttl in zip(keys, recs, ttls):
+            # pttl is -2 for a key that has gone since the scan, -1 for one that never expires.
+            if rec is None or ttl == -2 or self.serializer.is_native (rec):
+                continue
+            try:
+                value = pickle.loads (rec)
+            except Exception:
+                logger.warning (f"Unable to read cache entry {key}. Leaving it as is.")
+                continue
+            pipeline.set (key, self.serializer.dumps (value), px=ttl if ttl > 0 else None)
+            rewritten += 1
+        pipeline.execute ()
+        return rewritten
 
     def flush(self):
+        self.cache.clear()
         self.redis.flushdb()
\ No newline at end of file
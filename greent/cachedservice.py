@@ -1,5 +1,4 @@
 import re
-import requests
 from greent.service import Service
 from greent.cache import Cache
 
@@ -13,6 +12,6 @@ class CachedService(Service):
         #print (f"==================> {url}")
         obj = self.context.cache.get(key)
         if not obj:
-            obj = requests.get(url).json ()
+            obj = self.http.get(url, service=self.name).json ()
             self.context.cache.set(key, obj)
         return obj
@@ -0,0 +1,96 @@
+import logging
+import os
+import sqlite3
+import threading
+from greent.cache import CompactCacheSerializer
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging(__name__, logging.INFO)
+
+class ConcordanceStore:
+    """ A local, on-disk index of equivalent identifiers: identifier -> equivalence set -> members (with labels).
+
+    Built by the crawler from the same equivalence sets it loads into the cache, and consulted by
+    the synonymizer before any network call.  The index is a SQLite file read through a memory map,
+    so lookups cost about as much as a dict access once the pages are warm, and many processes can
+    share it read-only.  Each equivalence set is stored once, encoded with the compact cache codec,
+    however many identifiers point at it.  Updates are incremental: identifiers in a new batch of
+    sets are repointed at them, and sets no longer referenced by any identifier are dropped. """
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS sets (set_id INTEGER PRIMARY KEY, members BLOB NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS ids (identifier TEXT PRIMARY KEY, set_id INTEGER NOT NULL) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS ids_set ON ids (set_id)"
+    ]
+    # SQLite limits the number of bound parameters in one statement.
+    QUERY_CHUNK = 500
+
+    def __init__(self, path, mmap_size=1024*1024*1024, serializer=None):
+        self.path = path
+        self.mmap_size = int(mmap_size)
+        self.serializer = serializer or CompactCacheSerializer ()
+        self.local = threading.local ()
+        with self.connection () as db:
+            for statement in self.SCHEMA:
+                db.execute (statement)
+
+    def connection (self):
+        """ This thread's connection to the index. """
+        db = getattr (self.local, "db", None)
+        if db is None:
+            directory = os.path.dirname (os.path.abspath (self.path))
+            os.makedirs (directory, exist_ok=True)
+            db = sqlite3.connect (self.path, timeout=60)
+            db.execute (f"PRAGMA mmap_size={self.mmap_size}")
+            db.execute ("PRAGMA journal_mode=WAL")
+            self.local.db = db
+        return db
+
+    def get (self, identifier):
+        """ The equivalence set containing identifier, or None if it isn't in the index. """
+        return self.get_many ([identifier])[identifier]
+
+    def get_many (self, identifiers):
+        """ Map each identifier to its equivalence set, or None.  Each distinct set is decoded once. """
+        result = { identifier : None for identifier in identifiers }
+        keys = list(result)
+        db = self.connection ()
+        decoded = {}
+        for start in range (0, len(keys), self.QUERY_CHUNK):
+            chunk = keys[start:start+self.QUERY_CHUNK]
+            rows = db.execute (
+                "SELECT ids.identifier, sets.set_id, sets.members FROM ids JOIN sets ON ids.set_id = sets.set_id "
+                f"WHERE ids.identifier IN ({','.join('?' * len(chunk))})", chunk)
+            for identifier, set_id, members in rows:
+                if set_id not in decoded:
+                    decoded[set_id] = self.serializer.loads (members)
+                result[identifier] = decoded[set_id]
+        return result
+
+    def update (self, concord, batch_size=10000):
+        """ Add the equivalence sets in concord, a map from identifier to its equivalence set (as built by
+        crawler.crawl_util.glom, where all members of a set share one set object).  Returns the number of
+        identifiers written. """
+        db = self.connection ()
+        set_ids = {}
+        id_rows = []
+        written = 0
+        with db:
+            for identifier, members in concord.items ():
+                key = id(members)
+                if key not in set_ids:
+                    cursor = db.execute ("INSERT INTO sets (members) VALUES (?)", (self.serializer.dumps (members),))
+                    set_ids[key] = cursor.lastrowid
+                id_rows.append ((identifier, set_ids[key]))
+                if len(id_rows) >= batch_size:
+                    db.executemany ("INSERT OR REPLACE INTO ids (identifier, set_id) VALUES (?, ?)", id_rows)
+                    written += len(id_rows)
+                    id_rows = []
+            db.executemany ("INSERT OR REPLACE INTO ids (identifier, set_id) VALUES (?, ?)", id_rows)
+            written += len(id_rows)
+            db.execute ("DELETE FROM sets WHERE set_id NOT IN (SELECT set_id FROM ids)")
+        logger.info (f"Indexed {written} identifiers in {len(set_ids)} equivalence sets")
+        return written
+
+    def count (self):
+        return self.connection ().execute ("SELECT COUNT(*) FROM ids").fetchone ()[0]
@@ -1,9 +1,25 @@
 from greent import node_types
 from greent.util import LoggingUtil,Text
-from neo4j.v1 import GraphDatabase
+from greent.cache import CompactCacheSerializer
+from greent.fingerprints import fingerprint_set, node_fingerprint, edge_fingerprint, shard_for
+from greent.graph_components import KNode, KEdge, LabeledID
+from neo4j.v1 import GraphDatabase, TransientError
+from pika.exceptions import NackError, UnroutableError
 from collections import defaultdict, deque
+from lru import LRU
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import bisect
 import calendar
+import csv
+import json
 import logging
+import os
+import pika
+import random
+import re
+import threading
+import time
 from datetime import datetime
 from neo4j.util import watch
 from sys import stdout
@@ -12,9 +28,137 @@ from sys import stdout
 
 logger = LoggingUtil.init_logging(__name__, logging.DEBUG)
 
+class LabelQueue:
+    """Queued nodes or edges of one label, and the limits that decide when they are written.
+    A queue is due once it holds batch_size elements or its oldest element has waited max_latency seconds.
+    If target_seconds is set, batch_size is tuned after each full batch so that a transaction takes about
+    that long, within [min_batch_size, max_batch_size]."""
+
+    def __init__(self, batch_size=100, min_batch_size=10, max_batch_size=5000, max_latency=5, target_seconds=0):
+        self.min_batch_size = int(min_batch_size)
+        self.max_batch_size = int(max_batch_size)
+        self.batch_size = min(max(int(batch_size), self.min_batch_size), self.max_batch_size)
+        self.max_latency = float(max_latency)
+        self.target_seconds = float(target_seconds)
+        self.items = []
+        self.since = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def append(self, item):
+        if not self.items:
+            self.since = time.time()
+        self.items.append(item)
+
+    def full(self):
+        return len(self.items) >= self.batch_size
+
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        return self.full() or (len(self.items) > 0 and now - self.since >= self.max_latency)
+
+    def take(self):
+        """Remove and return the next batch."""
+        batch, self.items = self.items[:self.batch_size], self.items[self.batch_size:]
+        self.since = time.time() if self.items else None
+        return batch
+
+    def put_back(self, batch):
+        """Return a batch that couldn't be written to the front of the queue."""
+        if not self.items:
+            self.since = time.time()
+        self.items[:0] = batch
+
+    def tune(self, size, seconds):
+        """Move batch_size halfway towards the size that would have taken target_seconds.
+        Only full batches are used: the fixed cost of a transaction makes small batches look slow."""
+        if self.target_seconds <= 0 or size < self.batch_size or seconds <= 0:
+            return
+        ideal = size * self.target_seconds / seconds
+        self.batch_size = int(min(max((self.batch_size + ideal) / 2, self.min_batch_size), self.max_batch_size))
+
+class LabelStats:
+    """Batch counts, sizes and latencies for one node or edge label."""
+    # Upper bounds, in milliseconds, of the latency histogram buckets.
+    BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+
+    def __init__(self):
+        self.batches = 0
+        self.rows = 0
+        self.created = 0
+        self.unmatched = 0
+        self.counted_rows = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.histogram = [0] * len(self.BUCKETS)
+
+    def record(self, rows, seconds, created=None, unmatched=0):
+        self.batches += 1
+        self.rows += rows
+        self.unmatched += unmatched
+        if created is not None:
+            self.created += created
+            self.counted_rows += rows - unmatched
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.histogram[bisect.bisect_left(self.BUCKETS, 1000 * seconds)] += 1
+
+    def as_dict(self):
+        return {
+            'batches': self.batches,
+            'rows': self.rows,
+            'mean_batch': round(self.rows / self.batches, 1) if self.batches else 0,
+            'created': self.created,
+            'matched': self.counted_rows - self.created,
+            'unmatched': self.unmatched,
+            'rows_per_s': round(self.rows / self.total_seconds) if self.total_seconds else 0,
+            'mean_ms': round(1000 * self.total_seconds / self.batches, 1) if self.batches else 0,
+            'max_ms': round(1000 * self.max_seconds, 1),
+            'latency_ms': {f'<={bound:g}': n for bound, n in zip(self.BUCKETS, self.histogram) if n}
+        }
+
+class WriteStats:
+    """Per-label write statistics for a BufferedWriter.  Created counts come from neo4j's result counters,
+    so matched is the number of rows that MERGEd something already in the graph.  Unmatched counts the
+    edges that weren't written at all because an endpoint wasn't in the graph."""
+
+    def __init__(self, config=None):
+        config = {} if config is None else config
+        self.log_interval = float(config.get('log_interval', 60))
+        self.slow_batch = float(config.get('slow_batch', 10))
+        self.labels = {'nodes': defaultdict(LabelStats), 'edges': defaultdict(LabelStats)}
+        self.lock = threading.Lock()
+        self.next_log = time.time() + self.log_interval
+
+    def record(self, export, label, rows, seconds, created=None, unmatched=0):
+        kind = 'edges' if export is export_edge_chunk else 'nodes'
+        with self.lock:
+            self.labels[kind][label].record(rows, seconds, created, unmatched)
+        if seconds >= self.slow_batch:
+            logger.warning(f"Slow write: {rows} {label} {kind} took {seconds:.1f}s")
+
+    def as_dict(self):
+        with self.lock:
+            return {kind: {label: stats.as_dict() for label, stats in labels.items()}
+                    for kind, labels in self.labels.items()}
+
+    def due(self):
+        return self.log_interval > 0 and time.time() >= self.next_log
+
+    def log(self, depths=None):
+        self.next_log = time.time() + self.log_interval
+        for kind, labels in sorted(self.as_dict().items()):
+            # Busiest labels first.
+            for label, stats in sorted(labels.items(), key=lambda item: -item[1]['rows']):
+                logger.info(f"write {kind} {label}: {stats}")
+        if depths:
+            logger.info(f"write queue depths: {depths}")
+
 class BufferedWriter:
     """Buffered writer accepts individual nodes and edges to write to neo4j.
-    It doesn't write the node/edge if it has already been written in its lifetime (it maintains a record)
+    It doesn't write the node/edge if it has already been written in its lifetime (it keeps fixed-size
+    fingerprints of what it has written, in a bounded LRU or Bloom filter configured under writer.dedup)
     It then accumulates nodes/edges by label/type until a buffersize has been reached, at which point it does
     an intelligent update/write to the batch of nodes and edges.
     
@@ -24,76 +168,642 @@ class BufferedWriter:
         ...
 
     Doing this as a context manager will make sure that the different queues all get flushed out.
+    A long-lived writer (e.g. one per Program) should call close() when it is done.
+
+    Each label has its own LabelQueue, written when it fills up or its oldest element has waited too long,
+    with its batch size tuned from observed transaction times.  Limits come from the writer section of
+    greent.conf, with per-label overrides.  With flush_thread set, a background thread writes queues that
+    have waited too long even when nothing new arrives.  Queued nodes are always written before any
+    queued edges, so an edge is never written before its endpoints.
+
+    With workers > 1, a flush writes the node labels concurrently, each in its own session from the
+    driver's pool, and then the edge labels the same way.  Transactions that fail transiently (e.g. edges
+    of two labels deadlocking on a shared node) are retried with backoff.
+
+    Each batch's size, latency and the number of nodes or relationships it created (the rest were matched,
+    i.e. re-MERGEs) are counted per label, and logged with the queue depths every writer.stats.log_interval
+    seconds and on close.  Batches slower than slow_batch seconds are logged as they happen.
+
+    The neo4j internal ids returned by node MERGEs are kept in a bounded LRU (writer.node_id_cache), so
+    edges between recently written nodes bind their endpoints by id rather than through the id index.
     """
 
-    def __init__(self,rosetta):
+    LIMITS = ('batch_size', 'min_batch_size', 'max_batch_size', 'max_latency', 'target_seconds')
+
+    def __init__(self,rosetta,flush_thread=None):
         self.rosetta = rosetta
-        self.written_nodes = set()
-        self.written_edges = defaultdict(lambda: defaultdict( set ) )
-        self.node_queues = defaultdict(list)
-        self.edge_queues = defaultdict(list)
-        self.node_buffer_size = 100
-        self.edge_buffer_size = 100
+        self.config = rosetta.service_context.config.get('writer', {})
+        self.written_nodes = fingerprint_set(self.config.get('dedup'))
+        self.written_edges = fingerprint_set(self.config.get('dedup'))
+        self.node_queues = {}
+        self.edge_queues = {}
+        self.lock = threading.RLock()
         self.driver = self.rosetta.type_graph.driver
+        workers = int(self.config.get('workers', 1))
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.retries = int(self.config.get('retries', 5))
+        # Neo4j internal ids of recently written nodes, so edges can bind their endpoints without an index lookup.
+        node_id_cache = int(self.config.get('node_id_cache', 1000000))
+        self.node_ids = LRU(node_id_cache) if node_id_cache > 0 else None
+        self.stats = WriteStats(self.config.get('stats'))
+        self.collect_unmatched = False
+        self.unmatched = []
+        self.unmatched_lock = threading.Lock()
+        self.tick = min(max(float(self.config.get('max_latency', 5)) / 4, 0.1), 1.0)
+        self.next_check = time.time() + self.tick
+        self.stopped = threading.Event()
+        self.failure = None
+        self.flusher = None
+        if flush_thread is None:
+            flush_thread = str(self.config.get('flush_thread', False)).lower() == 'true'
+        if flush_thread:
+            self.flusher = threading.Thread(target=self.run_flusher, name='BufferedWriter flusher', daemon=True)
+            self.flusher.start()
 
     def __enter__(self):
         return self
 
+    def queue(self, queues, label):
+        if label not in queues:
+            label_config = self.config.get('labels', {}).get(label) or {}
+            limits = {k: label_config.get(k, self.config.get(k)) for k in self.LIMITS}
+            queues[label] = LabelQueue(**{k: v for k, v in limits.items() if v is not None})
+        return queues[label]
+
     def write_node(self,node):
-        if node.id in self.written_nodes:
-            return
+        with self.lock:
+            typednodes = self.queue_node(node)
+            if typednodes is not None and (typednodes.full() or time.time() >= self.next_check):
+                self.flush_due()
+
+    def write_edge(self,edge):
+        with self.lock:
+            typed_edges = self.queue_edge(edge)
+            if typed_edges is not None and (typed_edges.full() or time.time() >= self.next_check):
+                self.flush_due()
+
+    def write_many(self, nodes, edges, dedup=True):
+        """Queue a batch of nodes and then a batch of edges (e.g. one writer message), checking
+        for queues to write once at the end rather than after every element.  With dedup False,
+        elements are queued even if they have been written before."""
+        with self.lock:
+            queued = [self.queue_node(node, dedup) for node in nodes] + [self.queue_edge(edge, dedup) for edge in edges]
+            if any(queue is not None and queue.full() for queue in queued) or time.time() >= self.next_check:
+                self.flush_due()
+
+    def queue_node(self, node, dedup=True):
+        """Add node to its label's queue, returning the queue, or None if it has already been written."""
+        if not self.written_nodes.add(node_fingerprint(node)) and dedup:
+            return None
         if node.name is None or node.name == '':
             logger.error(f"Node {node.id} is missing a label")
-        self.written_nodes.add(node.id)
-        typednodes = self.node_queues[node.type]
+        typednodes = self.queue(self.node_queues, node.type)
         typednodes.append(node)
-        if len(typednodes) >= self.node_buffer_size:
-            self.flush()
+        return typednodes
 
-    def write_edge(self,edge):
-        if edge in self.written_edges[edge.source_id][edge.target_id]:
-            return
-        self.written_edges[edge.source_id][edge.target_id].add(edge)
-        label = Text.snakify(edge.standard_predicate.label)
-        typed_edges = self.edge_queues[label]
+    def queue_edge(self, edge, dedup=True):
+        """Add edge to its label's queue, returning the queue, or None if it has already been written."""
+        if not self.written_edges.add(edge_fingerprint(edge)) and dedup:
+            return None
+        typed_edges = self.queue(self.edge_queues, Text.snakify(edge.standard_predicate.label))
         typed_edges.append(edge)
-        if len(typed_edges) >= self.edge_buffer_size:
-            self.flush()
+        return typed_edges
+
+    def flush_due(self):
+        """Write the queues that are full or have waited too long."""
+        with self.lock:
+            now = time.time()
+            self.next_check = now + self.tick
+            nodes = [label for label, queue in self.node_queues.items() if queue.due(now)]
+            edges = [label for label, queue in self.edge_queues.items() if queue.due(now)]
+            if edges:
+                # The endpoints of these edges may still be queued.
+                nodes = list(self.node_queues)
+            self.write(nodes, edges)
+            self.log_stats()
 
     def flush(self):
+        """Write everything that is queued.  If a background flush failed since the last flush, its batch
+        is written again here, and the failure is raised once the rest has been written."""
+        with self.lock:
+            failure, self.failure = self.failure, None
+            self.write(list(self.node_queues), list(self.edge_queues))
+            if failure is not None:
+                raise failure
+
+    def write(self, node_labels, edge_labels):
+        """Empty the given node queues, then the given edge queues, a batch per transaction.
+        Each label's batches are written in order; with a pool, different labels are written at once."""
+        node_labels = [label for label in node_labels if len(self.node_queues[label]) > 0]
+        edge_labels = [label for label in edge_labels if len(self.edge_queues[label]) > 0]
+        if not node_labels and not edge_labels:
+            return
+        if self.pool is None:
+            with self.driver.session() as session:
+                for label in node_labels:
+                    self.write_queue(session, self.node_queues[label], label, export_node_chunk)
+                for label in edge_labels:
+                    self.write_queue(session, self.edge_queues[label], label, export_edge_chunk)
+            return
+        # Every node batch finishes before any edge batch starts.
+        for queues, labels, export in ((self.node_queues, node_labels, export_node_chunk),
+                                       (self.edge_queues, edge_labels, export_edge_chunk)):
+            futures = [self.pool.submit(self.write_label, queues[label], label, export) for label in labels]
+            for future in futures:
+                future.result()
+
+    def write_label(self, queue, label, export):
         with self.driver.session() as session:
-            for node_type in self.node_queues:
-                session.write_transaction(export_node_chunk,self.node_queues[node_type],node_type)
-                self.node_queues[node_type] = []
-            for edge_label in self.edge_queues:
-                session.write_transaction(export_edge_chunk,self.edge_queues[edge_label],edge_label)
-                self.edge_queues[edge_label] = []
+            self.write_queue(session, queue, label, export)
+
+    def write_queue(self, session, queue, label, export):
+        while len(queue) > 0:
+            batch = queue.take()
+            start = time.time()
+            counts = {}
+            try:
+                unmatched = self.write_batch(session, export, batch, label, counts)
+            except Exception:
+                # Its elements are already fingerprinted as written, so they could never be queued again.
+                queue.put_back(batch)
+                raise
+            seconds = time.time() - start
+            queue.tune(len(batch), seconds)
+            self.stats.record(export, label, len(batch), seconds, counts.get('created'), len(unmatched or []))
+            if unmatched:
+                self.missing_endpoints(unmatched)
+
+    def missing_endpoints(self, edges):
+        """Edges that weren't written because an endpoint isn't in the graph yet.  A WriterConsumer
+        collects them to retry; otherwise the endpoint was never sent, and they are just logged."""
+        if self.collect_unmatched:
+            with self.unmatched_lock:
+                self.unmatched.extend(edges)
+        else:
+            logger.warning(f"{len(edges)} edges have a missing endpoint, e.g. {edges[0]}")
+
+    def forget_edges(self, edges):
+        """Forget that edges were written (e.g. they were dropped), so a later copy is written."""
+        for edge in edges:
+            self.written_edges.discard(edge_fingerprint(edge))
+
+    def take_unmatched(self):
+        with self.unmatched_lock:
+            unmatched, self.unmatched = self.unmatched, []
+        return unmatched
+
+    def write_batch(self, session, export, batch, label, counts=None):
+        """Run one export transaction, retrying transient failures such as deadlocks with jittered backoff.
+        The export adds the number of nodes or relationships it created to counts.
+        The transaction is begun explicitly: session.write_transaction has its own retry loop (for up to the
+        driver's max_retry_time), which would run inside each of these attempts."""
+        for attempt in range(self.retries + 1):
+            if counts is not None:
+                counts.clear()
+            try:
+                with session.begin_transaction() as tx:
+                    return export(tx, batch, label, self.node_ids, counts)
+            except TransientError as e:
+                if attempt == self.retries:
+                    raise
+                wait = random.uniform(0, min(5.0, 0.1 * 2 ** attempt))
+                logger.warning(f"Transient error writing {len(batch)} {label}; retrying in {wait:.2f}s: {e}")
+                time.sleep(wait)
+
+    def run_flusher(self):
+        while not self.stopped.wait(self.tick):
+            try:
+                self.flush_due()
+            except Exception as e:
+                logger.error(f"Background flush failed: {e}")
+                # Raised by the next flush() or close().
+                with self.lock:
+                    self.failure = e
+
+    def queue_depths(self):
+        with self.lock:
+            return {'nodes': {label: len(queue) for label, queue in self.node_queues.items() if len(queue)},
+                    'edges': {label: len(queue) for label, queue in self.edge_queues.items() if len(queue)}}
+
+    def log_stats(self, force=False):
+        """Log the write statistics, at most every writer.stats.log_interval seconds unless forced."""
+        if self.stats.due() or force:
+            self.stats.log(self.queue_depths())
+
+    def close(self):
+        """Stop the background flusher, if any, and write everything that is queued."""
+        self.stopped.set()
+        if self.flusher is not None:
+            self.flusher.join()
+        try:
+            self.flush()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.log_stats(force=True)
 
     def __exit__(self,*args):
-        self.flush()
+        self.close()
         #Doesn't own the driver
         #self.driver.close()
 
+class CSVWriter:
+    """Writes nodes and edges as CSV files for an offline `neo4j-admin import`, for full rebuilds where
+    MERGEing through BufferedWriter would be far too slow.  It takes the same calls as BufferedWriter
+    (write_node, write_edge, flush, close, or use it as a context manager) and writes the same properties.
+
+    There is one file per node type (nodes_<type>.csv) and one per edge label (edges_<label>.csv) under
+    path, each with a neo4j-admin header.  Ids already written are skipped, using the same bounded
+    fingerprint sets as BufferedWriter.  Files are appended to, so several runs (or a run followed by a
+    replay of the writer's message log, see replay_messages) can build up one import; duplicates across
+    runs are dropped at import time by the flags in import_command.
+    """
+
+    NODE_HEADER = ['id:ID', 'name', 'equivalent_identifiers:string[]', ':LABEL']
+    EDGE_HEADER = [':START_ID', ':END_ID', ':TYPE', 'edge_source', 'relation_label', 'source_database',
+                   'ctime:double', 'predicate_id', 'relation', 'publications:string[]']
+    ARRAY_DELIMITER = ';'
+
+    def __init__(self, path, dedup_config=None):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        self.written_nodes = fingerprint_set(dedup_config)
+        self.written_edges = fingerprint_set(dedup_config)
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def csv_file(self, kind, label, header):
+        """The csv writer for a node type or edge label, opened (with a header if new) on first use."""
+        name = f"{kind}_{re.sub('[^A-Za-z0-9_]', '_', label)}.csv"
+        if name not in self.files:
+            file_name = os.path.join(self.path, name)
+            new = not os.path.exists(file_name) or os.path.getsize(file_name) == 0
+            handle = open(file_name, 'a', newline='')
+            writer = csv.writer(handle)
+            if new:
+                writer.writerow(header)
+            self.files[name] = (handle, writer)
+        return self.files[name][1]
+
+    def array(self, values):
+        return self.ARRAY_DELIMITER.join(str(v).replace(self.ARRAY_DELIMITER, ',') for v in values)
+
+    def write_node(self, node):
+        with self.lock:
+            if not self.written_nodes.add(node_fingerprint(node)):
+                return
+            labels = self.ARRAY_DELIMITER.join([node_types.ROOT_ENTITY, node.type])
+            self.csv_file('nodes', node.type, self.NODE_HEADER).writerow(
+                [node.id, node.name, self.array(s.identifier for s in node.synonyms), labels])
+
+    def write_edge(self, edge):
+        with self.lock:
+            if not self.written_edges.add(edge_fingerprint(edge)):
+                return
+            label = Text.snakify(edge.standard_predicate.label)
+            self.csv_file('edges', label, self.EDGE_HEADER).writerow(
+                [edge.source_id, edge.target_id, label, edge.provided_by, edge.original_predicate.label,
+                 edge.provided_by.split('.')[0], edge.ctime, edge.standard_predicate.identifier,
+                 edge.original_predicate.identifier, self.array(edge.publications[:1000])])
+
+    def flush(self):
+        with self.lock:
+            for handle, writer in self.files.values():
+                handle.flush()
+
+    def close(self):
+        with self.lock:
+            for handle, writer in self.files.values():
+                handle.close()
+            self.files = {}
+
+    def __exit__(self, *args):
+        self.close()
+
+    def import_command(self, database='graph.db'):
+        """The neo4j-admin command that loads the files written so far into a new database."""
+        files = sorted(f for f in os.listdir(self.path) if f.endswith('.csv'))
+        args = ['neo4j-admin', 'import', f'--database={database}', f"--array-delimiter={self.ARRAY_DELIMITER}",
+                '--ignore-duplicate-nodes=true', '--ignore-missing-nodes=true']
+        args += [f"--nodes={os.path.join(self.path, f)}" for f in files if f.startswith('nodes_')]
+        args += [f"--relationships={os.path.join(self.path, f)}" for f in files if f.startswith('edges_')]
+        return ' '.join(args)
+
+def create_writer(rosetta):
+    """The direct-mode writer configured by writer.mode: neo4j (a BufferedWriter) or csv (a CSVWriter at writer.csv.path)."""
+    writer_config = rosetta.service_context.config.get('writer', {})
+    if writer_config.get('mode', 'neo4j') == 'csv':
+        return CSVWriter(writer_config.get('csv', {}).get('path', 'import'), writer_config.get('dedup'))
+    return BufferedWriter(rosetta)
+
+def writer_queues(shards=1):
+    """The writer service's queues, one per shard."""
+    return [f'neo4j.{shard}' for shard in range(int(shards))]
+
+class MessageBatch:
+    """The elements waiting to be sent to one writer queue."""
+    def __init__(self):
+        self.nodes = []
+        self.edges = []
+        self.oldest = None
+
+    def __len__(self):
+        return len(self.nodes) + len(self.edges)
+
+def publish(channel, queue, body, properties, retries=5):
+    """Publish a message, resending it up to retries times if a channel in confirm mode reports it wasn't
+    delivered.  Raises if it never is."""
+    for attempt in range(retries + 1):
+        # Without confirms basic_publish returns None.  With them, pika 0.x returns False for a nack
+        # and pika 1.x raises.
+        try:
+            if channel.basic_publish(exchange='', routing_key=queue, body=body, properties=properties) is not False:
+                return
+        except (NackError, UnroutableError) as e:
+            logger.debug(f"Publish to {queue} failed: {e!r}")
+        logger.warning(f"Broker did not confirm a {len(body)} byte message to {queue} (attempt {attempt + 1})")
+    raise RuntimeError(f"Broker did not confirm a message to {queue} after {retries + 1} attempts")
+
+class MessagePublisher:
+    """Sends nodes and edges to the writer service over its RabbitMQ queues, in batched, compressed messages.
+    It takes the same calls as BufferedWriter, so Program writes through either one.
+
+    The writer service runs one consumer per shard queue (see writer_queues).  A node goes to the shard that
+    owns its id (fingerprints.shard_for), so each node is only ever MERGEd by one consumer, and an edge goes
+    to the shard of its source.  For each queue, elements are accumulated, in order, into a message of up to
+    batch_size elements, which is sent once it is full or its oldest element is max_latency seconds old
+    (checked as elements arrive: the blocking pika connection can't be used from a background thread).
+    Messages are encoded with the compact cache codec and compressed (zlib unless configured otherwise).
+    With confirm set, the channel is put in publisher confirm mode and a message the broker doesn't
+    acknowledge is resent, up to retries times.  close() sends what is left followed by a flush message to
+    each queue.
+    """
+
+    def __init__(self, channel, config=None, queues=None):
+        config = {} if config is None else config
+        self.channel = channel
+        self.queues = writer_queues() if queues is None else queues
+        self.batch_size = int(config.get('batch_size', 1000))
+        self.max_latency = float(config.get('max_latency', 0.2))
+        self.retries = int(config.get('retries', 5))
+        self.serializer = CompactCacheSerializer(compression=config.get('compression', 'zlib'), compression_threshold=0)
+        self.confirm = str(config.get('confirm', True)).lower() == 'true'
+        if self.confirm:
+            self.channel.confirm_delivery()
+        self.batches = {queue: MessageBatch() for queue in self.queues}
+        self.lock = threading.Lock()
+        self.sent_messages = 0
+        self.sent_elements = 0
+        self.sent_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def queue_for(self, identifier):
+        return self.queues[shard_for(identifier, len(self.queues))]
+
+    def write_node(self, node):
+        with self.lock:
+            queue = self.queue_for(node.id)
+            self.batches[queue].nodes.append(node)
+            self.added(queue)
+
+    def write_edge(self, edge):
+        with self.lock:
+            queue = self.queue_for(edge.source_id)
+            self.batches[queue].edges.append(edge)
+            self.added(queue)
+
+    def added(self, queue):
+        batch = self.batches[queue]
+        now = time.time()
+        if batch.oldest is None:
+            batch.oldest = now
+        if len(batch) >= self.batch_size:
+            self.send(queue)
+        for queue, batch in self.batches.items():
+            if batch.oldest is not None and now - batch.oldest >= self.max_latency:
+                self.send(queue)
+
+    def flush(self):
+        with self.lock:
+            for queue in self.queues:
+                self.send(queue)
+
+    def send(self, queue):
+        """Publish the elements accumulated for queue as one message.  Nodes come first, so the consumer
+        queues each edge after any endpoints sent with it."""
+        batch = self.batches[queue]
+        if len(batch) == 0:
+            return
+        body = encode_message(batch.nodes, batch.edges, self.serializer)
+        self.publish(queue, body)
+        self.sent_messages += 1
+        self.sent_elements += len(batch)
+        self.sent_bytes += len(body)
+        self.batches[queue] = MessageBatch()
+
+    def publish(self, queue, body):
+        publish(self.channel, queue, body, pika.BasicProperties(delivery_mode=2), self.retries)
+
+    def close(self):
+        """Send everything that is left, then tell each writer to flush."""
+        with self.lock:
+            for queue in self.queues:
+                self.send(queue)
+                self.publish(queue, 'flush')
+        if self.sent_messages:
+            logger.info(f"Sent {self.sent_elements} graph elements in {self.sent_messages} messages "
+                        f"({self.sent_bytes / self.sent_messages:.0f} bytes per message)")
+
+    def __exit__(self, *args):
+        self.close()
+
+class WriterConsumer:
+    """Consumes one writer queue into a BufferedWriter, acknowledging messages only once everything in them
+    is in neo4j, so that if a consumer dies its unacknowledged messages are redelivered to another.
+
+    At most prefetch messages are delivered unacknowledged.  When that many are pending, when a flush
+    message arrives, or when the queue has been idle for idle_flush seconds, the writer is flushed and the
+    pending messages are acknowledged together.
+
+    An edge is only written once both its endpoints are in the graph, i.e. once the messages that carried
+    them have been acknowledged by their shards' consumers (export_edge_chunk MATCHes the endpoints, and
+    reports edges where either is missing).  Such edges are sent back through a retry queue that holds
+    them for retry_delay seconds, up to edge_retries times, before they are logged and dropped (and
+    forgotten by the writer, so a later copy is written).  Retries are published with confirms, resent
+    up to retries times, before the messages that carried the edges are acknowledged.
+
+    If a write or a retry fails, commit raises without acknowledging anything, so the pending messages
+    are redelivered once the consumer exits.  A message that can't be decoded (truncated, say, or compressed
+    with a codec that isn't installed here) would fail the same way wherever it was redelivered, so it is
+    logged and rejected without being requeued.  The writer should not have its own background flusher
+    (builder/writer.py turns it off): the consumer decides when to write.
+
+    If message_log is given, every message consumed is also written to it, a line each (see log_message).
+    """
+
+    def __init__(self, channel, queue, writer, config=None, message_log=None):
+        config = {} if config is None else config
+        self.channel = channel
+        self.queue = queue
+        self.writer = writer
+        self.message_log = message_log
+        self.writer.collect_unmatched = True
+        self.prefetch = int(config.get('prefetch', 20))
+        self.idle_flush = float(config.get('idle_flush', 1))
+        self.edge_retries = int(config.get('edge_retries', 10))
+        self.retries = int(config.get('retries', 5))
+        self.retry_queue = f'{queue}.retry'
+        self.pending = []
+        self.attempts = {}
+        self.channel.queue_declare(queue=self.queue, durable=True)
+        # Messages wait out their ttl in the retry queue, then are dead-lettered back onto the queue.
+        self.channel.queue_declare(queue=self.retry_queue, durable=True, arguments={
+            'x-message-ttl': int(float(config.get('retry_delay', 5)) * 1000),
+            'x-dead-letter-exchange': '',
+            'x-dead-letter-routing-key': self.queue})
+        self.channel.basic_qos(prefetch_count=self.prefetch)
+        self.channel.confirm_delivery()
+
+    def run(self):
+        for method, properties, body in self.channel.consume(self.queue, inactivity_timeout=self.idle_flush):
+            if method is None:
+                self.commit()
+            else:
+                self.handle(method, properties, body)
+
+    def handle(self, method, properties, body):
+        if self.message_log is not None:
+            self.message_log.write(log_message(body) + '\n')
+        if body == b'flush':
+            self.pending.append(method.delivery_tag)
+            self.commit()
+            return
+        try:
+            nodes, edges = message_elements(body)
+        except Exception as e:
+            # Decoding depends only on the body, so every consumer would fail on it again: reject it for good.
+            logger.error(f"Rejecting a message that can't be decoded ({e!r}): {log_message(body)}")
+            self.channel.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+            return
+        self.pending.append(method.delivery_tag)
+        attempt = int(((properties.headers if properties else None) or {}).get('attempts', 0))
+        if attempt:
+            # Retried edges were seen (and remembered) the first time round.
+            for edge in edges:
+                self.attempts[edge_fingerprint(edge)] = attempt
+        self.writer.write_many(nodes, edges, dedup=attempt == 0)
+        if len(self.pending) >= self.prefetch:
+            self.commit()
+
+    def commit(self):
+        """Write everything the pending messages carried, then acknowledge them.  Raises, acknowledging
+        nothing, if anything written since the last commit failed."""
+        if not self.pending:
+            return
+        self.writer.flush()
+        self.retry(self.writer.take_unmatched())
+        self.channel.basic_ack(delivery_tag=self.pending[-1], multiple=True)
+        self.pending = []
+        self.attempts = {}
+
+    def retry(self, edges):
+        by_attempt = defaultdict(list)
+        for edge in edges:
+            by_attempt[self.attempts.get(edge_fingerprint(edge), 0) + 1].append(edge)
+        for attempt, retries in by_attempt.items():
+            if attempt > self.edge_retries:
+                logger.error(f"Dropping {len(retries)} edges whose endpoints never appeared, e.g. {retries[0]}")
+                self.writer.forget_edges(retries)
+                continue
+            publish(self.channel, self.retry_queue, encode_message([], retries),
+                    pika.BasicProperties(headers={'attempts': attempt}, delivery_mode=2), self.retries)
+
+message_serializer = CompactCacheSerializer()
+
+def encode_message(nodes, edges, serializer=message_serializer):
+    """A writer queue message holding nodes and edges, encoded with the compact cache codec."""
+    return serializer.dumps((nodes, edges))
+
+def message_elements(body):
+    """The nodes and edges in one writer queue message: a compact-codec record from MessagePublisher, or
+    a JSON body as Program used to send (in which node synonyms are restored, since KNode's constructor
+    starts them over from the id)."""
+    if isinstance(body, bytes) and message_serializer.is_native(body):
+        return message_serializer.loads(body)
+    if isinstance(body, bytes):
+        body = body.decode()
+    graph = json.loads(body)
+    nodes = []
+    for data in graph['nodes']:
+        node = KNode(data)
+        node.add_synonyms(LabeledID(s) if isinstance(s, dict) else s for s in data.get('synonyms', []))
+        nodes.append(node)
+    return nodes, [KEdge(data) for data in graph['edges']]
+
+def log_message(body):
+    """One line of a message log: a JSON body as is, a binary message (or one that isn't text) in base64."""
+    if isinstance(body, bytes) and message_serializer.is_native(body):
+        return base64.b64encode(body).decode()
+    if isinstance(body, bytes):
+        try:
+            body = body.decode()
+        except UnicodeDecodeError:
+            return base64.b64encode(body).decode()
+    return body.replace('\n', ' ')
+
+def replay_messages(messages, writer):
+    """Write the graph elements in a sequence of writer queue messages, e.g. the lines of a message log."""
+    for body in messages:
+        body = body.strip()
+        if not body or body == 'flush':
+            continue
+        nodes, edges = message_elements(body if body.startswith('{') else base64.b64decode(body))
+        for node in nodes:
+            writer.write_node(node)
+        for edge in edges:
+            writer.write_edge(edge)
+
 def sort_edges_by_label(edges):
     el = defaultdict(list)
     deque( map( lambda x: el[Text.snakify(x[2]['object'].standard_predicate.label)].append(x), edges ) )
     return el
 
-def export_edge_chunk(tx,edgelist,edgelabel):
+def export_edge_chunk(tx,edgelist,edgelabel,node_ids=None,counts=None):
     """The approach of updating edges will be to erase an old one and replace it in whole.   There's no real
     reason to worry about preserving information from an old edge.
-    What defines the edge are the identifiers of its nodes, and the source.function that created it."""
-    cypher = f"""UNWIND $batches as row
-            MATCH (a:{node_types.ROOT_ENTITY} {{id: row.source_id}}),(b:{node_types.ROOT_ENTITY} {{id: row.target_id}})
-            MERGE (a)-[r:{edgelabel} {{edge_source: row.provided_by, relation_label: row.original_predicate_label}}]-(b)
+    What defines the edge are the identifiers of its nodes, and the source.function that created it.
+
+    Endpoints whose neo4j internal ids are in node_ids (curie -> id, filled in by export_node_chunk) are
+    bound by id, which skips the index lookups.  Internal ids can be reused once a node is deleted, so the
+    curie is checked as well, and rows that don't bind fall back to MATCHing by curie.
+    Adds the number of relationships created to counts, and returns the edges that weren't written because
+    an endpoint isn't in the graph."""
+    merge = f"""MERGE (a)-[r:{edgelabel} {{edge_source: row.provided_by, relation_label: row.original_predicate_label}}]-(b)
             set r.source_database=row.database
             set r.ctime=row.ctime 
             set r.predicate_id=row.standard_id 
             set r.relation=row.original_predicate_id 
             set r.publications=row.publications
+            RETURN row.index AS index, row.source_id AS source_id, id(a) AS source_node, row.target_id AS target_id, id(b) AS target_node
             """
-    batch = [ {'source_id': edge.source_id,
+    by_node_id = f"""UNWIND $batches as row
+            MATCH (a) WHERE id(a) = row.source_node AND a.id = row.source_id
+            MATCH (b) WHERE id(b) = row.target_node AND b.id = row.target_id
+            """ + merge
+    by_curie = f"""UNWIND $batches as row
+            MATCH (a:{node_types.ROOT_ENTITY} {{id: row.source_id}}),(b:{node_types.ROOT_ENTITY} {{id: row.target_id}})
+            """ + merge
+    node_ids = {} if node_ids is None else node_ids
+    batch = [ {'index': index,
+               'source_id': edge.source_id,
                'target_id': edge.target_id,
+               'source_node': node_ids.get(edge.source_id),
+               'target_node': node_ids.get(edge.target_id),
                'provided_by': edge.provided_by,
                'database': edge.provided_by.split('.')[0],
                'ctime': edge.ctime,
@@ -103,13 +813,28 @@ def export_edge_chunk(tx,edgelist,edgelabel):
                'publication_count': len(edge.publications),
                'publications': edge.publications[:1000]
                }
-              for edge in edgelist]
+              for index, edge in enumerate(edgelist)]
 
-    tx.run(cypher,{'batches': batch})
+    written = set()
+    bound = [row for row in batch if row['source_node'] is not None and row['target_node'] is not None]
+    if bound:
+        result = tx.run(by_node_id,{'batches': bound})
+        written.update(record['index'] for record in result)
+        count_created(result, counts, 'relationships_created')
+    unbound = [row for row in batch if row['index'] not in written]
+    if unbound:
+        result = tx.run(by_curie,{'batches': unbound})
+        for record in result:
+            written.add(record['index'])
+            node_ids[record['source_id']] = record['source_node']
+            node_ids[record['target_id']] = record['target_node']
+        count_created(result, counts, 'relationships_created')
 
     for edge in edgelist:
         if edge.standard_predicate.identifier == 'GAMMA:0':
             logger.warn(f"Unable to map predicate for edge {edge.original_predicate}  {edge}")
+    # Rows whose endpoints weren't both MATCHed produce no record.
+    return [edge for index, edge in enumerate(edgelist) if index not in written]
 
 def sort_nodes_by_label(nodes):
     nl = defaultdict(list)
@@ -117,17 +842,29 @@ def sort_nodes_by_label(nodes):
     return nl
 
 
-def export_node_chunk(tx,nodelist,label):
+def export_node_chunk(tx,nodelist,label,node_ids=None,counts=None):
+    """MERGE the nodes, recording their neo4j internal ids in node_ids (curie -> id) for export_edge_chunk,
+    and the number of nodes created in counts."""
     cypher = f"""UNWIND $batches as batch
                 MERGE (a:{node_types.ROOT_ENTITY} {{id: batch.id}})
                 set a:{label}
                 set a.name=batch.name
                 set a.equivalent_identifiers=batch.synonyms
+                RETURN batch.id AS id, id(a) AS node_id
                 """
     batch = []
     for n in nodelist:
         nodeout = { 'id': n.id, 'name': n.name, 'synonyms': [s.identifier for s in n.synonyms] }
         batch.append(nodeout)
-    tx.run(cypher,{'batches': batch})
+    result = tx.run(cypher,{'batches': batch})
+    for record in result:
+        if node_ids is not None:
+            node_ids[record['id']] = record['node_id']
+    count_created(result, counts, 'nodes_created')
+
+def count_created(result, counts, counter):
+    """Add a neo4j result counter (e.g. nodes_created) to counts['created']."""
+    if counts is not None:
+        counts['created'] = counts.get('created', 0) + getattr(result.summary().counters, counter)
 
 
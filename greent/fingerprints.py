@@ -0,0 +1,127 @@
+import hashlib
+import math
+from collections import OrderedDict
+
+def fingerprint(*fields):
+    """ A 64-bit fingerprint of some identifying fields. """
+    text = '\x1f'.join (str(field) for field in fields)
+    return int.from_bytes (hashlib.blake2b (text.encode ('utf-8'), digest_size=8).digest (), 'big')
+
+def node_fingerprint(node):
+    return fingerprint (node.id)
+
+def edge_fingerprint(edge):
+    """ Fingerprint of the fields that make two KEdges equal. """
+    predicate = edge.original_predicate
+    return fingerprint (edge.source_id, edge.target_id, edge.provided_by,
+                        getattr(predicate, 'identifier', predicate), getattr(predicate, 'label', None))
+
+class FingerprintLRU:
+    """ The most recent max_entries fingerprints.  Older ones are forgotten, so an element seen again
+    long after is reported as new; for the writer that just means a harmless re-MERGE. """
+    def __init__(self, max_entries=1000000):
+        self.max_entries = int(max_entries)
+        self.entries = OrderedDict ()
+    def add(self, fp):
+        """ Remember fp.  Returns True if it was not already remembered. """
+        if fp in self.entries:
+            self.entries.move_to_end (fp)
+            return False
+        self.entries[fp] = None
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem (last=False)
+        return True
+    def discard(self, fp):
+        """ Forget fp, if it is remembered. """
+        self.entries.pop (fp, None)
+    def __len__(self):
+        return len(self.entries)
+
+class BloomFilter:
+    """ A Bloom filter over 64-bit fingerprints, sized for capacity elements at error_rate. """
+    def __init__(self, capacity, error_rate):
+        self.capacity = int(capacity)
+        self.size = max (8, int(math.ceil (-self.capacity * math.log (error_rate) / math.log (2) ** 2)))
+        self.hashes = max (1, int(round (self.size / self.capacity * math.log (2))))
+        self.bits = bytearray ((self.size + 7) // 8)
+        self.count = 0
+    def positions(self, fp):
+        # Double hashing on the two halves of the fingerprint.
+        h1, h2 = fp & 0xffffffff, (fp >> 32) | 1
+        return [ (h1 + i * h2) % self.size for i in range (self.hashes) ]
+    def __contains__(self, fp):
+        return all (self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions (fp))
+    def add(self, fp):
+        for p in self.positions (fp):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+    def full(self):
+        return self.count >= self.capacity
+
+class ScalableBloomFilter:
+    """ Bloom filters that grow as they fill: each new filter holds growth times as many elements at a
+    tighter error rate, so the overall false positive rate stays under error_rate.  A false positive
+    reports a new element as already seen.  If max_bytes is set, the oldest filters are dropped to stay
+    under it, which only forgets old elements. """
+    def __init__(self, initial_capacity=1000000, error_rate=0.000001, max_bytes=None, growth=2, tightening=0.5):
+        self.initial_capacity = int(initial_capacity)
+        self.error_rate = float(error_rate)
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.growth = growth
+        self.tightening = tightening
+        self.generation = 0
+        self.filters = []
+        self.forgotten = set ()
+        self.grow ()
+    def grow(self):
+        capacity = self.initial_capacity * self.growth ** self.generation
+        error_rate = self.error_rate * (1 - self.tightening) * self.tightening ** self.generation
+        self.filters.append (BloomFilter (capacity, error_rate))
+        self.generation += 1
+        while self.max_bytes and len(self.filters) > 1 and self.nbytes () > self.max_bytes:
+            self.filters.pop (0)
+    def nbytes(self):
+        return sum ([ len(f.bits) for f in self.filters ])
+    def add(self, fp):
+        """ Remember fp.  Returns True if it was not (apparently) already remembered. """
+        if fp in self.forgotten:
+            self.forgotten.discard (fp)
+            return True
+        if any (fp in f for f in self.filters):
+            return False
+        if self.filters[-1].full ():
+            self.grow ()
+        self.filters[-1].add (fp)
+        return True
+    def discard(self, fp):
+        """ Forget fp.  A Bloom filter can't remove it, so it is reported as new the next time it is added. """
+        if any (fp in f for f in self.filters):
+            self.forgotten.add (fp)
+    def __len__(self):
+        return sum ([ f.count for f in self.filters ])
+
+def fingerprint_set(config=None):
+    """ Build the set of seen fingerprints described by config (method lru or bloom). """
+    config = {} if config is None else config
+    method = config.get ('method', 'lru')
+    if method == 'bloom':
+        return ScalableBloomFilter (initial_capacity = config.get ('initial_capacity', 1000000),
+                                    error_rate = config.get ('error_rate', 0.000001),
+                                    max_bytes = config.get ('max_bytes'))
+    if method == 'lru':
+        return FingerprintLRU (config.get ('max_entries', 1000000))
+    raise ValueError (f"Unknown dedup method: {method}")
+
+def jump_hash(key, buckets):
+    """ Lamping and Veach's jump consistent hash: the bucket, in range(buckets), for a 64-bit key.
+    Going from n to n+1 buckets moves only 1/(n+1) of the keys, all of them into the new bucket. """
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xffffffffffffffff
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+def shard_for(identifier, shards):
+    """ The shard, in range(shards), that owns identifier.  Stable across processes and runs. """
+    return jump_hash (fingerprint (identifier), shards)
@@ -1,8 +1,13 @@
+import hashlib
+import itertools
 import json
 import logging
 import sys
+import threading
+import time
 import traceback
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
+from functools import lru_cache
 
 from greent.concept import Concept
 from greent.concept import ConceptModel
@@ -36,12 +41,17 @@ class TypeGraph(Service):
         self.edges_by_source = defaultdict(list)
         self.edges_by_target = defaultdict(list)
         self.base_op_to_concepts = defaultdict(list)
+        self.compiled = None
+        self.compiled_version = None
+        self.version_checked = 0
+        self.compile_lock = threading.Lock()
         self.concept_model_name = concept_model_name
         self.set_concept_model()
         self.TYPE = "Type"
         self.CONCEPT = "Concept"
         config = self.get_config()
         self.driver = GraphDatabase.driver(self.url, auth=("neo4j", config['neo4j_password']))
+        self.version_check_interval = config.get('version_check_interval', 30)
 
     def initialize_connection(self):
         """ Connect to the database. """
@@ -55,8 +65,10 @@ class TypeGraph(Service):
                 db = GraphDB(session)
                 db.exec("MATCH (n:Concept) DETACH DELETE n")
                 db.exec("MATCH (n:Type) DETACH DELETE n")
+                db.exec("MATCH (n:TypeGraph) DETACH DELETE n")
         except Exception as e:
             traceback.print_exc()
+        self.compiled = None
 
     def create_constraints(self):
         """Neo4j demands that constraints are by label.  That is, you might have a constraint that
@@ -97,12 +109,46 @@ class TypeGraph(Service):
             """ Recurse. """
             self.build_concept(db, concept.is_a)
 
-    def find_or_create_list(self, items):
+    def initialize(self, vocab, operators, type_checks):
+        """ Build the whole type graph - types, concepts, op transitions and cast edges - in memory,
+        then write it with a few parameterized statements in one transaction.  The same transaction
+        stamps the type graph with the digest of the transitions now in neo4j, which is how other
+        processes notice that their compiled concept graph is stale. """
+        db = BulkGraphDB()
+        self.find_or_create_list(vocab, db)
+        self.configure_operators(operators, db)
+        self.cast_edges(type_checks, db)
         with self.driver.session() as session:
-            db = GraphDB(session)
-            for k, v in items:
-                if isinstance(v, str):
-                    self.find_or_create(db, k, v)
+            compiled = session.write_transaction(self._write_type_graph, db)
+        with self.compile_lock:
+            self.compiled = compiled
+            self.compiled_version = compiled.version
+            self.version_checked = time.time()
+        logger.debug(f"Wrote type graph: {len(db.nodes)} nodes, {len(db.relationships)} relationships, version {compiled.version}")
+
+    def _write_type_graph(self, tx, db):
+        db.write(tx)
+        compiled = ConceptGraph(self._read_transitions(tx))
+        compiled.version = compiled.digest()
+        tx.run("MERGE (g:TypeGraph {name: 'type_graph'}) SET g.version = $version", {'version': compiled.version})
+        return compiled
+
+    def _read_transitions(self, tx):
+        return [ dict(record) for record in tx.run(
+            "MATCH (a:Concept)-[r]->(b:Concept) WHERE EXISTS(r.op) "
+            "RETURN a.name AS source, b.name AS target, r.predicate AS predicate, r.op AS op") ]
+
+    def _read_version(self, tx):
+        record = tx.run("MATCH (g:TypeGraph {name: 'type_graph'}) RETURN g.version AS version").single()
+        return record['version'] if record else None
+
+    def find_or_create_list(self, items, db=None):
+        if db is None:
+            with self.driver.session() as session:
+                return self.find_or_create_list(items, GraphDB(session))
+        for k, v in items:
+            if isinstance(v, str):
+                self.find_or_create(db, k, v)
 
     # make private
     def find_or_create(self, db, name, iri=None):
@@ -128,16 +174,17 @@ class TypeGraph(Service):
                     name_b=name, type_b=self.TYPE)
         return n
 
-    def configure_operators (self, operators):
-        with self.driver.session() as session:
-            db = GraphDB(session)
-            logger.debug ("Configure operators in the Rosetta config.")
-            for a_concept, transition_list in operators:
-                for b_concept, transitions in transition_list.items ():
-                    for transition in transitions:
-                        link = transition['link']
-                        op   = transition['op']
-                        self.create_concept_transition (db, a_concept, b_concept, link, op)
+    def configure_operators (self, operators, db=None):
+        if db is None:
+            with self.driver.session() as session:
+                return self.configure_operators (operators, GraphDB(session))
+        logger.debug ("Configure operators in the Rosetta config.")
+        for a_concept, transition_list in operators:
+            for b_concept, transitions in transition_list.items ():
+                for transition in transitions:
+                    link = transition['link']
+                    op   = transition['op']
+                    self.create_concept_transition (db, a_concept, b_concept, link, op)
                     
     def create_concept_transition (self, db, a_concept, b_concept, link, op):
         """ Create a link between two concepts in the type graph. """
@@ -171,6 +218,7 @@ class TypeGraph(Service):
         self.edges_by_source[a_concept.name].append(edge)
         self.edges_by_target[b_concept.name].append(edge)
         self.base_op_to_concepts[base_op].append( (a_concept.name, b_concept.name) )
+        self.compiled = None
         return edge
 
     def _find_or_create_concept(self, db, concept):
@@ -189,16 +237,17 @@ class TypeGraph(Service):
             traceback.print_stack()
         return concept_node
 
-    def cast_edges(self, type_check_functions):
+    def cast_edges(self, type_check_functions, db=None):
         """With a built type-graph, push edges up and down the type hierarchy (concept_map)"""
         #This approach generates a lot of edges if we let it.  And that might be the right answer
         #But for now, let's try to keep it in check
         #This is one way to do it, but we could swap it with something more complex
-        with self.driver.session() as session:
-            db = GraphDB(session)
-            usable_concepts = self.get_concepts_with_edges()
-            children= self._push_up(db, type_check_functions,usable_concepts)
-            self._pull_down(db, children, type_check_functions )
+        if db is None:
+            with self.driver.session() as session:
+                return self.cast_edges(type_check_functions, GraphDB(session))
+        usable_concepts = self.get_concepts_with_edges()
+        children= self._push_up(db, type_check_functions,usable_concepts)
+        self._pull_down(db, children, type_check_functions )
 
     def _push_up(self, db, type_check_functions, usable_concepts):
         this_level = self.concept_model.get_leaves()
@@ -328,6 +377,26 @@ class TypeGraph(Service):
                 print(f"  list {p}")
         return programs
 
+    def concept_graph(self):
+        """ The concepts and op transitions as an in-memory ConceptGraph, loaded from neo4j.  At most once
+        every version_check_interval seconds, the type graph's persisted version is read, and the graph
+        is loaded again if another process has rebuilt it since. """
+        with self.compile_lock:
+            now = time.time()
+            if self.compiled is None or now - self.version_checked >= self.version_check_interval:
+                with self.driver.session() as session:
+                    version = session.read_transaction(self._read_version)
+                    if self.compiled is None or version != self.compiled_version:
+                        edges = session.read_transaction(self._read_transitions)
+                        compiled = ConceptGraph(edges)
+                        # A type graph written before it was versioned is keyed by its content.
+                        compiled.version = version or compiled.digest()
+                        self.compiled = compiled
+                        self.compiled_version = version
+                        logger.debug(f"Compiled type graph {compiled.version}: {len(compiled.concepts)} concepts, {len(edges)} transitions")
+                self.version_checked = now
+            return self.compiled
+
     def get_concepts_with_edges(self):
         sedges = set(self.edges_by_source.keys())
         tedges = set(self.edges_by_target.keys())
@@ -335,6 +404,84 @@ class TypeGraph(Service):
         return list(sedges)
 
 
+class ConceptGraph:
+    """ The type graph's concepts and the op-annotated transitions between them, in memory, for
+    enumerating the concept-level plans of a machine question without querying neo4j. """
+
+    def __init__(self, edges=()):
+        self.concepts = set()
+        self.transitions = defaultdict(list)
+        self.version = None
+        self._digest = None
+        for edge in edges:
+            self.add(edge['source'], edge['target'], edge['predicate'], edge['op'])
+
+    def add(self, source, target, predicate, op):
+        links = self.transitions[(source, target)]
+        if not any(link['op'] == op for link in links):
+            links.append({"op": op, "link": predicate})
+        self.concepts.update([source, target])
+        self._digest = None
+
+    def links(self, source, target):
+        return self.transitions.get((source, target), [])
+
+    def digest(self):
+        """ A hash of the transitions.  It changes whenever the type graph is rebuilt differently, so
+        anything computed from the graph can be cached under it. """
+        if self._digest is None:
+            content = sorted([ [s, t, link['op'], link['link']] for (s, t), links in self.transitions.items() for link in links ])
+            self._digest = hashlib.sha1(json.dumps(content).encode('utf-8')).hexdigest()
+        return self._digest
+
+    def plans(self, nodes, edges):
+        """ The concept-level plans for a machine question's nodes (QNodes) and edges (QEdges).
+
+        Each question node is bound to a concept (its type, or any concept if it has none), and each
+        question edge to the transitions between its nodes' concepts, in one direction or the other.
+        A binding is viable if every node can be reached from the nodes with curies by following the
+        transitions' directions.  Each plan maps source node id -> target node id -> transitions, with
+        all the transitions of one viable binding of concepts and directions.  """
+        for edge in edges:
+            if not edge.min_length == edge.max_length == 1:
+                raise ValueError(f"Only single-hop question edges can be compiled: {edge.source_id}-{edge.target_id}")
+        node_ids = tuple(n.id for n in nodes)
+        named = tuple(n.id for n in nodes if n.curie)
+        choices = [ [n.type] if n.type else sorted(self.concepts) for n in nodes ]
+        plans = []
+        for assignment in itertools.product(*choices):
+            concept = dict(zip(node_ids, assignment))
+            options = []
+            for edge in edges:
+                s, t = edge.source_id, edge.target_id
+                forward = self.links(concept[s], concept[t])
+                backward = self.links(concept[t], concept[s]) if concept[s] != concept[t] else []
+                options.append([ (a, b, links) for a, b, links in ((s, t, forward), (t, s, backward)) if links ])
+            for directions in itertools.product(*options):
+                if not traversable(node_ids, tuple((a, b) for a, b, links in directions), named):
+                    continue
+                plan = { i: { j: [] for j in node_ids } for i in node_ids }
+                for a, b, links in directions:
+                    plan[a][b].extend(links)
+                plans.append(plan)
+        return plans
+
+@lru_cache(maxsize=4096)
+def traversable(nodes, pairs, starts):
+    """ True if every node can be reached from starts along the directed (source, target) pairs. """
+    successors = defaultdict(list)
+    for a, b in pairs:
+        successors[a].append(b)
+    reached = set(starts)
+    frontier = deque(starts)
+    while frontier:
+        for b in successors[frontier.popleft()]:
+            if b not in reached:
+                reached.add(b)
+                frontier.append(b)
+    return reached.issuperset(nodes)
+
+
 class Operator:
     """ Abstraction of a method to call to effect a transition between two graph nodes. """
 
@@ -432,6 +579,79 @@ class GraphDB:
             CREATE (a)-[:{relname} {{ {rprops} }}]->(b)""")
 
 
+class BulkResult:
+    """ Stands in for a statement result from BulkGraphDB: peek() is the recorded node, if any. """
+
+    def __init__(self, node):
+        self.node = node
+
+    def peek(self):
+        return self.node
+
+
+class BulkGraphDB:
+    """ Takes the same calls as GraphDB, but records the nodes, labels and relationships in memory, and
+    writes them all in one transaction.  Nodes are identified by type and name, as GraphDB
+    finds them.  There is one UNWIND ... MERGE statement per node type and set of labels, and per
+    relationship type and set of properties, each parameterized with its rows, so initializing the
+    type graph takes a few dozen statements rather than several for every node and edge. """
+
+    def __init__(self):
+        self.nodes = OrderedDict()
+        self.relationships = OrderedDict()
+
+    def get_node(self, properties, node_type=None):
+        return BulkResult(self.nodes.get((node_type, properties['name'])))
+
+    def create_concept(self, properties):
+        self.create_node(properties, "Concept")
+
+    def create_type(self, properties):
+        self.create_node(properties, "Type")
+
+    def create_node(self, properties, node_type=None):
+        node = self.nodes.setdefault((node_type, properties['name']), {'properties': {}, 'labels': set()})
+        node['properties'].update({k: v for k, v in properties.items() if v is not None})
+        return BulkResult(node)
+
+    def add_label(self, properties, node_type, label):
+        node = self.nodes.get((node_type, properties['name']))
+        if node is not None:
+            node['labels'].add(label)
+        return BulkResult(node)
+
+    def create_relationship(self, name_a, type_a, properties, name_b, type_b):
+        relname = properties['name']
+        rprops = tuple(sorted((k, v) for k, v in properties.items() if not k == "name"))
+        self.relationships[(type_a, name_a, relname, rprops, type_b, name_b)] = True
+        return BulkResult(True)
+
+    def statements(self):
+        """ The (cypher, parameters) pairs that write everything recorded. """
+        node_groups = defaultdict(list)
+        for (node_type, name), node in self.nodes.items():
+            node_groups[(node_type, tuple(sorted(node['labels'])))].append(node['properties'])
+        for (node_type, labels), rows in node_groups.items():
+            ntype = f":`{node_type}`" if node_type else ""
+            set_labels = f" SET n:{':'.join(f'`{label}`' for label in labels)}" if labels else ""
+            yield (f"UNWIND $rows AS row MERGE (n{ntype} {{name: row.name}}) SET n += row{set_labels}", {'rows': rows})
+        relationship_groups = defaultdict(list)
+        for (type_a, name_a, relname, rprops, type_b, name_b) in self.relationships:
+            keys = tuple(k for k, v in rprops)
+            relationship_groups[(type_a, relname, keys, type_b)].append({'a': name_a, 'b': name_b, 'properties': dict(rprops)})
+        for (type_a, relname, keys, type_b), rows in relationship_groups.items():
+            rprops = f" {{{', '.join(f'{k}: row.properties.{k}' for k in keys)}}}" if keys else ""
+            yield (f"""UNWIND $rows AS row
+                MATCH (a:`{type_a}` {{name: row.a}})
+                MATCH (b:`{type_b}` {{name: row.b}})
+                MERGE (a)-[:`{relname}`{rprops}]->(b)""", {'rows': rows})
+
+    def write(self, tx):
+        """ Run everything recorded in the transaction tx. """
+        for cypher, parameters in self.statements():
+            tx.run(cypher, parameters)
+
+
 class Rel:
     def __init__(self,start,end):
         self.start = start
@@ -0,0 +1,142 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging(__name__, logging.INFO)
+
+class HttpError(Exception):
+    """ Raised when a request still fails after all retries. """
+    pass
+
+class HttpStats:
+    """ Call counts and latency for one service (or host, for calls made without a service). """
+    def __init__(self):
+        self.lock = threading.Lock ()
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+    def record (self, seconds, error=False, retry=False):
+        with self.lock:
+            self.calls += 1
+            self.errors += 1 if error else 0
+            self.retries += 1 if retry else 0
+            self.total_seconds += seconds
+            self.max_seconds = max (self.max_seconds, seconds)
+    def as_dict (self):
+        with self.lock:
+            return {
+                "calls"   : self.calls,
+                "errors"  : self.errors,
+                "retries" : self.retries,
+                "mean_ms" : round (1000 * self.total_seconds / self.calls, 1) if self.calls else 0,
+                "max_ms"  : round (1000 * self.max_seconds, 1)
+            }
+
+class HttpClient:
+    """ Shared HTTP client for all services.
+
+    Keeps one pooled, keep-alive session per host so repeated calls to the same source reuse
+    connections.  Connection errors, timeouts and throttling responses (429, 502, 503, 504) are
+    retried with exponential backoff and jitter, honouring Retry-After when the server sends it.
+    Any other response, including a 500, is returned to the caller unchanged so services keep
+    their own handling of error statuses.  Each attempt first waits on the service's rate limit. """
+
+    RETRY_STATUS = frozenset ([ 429, 502, 503, 504 ])
+
+    def __init__(self, config=None, limiter=None):
+        config = {} if config is None else config
+        self.limiter = limiter
+        self.timeout = float(config.get ("timeout", 60))
+        self.max_tries = int(config.get ("max_tries", 5))
+        self.backoff = float(config.get ("backoff", 0.5))
+        self.max_backoff = float(config.get ("max_backoff", 30))
+        self.pool_size = int(config.get ("pool_size", 16))
+        self.hosts = { h["host"] : h for h in (config.get ("hosts") or []) }
+        self.sessions = {}
+        self.stats_by_name = defaultdict(HttpStats)
+        self.lock = threading.Lock ()
+
+    def session (self, host):
+        """ The session for a host, created on first use. """
+        with self.lock:
+            session = self.sessions.get (host)
+            if session is None:
+                session = requests.Session ()
+                adapter = HTTPAdapter (pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount ("http://", adapter)
+                session.mount ("https://", adapter)
+                self.sessions[host] = session
+            return session
+
+    def host_config (self, host, key, default):
+        return self.hosts.get (host, {}).get (key, default)
+
+    def delay (self, attempt, response=None):
+        """ Seconds to wait before the next attempt: Retry-After if given, else exponential backoff with full jitter. """
+        retry_after = response.headers.get ("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                seconds = float(retry_after)
+            except ValueError:
+                # An HTTP date, or garbage, in which case fall back to backoff.
+                try:
+                    seconds = email.utils.parsedate_to_datetime (retry_after).timestamp () - time.time ()
+                except (TypeError, ValueError, IndexError, AttributeError):
+                    logger.debug (f"Ignoring malformed Retry-After: {retry_after}")
+                    seconds = None
+            # NaN isn't equal to itself.
+            if seconds is not None and seconds == seconds:
+                return min (max (seconds, 0), self.max_backoff)
+        return random.uniform (0, min (self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request (self, method, url, service=None, retry=True, **kwargs):
+        """ Issue a request and return the response, retrying transient failures.
+        Raises HttpError if the last attempt failed without a response. """
+        host = urlparse (url).netloc
+        kwargs.setdefault ("timeout", float(self.host_config (host, "timeout", self.timeout)))
+        max_tries = int(self.host_config (host, "max_tries", self.max_tries)) if retry else 1
+        stats = self.stats_by_name[service or host]
+        session = self.session (host)
+        for attempt in range (max_tries):
+            if self.limiter is not None:
+                self.limiter.acquire (service)
+            start = time.time ()
+            response = None
+            error = None
+            try:
+                response = session.request (method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                error = e
+            last = attempt == max_tries - 1
+            transient = error is not None or response.status_code in self.RETRY_STATUS
+            stats.record (time.time () - start, error=transient, retry=attempt > 0)
+            if not transient or last:
+                break
+            wait = self.delay (attempt, response)
+            logger.debug (f"{method} {url} failed ({error or response.status_code}); retrying in {wait:.2f}s")
+            time.sleep (wait)
+        if response is None:
+            raise HttpError (f"{method} {url} failed after {max_tries} tries: {error}") from error
+        return response
+
+    def get (self, url, service=None, **kwargs):
+        return self.request ("GET", url, service=service, **kwargs)
+
+    def post (self, url, service=None, **kwargs):
+        return self.request ("POST", url, service=service, **kwargs)
+
+    def stats (self):
+        return { name : s.as_dict () for name, s in list(self.stats_by_name.items ()) }
+
+    def log_stats (self):
+        for name, s in sorted (self.stats ().items ()):
+            logger.info (f"http {name}: {s}")
@@ -0,0 +1,48 @@
+import operator
+import threading
+from greent.util import LoggingUtil
+import logging
+
+logger = LoggingUtil.init_logging(__name__, logging.INFO)
+
+class OpRegistry:
+    """ The functions behind op names (e.g. ctd.drug_to_gene, or a cast such as
+    caster.output_filter(biolink~gene_get_disease,genetic_condition,mondo~is_genetic_disease)).
+    Each name is resolved once, so calling an op again costs a dict lookup rather than an attribute
+    walk over core and, for casts, re-parsing the cast expression. """
+
+    def __init__(self, core):
+        self.core = core
+        self.functions = {}
+        self.lock = threading.Lock ()
+
+    def get(self, name):
+        function = self.functions.get (name)
+        if function is None:
+            with self.lock:
+                function = self.functions.get (name)
+                if function is None:
+                    function = operator.attrgetter (name)(self.core)
+                    self.functions[name] = function
+        return function
+
+    def describe(self, name):
+        """ What an op is made of: the service it calls, the underlying op, the casts applied to it
+        (outermost first) and the input and output types they impose, if any. """
+        if name.startswith ('caster.'):
+            cast_op = self.core.caster.compile (name[len('caster.'):])
+            base_op, filters = cast_op.base_op, cast_op.filters
+            input_type, output_type = cast_op.input_type, cast_op.output_type
+        else:
+            base_op, filters, input_type, output_type = name, [], None, None
+        return {
+            'name'        : name,
+            'source'      : base_op.split ('.')[0],
+            'base_op'     : base_op,
+            'filters'     : filters,
+            'input_type'  : input_type,
+            'output_type' : output_type
+        }
+
+    def __len__(self):
+        return len(self.functions)
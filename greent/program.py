@@ -3,13 +3,15 @@ import traceback
 import calendar
 import json
 import os
+import threading
 
 import requests
 from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from greent.graph_components import KNode
 from greent.util import LoggingUtil
 from greent import node_types
-from greent.export import BufferedWriter
+from greent.export import create_writer, writer_queues, MessagePublisher
 from greent.cache import Cache
 from greent.graph_components import KEdge
 
@@ -29,6 +31,32 @@ class QueryDefinition:
         self.start_name = None
         self.end_name = None
 
+def get_op_source(op_name):
+    """Return the name of the service that an op calls, looking through any caster wrapping.
+    e.g. caster.upcast(biolink~gene_get_pathways,biological_process) -> biolink"""
+    if op_name.startswith('caster.'):
+        base_function = op_name.split('(')[-1].split(',')[0].split(')')[0]
+        return base_function.split('~')[0]
+    return op_name.split('.')[0]
+
+class SourceLimits:
+    """Bounds the number of simultaneous calls to each knowledge source.
+    Limits are read from the program/concurrency section of greent.conf.  Sources without
+    an entry of their own get the default."""
+
+    def __init__(self, config):
+        self.concurrency = config.get('concurrency', {})
+        self.default = int(self.concurrency.get('default', config.get('workers', 8)))
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def get(self, source):
+        with self.lock:
+            if source not in self.semaphores:
+                limit = int(self.concurrency.get(source, self.default)) if source else self.default
+                self.semaphores[source] = threading.BoundedSemaphore(limit)
+            return self.semaphores[source]
+
 class Program:
 
     def __init__(self, plan, nodes, rosetta, program_number):
@@ -38,29 +66,46 @@ class Program:
         self.concept_nodes = nodes
         self.transitions = plan
         self.rosetta = rosetta
+        program_config = self.rosetta.service_context.config.get('program', {})
+        self.executor = program_config.get('executor', 'depth_first')
+        self.workers = int(program_config.get('workers', 8))
+        self.batch_size = int(program_config.get('batch_size', 50))
+        self.limits = SourceLimits(program_config)
         self.cache = Cache(
             redis_host=os.environ['CACHE_HOST'],
             redis_port=os.environ['CACHE_PORT'],
-            redis_db=1)
+            redis_db=1,
+            serializer=self.rosetta.cache.serializer)
 
         self.cache.flush()
         self.log_program()
         #self.excluded_identifiers=set()
         self.excluded_identifiers=set(['UBERON:0000468'])
 
+        # Use the writer service if every one of its shard queues has a consumer.
+        writer_config = self.rosetta.service_context.config.get('writer', {})
+        self.writer_queues = writer_queues(writer_config.get('service', {}).get('shards', 1))
         response = requests.get(f"{os.environ['BROKER_API']}queues/")
         queues = response.json()
-        num_consumers = [q['consumers'] for q in queues if q['name'] == 'neo4j']
-        if num_consumers and num_consumers[0]:
+        consumers = {q['name']: q['consumers'] for q in queues}
+        if all(consumers.get(queue) for queue in self.writer_queues):
             import pika
             self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=os.environ['BROKER_HOST'],
                 virtual_host='builder',
                 credentials=pika.credentials.PlainCredentials(os.environ['BROKER_USER'], os.environ['BROKER_PASSWORD'])))
             self.channel = self.connection.channel()
-            self.channel.queue_declare(queue='neo4j')
+            for queue in self.writer_queues:
+                self.channel.queue_declare(queue=queue, durable=True)
         else:
             self.connection = None
             self.channel = None
+        # Send graph elements to the writer service in batched messages if there is one.  Otherwise write
+        # directly through one writer for the life of the program (to neo4j, or to CSV files for
+        # neo4j-admin import, per writer.mode).
+        if self.channel is not None:
+            self.writer = MessagePublisher(self.channel, writer_config.get('messages'), self.writer_queues)
+        else:
+            self.writer = create_writer(self.rosetta)
 
     def __del__(self):
         if self.connection is not None:
@@ -86,20 +131,58 @@ class Program:
             self.process_node(start_node, str(n.id))
         return
 
+    def run_op(self, op_name, source_node):
+        """Get the results of an op from the cache, calling the op (within its source's limit) on a miss.
+        If another worker is already calling the same op on the same node, wait for its results instead."""
+        key = f"{op_name}({source_node.id})"
+        def call_op():
+            logger.debug(f"exec op: {key}")
+            op = self.rosetta.get_ops(op_name)
+            with self.limits.get(get_op_source(op_name)):
+                results = op(source_node)
+            logger.debug(f"cache.set-> {key} length:{len(results)}")
+            logger.debug(f"    {[node for _, node in results]}")
+            return results
+        results = self.rosetta.cache.single_flight(key, call_op)
+        logger.debug(f"results: {key} size:{len(results)}")
+        return results
+
+    def has_batch(self, op_name):
+        """Whether an op has a batch form.  An op that can't be resolved is left to run_op, which reports it."""
+        try:
+            return hasattr(self.rosetta.get_ops(op_name), 'batch')
+        except Exception as e:
+            logger.warning(f"Unable to resolve op {op_name}: {e}")
+            return False
+
+    def run_batch(self, op_name, source_nodes):
+        """Call an op's batch form on many nodes at once (within its source's limit, as one call) and cache
+        each node's results.  Returns {node_id: results}.  If the batch call fails, e.g. on one bad input,
+        the nodes are run one at a time instead, and a node whose own call fails maps to its exception."""
+        logger.debug(f"exec batch op: {op_name} on {len(source_nodes)} nodes")
+        op = self.rosetta.get_ops(op_name)
+        try:
+            with self.limits.get(get_op_source(op_name)):
+                batch_results = op.batch(source_nodes)
+        except Exception as e:
+            traceback.print_exc()
+            logger.warning(f"Error invoking batch> {op_name} on {len(source_nodes)} nodes; running them one at a time")
+            results = {}
+            for node in source_nodes:
+                try:
+                    results[node.id] = self.run_op(op_name, node)
+                except Exception as e:
+                    results[node.id] = e
+            return results
+        results = {node.id: batch_results.get(node.id, []) for node in source_nodes}
+        self.rosetta.cache.set_many({f"{op_name}({node_id})": r for node_id, r in results.items()})
+        return results
+
     def process_op(self, link, source_node, history):
         op_name = link['op']
         key = f"{op_name}({source_node.id})"
         try:
-            results = self.rosetta.cache.get(key)
-            if results is not None:
-                logger.debug(f"cache hit: {key} size:{len(results)}")
-            else:
-                logger.debug(f"exec op: {key}")
-                op = self.rosetta.get_ops(op_name)
-                results = op(source_node)
-                self.rosetta.cache.set(key, results)
-                logger.debug(f"cache.set-> {key} length:{len(results)}")
-                logger.debug(f"    {[node for _, node in results]}")
+            results = self.run_op(op_name, source_node)
             for edge, node in results:
                 self.process_node(node, history, edge)
 
@@ -108,6 +191,15 @@ class Program:
             log_text = f"  -- {key}"
             logger.warning(f"Error invoking> {log_text}")
 
+    def synonymize(self, node, synonyms=None):
+        """Synonymize a node, within the limit of the source that its synonymizer calls.
+        If the node's synonyms were already pulled from the cache, no source is called so no limit applies."""
+        if synonyms is not None:
+            self.rosetta.synonymizer.synonymize(node, synonyms)
+            return
+        with self.limits.get(self.rosetta.synonymizer.get_source(node)):
+            self.rosetta.synonymizer.synonymize(node)
+
     def process_node(self, node, history, edge=None):
         """
         We've got a new set of nodes (either initial nodes or from a query).  They are attached
@@ -116,13 +208,21 @@ class Program:
         """
         if edge is not None:
             is_source = node.id == edge.source_id
-        self.rosetta.synonymizer.synonymize(node)
+        self.synonymize(node)
         if edge is not None:
             if is_source:
                 edge.source_id = node.id
             else:
                 edge.target_id = node.id
 
+        self.record(node, history, edge)
+
+        for link, next_history in self.expand(node, history):
+            print("-"*len(history)+"Executing: ", link['op'])
+            self.process_op(link, node, next_history)
+
+    def record(self, node, history, edge=None):
+        """Write out a synonymized node (the first time we see it) and the edge that led to it."""
         # check the node cache, compare to the provided history
         # to determine which ops are valid
         key = node.id
@@ -139,26 +239,19 @@ class Program:
             completed = set()
             self.cache.set(key, completed)
 
-            if self.channel is None:
-                with BufferedWriter(self.rosetta) as writer:
-                    writer.write_node(node)
-            else:
-                self.channel.basic_publish(exchange='',
-                    routing_key='neo4j',
-                    body=json.dumps({'nodes': [node.dump()], 'edges': []}))
+            self.writer.write_node(node)
             print(" [x] Sent node")
 
         # make sure the edge is queued for creation AFTER the node
         if edge:
-            if self.channel is None:
-                with BufferedWriter(self.rosetta) as writer:
-                    writer.write_edge(edge)
-            else:
-                self.channel.basic_publish(exchange='',
-                    routing_key='neo4j',
-                    body=json.dumps({'nodes': [], 'edges': [edge.dump()]}))
+            self.writer.write_edge(edge)
             print(" [x] Sent edge")
 
+    def expand(self, node, history):
+        """Yield (link, history) for each op to run from this node, marking its destination as completed.
+        This is a generator so that the depth-first executor sees completions made further down the recursion."""
+        key = node.id
+
         # quit if we've closed a loop
         if history[-1] in history[:-1]:
             print("-"*len(history)+"Closed a loop!")
@@ -186,20 +279,111 @@ class Program:
             links = self.transitions[source_id][target_id]
             print("-"*len(history)+f"Destination: {target_id}")
             for link in links:
-                print("-"*len(history)+"Executing: ", link['op'])
-                self.process_op(link, node, history+str(target_id))
-        
+                yield link, history+str(target_id)
+
+    def run_frontiers(self):
+        """Breadth-first alternative to initialize_instance_nodes/process_node.  The plan is expanded one
+        frontier at a time: every node in the frontier is synonymized concurrently, the completed/loop/turn-around
+        bookkeeping is done on this thread in frontier order, and then every (op, node) pair leaving the frontier
+        is run concurrently, ops with a batch form taking up to batch_size of their nodes per call.  Their results
+        make up the next frontier."""
+        logger.debug("Initializing program {}".format(self.program_number))
+        frontier = [(KNode(n.curie, type=n.type, name=n.name), str(n.id), None) for n in self.concept_nodes if n.curie]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while frontier:
+                logger.debug(f"Frontier: {len(frontier)} nodes")
+                frontier = self.synonymize_frontier(frontier, pool)
+                # Only here to warm the memory tier: pull the completed sets for the whole frontier in one
+                # round trip, so that record and expand read them from memory.  (They can't use the result
+                # directly, since recording a node that recurs in the frontier updates its set.)
+                self.cache.get_many([node.id for node, history, edge in frontier])
+                # group identical (op, node) calls so that each is made once per frontier
+                calls = defaultdict(list)
+                for node, history, edge in frontier:
+                    self.record(node, history, edge)
+                    for link, next_history in self.expand(node, history):
+                        calls[(link['op'], node.id)].append((node, next_history))
+                cached = self.rosetta.cache.get_many([f"{op_name}({node_id})" for op_name, node_id in calls])
+                # the misses for ops with a batch form are grouped, and each group is one call
+                batches = defaultdict(list)
+                batchable = {op_name: self.has_batch(op_name) for op_name in {op_name for op_name, node_id in calls}}
+                for op_name, node_id in calls:
+                    if cached[f"{op_name}({node_id})"] is None and batchable[op_name]:
+                        batches[op_name].append(node_id)
+                batch_futures = {}
+                for op_name, node_ids in batches.items():
+                    for i in range(0, len(node_ids), self.batch_size):
+                        chunk = node_ids[i:i + self.batch_size]
+                        future = pool.submit(self.run_batch, op_name, [calls[(op_name, node_id)][0][0] for node_id in chunk])
+                        batch_futures.update({(op_name, node_id): future for node_id in chunk})
+                futures = []
+                for op_name, node_id in calls:
+                    results = cached[f"{op_name}({node_id})"]
+                    if (op_name, node_id) in batch_futures:
+                        results = batch_futures[(op_name, node_id)]
+                    elif results is None:
+                        results = pool.submit(self.run_op, op_name, calls[(op_name, node_id)][0][0])
+                    else:
+                        logger.debug(f"cache hit: {op_name}({node_id}) size:{len(results)}")
+                    futures.append((results, op_name, node_id))
+                frontier = []
+                for future, op_name, node_id in futures:
+                    try:
+                        results = future.result() if isinstance(future, Future) else future
+                        if (op_name, node_id) in batch_futures:
+                            results = results[node_id]
+                            if isinstance(results, Exception):
+                                raise results
+                    except Exception as e:
+                        traceback.print_exc()
+                        logger.warning(f"Error invoking>   -- {op_name}({node_id})")
+                        continue
+                    for source_node, next_history in calls[(op_name, node_id)]:
+                        frontier.extend((node, next_history, edge) for edge, node in results)
+
+    def synonymize_frontier(self, frontier, pool):
+        """Synonymize each distinct node in a frontier and point its edges at the new ids.
+        Entries whose node fails to synonymize are dropped, as process_op would have done."""
+        is_source = [edge is not None and node.id == edge.source_id for node, history, edge in frontier]
+        nodes = {id(node): node for node, history, edge in frontier}
+        cached = self.rosetta.synonymizer.get_cached_synonyms(nodes.values())
+        cached = self.rosetta.synonymizer.synonymize_many(nodes.values(), cached)
+        failed = set()
+        for node_key, future in [(k, pool.submit(self.synonymize, n, cached[n.id])) for k, n in nodes.items()]:
+            try:
+                future.result()
+            except Exception as e:
+                traceback.print_exc()
+                logger.warning(f"Error synonymizing> {nodes[node_key].id}")
+                failed.add(node_key)
+        synonymized = []
+        for (node, history, edge), source in zip(frontier, is_source):
+            if id(node) in failed:
+                continue
+            if edge is not None:
+                if source:
+                    edge.source_id = node.id
+                else:
+                    edge.target_id = node.id
+            synonymized.append((node, history, edge))
+        return synonymized
+
     #CAN I SOMEHOW CAPTURE PATHS HERE>>>>
 
     def run_program(self):
         """Loop over unused nodes, send them to the appropriate operator, and collect the results.
         Keep going until there's no nodes left to process."""
         logger.debug(f"Running program {self.program_number}")
-        self.initialize_instance_nodes()
-        if self.channel is not None:
-            self.channel.basic_publish(exchange='',
-                routing_key='neo4j',
-                body='flush')
+        try:
+            if self.executor == 'frontier':
+                self.run_frontiers()
+            else:
+                self.initialize_instance_nodes()
+        finally:
+            # Writes (or sends) whatever is buffered; a publisher also tells the writer service to flush.
+            self.writer.close()
+        self.rosetta.cache.log_stats()
+        self.rosetta.service_context.http.log_stats()
         return
 
     def get_path_descriptor(self):
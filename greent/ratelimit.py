@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging(__name__, logging.INFO)
+
+class TokenBucket:
+    """ Paces calls to `rate` per second, allowing bursts of up to `burst` calls.
+
+    Callers reserve a token and sleep until their reserved slot comes up, so a busy source
+    is called at exactly its allowed rate however many threads are waiting on it. """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(self.rate, 1))
+        self.tokens = self.burst
+        self.stamp = time.time ()
+        self.lock = threading.Lock ()
+
+    def reserve (self, tokens=1):
+        """ Take tokens, returning the seconds the caller must wait before using them. """
+        with self.lock:
+            now = time.time ()
+            self.tokens = min (self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= tokens
+            return max (0.0, -self.tokens / self.rate)
+
+    def acquire (self, tokens=1):
+        wait = self.reserve (tokens)
+        if wait > 0:
+            time.sleep (wait)
+        return wait
+
+class RedisTokenBucket(TokenBucket):
+    """ A token bucket kept in redis so every process calling a source shares its rate.
+    Falls back to a local bucket if redis can't be reached. """
+
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local want = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(state[1]) or burst
+local stamp = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - stamp) * rate) - want
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'stamp', tostring(math.max(now, stamp)))
+redis.call('PEXPIRE', KEYS[1], math.ceil(1000 * (burst - tokens) / rate) + 1000)
+if tokens >= 0 then return '0' end
+return tostring(-tokens / rate)
+"""
+
+    def __init__(self, redis, key, rate, burst=None):
+        super(RedisTokenBucket, self).__init__(rate, burst)
+        self.key = key
+        self.script = redis.register_script (self.SCRIPT)
+
+    def reserve (self, tokens=1):
+        try:
+            return float(self.script (keys=[self.key], args=[self.rate, self.burst, time.time (), tokens]))
+        except Exception as e:
+            logger.warning (f"Shared rate limit {self.key} unavailable, limiting locally: {e}")
+            return super(RedisTokenBucket, self).reserve (tokens)
+
+class RateLimiter:
+    """ Per-source rate limits, read from the rate_limits section of greent.conf.
+    Each source entry gives a rate (calls per second), an optional burst, and whether the
+    limit is shared with other processes through redis.  Sources without an entry are not limited. """
+
+    def __init__(self, config=None, redis=None):
+        self.config = {} if config is None else config
+        self.redis = redis
+        self.buckets = {}
+        self.lock = threading.Lock ()
+
+    def get (self, source):
+        """ The bucket for a source, or None if it has no limit. """
+        if not source:
+            return None
+        with self.lock:
+            if source not in self.buckets:
+                self.buckets[source] = self.create (source, self.config.get (source))
+            return self.buckets[source]
+
+    def create (self, source, limit):
+        if limit is None or not limit.get ("rate"):
+            return None
+        rate = float(limit.get ("rate"))
+        burst = limit.get ("burst")
+        burst = float(burst) if burst else None
+        if str(limit.get ("shared", False)).lower () == "true" and self.redis is not None:
+            return RedisTokenBucket (self.redis, f"ratelimit:{source}", rate, burst)
+        return TokenBucket (rate, burst)
+
+    def acquire (self, source, tokens=1):
+        """ Block until `source` may be called.  Returns the seconds waited. """
+        bucket = self.get (source)
+        return bucket.acquire (tokens) if bucket is not None else 0
@@ -13,6 +13,7 @@ from greent.graph import Frame
 from greent.graph import TypeGraph
 from greent.graph_components import KNode, KEdge
 from greent.identifiers import Identifiers
+from greent.opregistry import OpRegistry
 from greent.program import Program
 from greent.program import QueryDefinition
 from greent.synonymization import Synonymizer
@@ -64,6 +65,9 @@ class Rosetta:
         """ Merge identifiers.org vocabulary into Rosetta vocab. """
         self.identifiers = Identifiers()
 
+        """ Resolve op names to functions once. """
+        self.op_registry = OpRegistry(self.core)
+
         if delete_type_graph:
             logger.debug("--Deleting type graph")
             self.type_graph.delete_all()
@@ -75,11 +79,9 @@ class Rosetta:
                 if isinstance(v, str):
                     self.type_graph.find_or_create(k, v)
             '''
-            self.type_graph.find_or_create_list(self.identifiers.vocab.items())
             # self.configure_local_operators ()
-            self.type_graph.configure_operators(self.operators.items())
             # self.configure_translator_registry ()
-            self.type_graph.cast_edges(self.type_checks)
+            self.type_graph.initialize(self.identifiers.vocab.items(), self.operators.items(), self.type_checks)
 
         if build_indexes:
             """Create neo4j indices for identifier on different labels"""
@@ -142,8 +144,8 @@ class Rosetta:
 
     def get_ops(self, names):
         """ Dynamically locate python methods corresponding to names configured for semantic links. """
-        return operator.attrgetter(names)(self.core) if isinstance(names, str) else [
-            operator.attrgetter(n)(self.core) for n in names]
+        return self.op_registry.get(names) if isinstance(names, str) else [
+            self.op_registry.get(n) for n in names]
 
     def log_debug(self, text, cycle=0, if_empty=False):
         if cycle < 3:
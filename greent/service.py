@@ -1,3 +1,4 @@
+import functools
 import os
 from greent.graph_components import KEdge
 from greent.util import LoggingUtil
@@ -11,6 +12,7 @@ class Service:
         self.context = context
         self.name = name
         self.url = context.config.get_service (self.name).get("url", None)
+        self.http = context.http
         try:
             self.concept_model = getattr(context, 'rosetta-graph').concept_model
         except:
@@ -49,3 +51,40 @@ class Service:
                      url=url,
                      properties=properties)
 
+class batch_op:
+    """ Decorates an op, a service method taking one KNode and returning [(edge, node)], whose source can
+    answer many nodes in one request.  The op is called as before; bound to a service it also has
+    batch(nodes) -> {node.id: [(edge, node)]}, once a batch form is registered with
+
+        @drug_to_gene.batch
+        def drug_to_gene_batch(self, drugs): ...
+
+    Nodes missing from the batch result have no results. """
+    def __init__(self, function):
+        self.function = function
+        self.batch_function = None
+        functools.update_wrapper (self, function)
+
+    def batch(self, batch_function):
+        self.batch_function = batch_function
+        return batch_function
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        if self.batch_function is None:
+            return self.function.__get__ (instance, owner)
+        return BoundBatchOp (self, instance)
+
+class BoundBatchOp:
+    """ A batch_op bound to its service. """
+    def __init__(self, op, service):
+        self.op = op
+        self.service = service
+        functools.update_wrapper (self, op.function)
+
+    def __call__(self, node):
+        return self.op.function (self.service, node)
+
+    def batch(self, nodes):
+        return self.op.batch_function (self.service, nodes)
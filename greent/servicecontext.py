@@ -1,7 +1,10 @@
 import os
-from greent.cache import Cache
+from greent.cache import Cache, ExpiryPolicy, serializers
+from greent.concordance import ConcordanceStore
 from greent.core import GreenT
 from greent.config import Config
+from greent.httpclient import HttpClient
+from greent.ratelimit import RateLimiter
 from greent.util import LoggingUtil
 import socket
 
@@ -17,10 +20,37 @@ class ServiceContext:
         
         # Initiaize the cache.
         redis_conf = self.config["cache"]
+        serializer_conf = redis_conf.get ("serializer", {})
+        serializer_options = { k : serializer_conf.get (k) for k in ("compression", "compression_threshold")
+                               if serializer_conf.get (k) is not None }
+        memory_conf = redis_conf.get ("memory", {})
+        disk_conf = redis_conf.get ("disk", {})
+        expiry_conf = redis_conf.get ("expiry", {})
         self.cache = Cache (
             redis_host = redis_conf.get ("host"),
             redis_port = redis_conf.get ("port"),
-            redis_db = redis_conf.get ("db"))
+            redis_db = redis_conf.get ("db"),
+            serializer = serializers[serializer_conf.get ("name", "pickle")] (**serializer_options),
+            memory_max_bytes = int(memory_conf.get ("max_bytes", 64*1024*1024)),
+            negative_ttl = memory_conf.get ("negative_ttl", 60),
+            disk_path = disk_conf.get ("path"),
+            disk_max_bytes = disk_conf.get ("max_bytes"),
+            expiry = ExpiryPolicy (expiry_conf.get ("prefixes", []), expiry_conf.get ("default")),
+            lock_timeout = redis_conf.get ("lock_timeout", 300),
+            bulk_chunk_size = redis_conf.get ("bulk_chunk_size", 10000))
+
+        # Calls to each source are paced by its rate limit and go through one pooled client.
+        self.rate_limiter = RateLimiter (self.config.get ("rate_limits", {}), redis=self.cache.redis)
+        self.http = HttpClient (self.config.get ("http", {}), limiter=self.rate_limiter)
+
+        # Local concordance index, if one has been built.
+        concordance_conf = self.config.get ("concordance", {})
+        self.concordance = None
+        if concordance_conf.get ("path"):
+            self.concordance = ConcordanceStore (
+                concordance_conf.get ("path"),
+                mmap_size = concordance_conf.get ("mmap_size", 1024*1024*1024),
+                serializer = self.cache.serializer)
         #redis_conf = self.config["redis"]
         #self.cache = Cache (
         #    redis_host = self.config.get ("RESULTS_HOST"),
@@ -1,5 +1,4 @@
-import requests
-import urllib
+import urllib.parse
 from greent.service import Service
 from greent.ontologies.mondo2 import Mondo2
 from greent.ontologies.go2 import GO2
@@ -21,26 +20,17 @@ class Biolink(Service):
         self.go = context.core.go
         self.label2id = {'colocalizes_with': 'RO:0002325', 'contributes_to': 'RO:0002326'}
 
-    #TODO: share the retry logic in Service?
     def query(self,url):
         """The biolink functions mostly work nicely - if the identifier is unresolvable, they return
         a valid json with no results.   However, gene/{id}/function throws a 500 (yuck).  So if there's a 500 from
-        any endpoint, don't try again."""
-        done = False
-        num_tries = 0
-        max_tries = 10
-        wait_time = 5 # seconds
-        while num_tries < max_tries:
-            try:
-                r = requests.get(url)
-                if r.status_code == 500:
-                    return None
-                #Anything else, it's either good or we want to retry on exception.
-                return r.json()
-            except Exception as e:
-                num_tries += 1
-                time.sleep(wait_time)
-        return None
+        any endpoint, don't try again.  Timeouts and throttling are retried by the http client."""
+        try:
+            r = self.http.get(url, service=self.name)
+            if r.status_code == 500:
+                return None
+            return r.json()
+        except Exception as e:
+            return None
  
         
     def process_associations(self, r, function, target_node_type, input_identifier, url, input_node, reverse=False):
@@ -10,6 +10,8 @@ logger = LoggingUtil.init_logging(__name__, level=logging.DEBUG)
 class Caster(Service):
 
     def __init__(self, context, core):
+        # Set first: __getattr__ treats any other missing attribute as an op.
+        self.compiled = {}
         super(Caster, self).__init__("caster", context)
         self.core = core
 
@@ -57,31 +59,76 @@ class Caster(Service):
             args = argstring.split(',')
         return fname,args
 
-    def create_function(self,functiontext):
+    def compile(self, functiontext):
+        """Parse a cast expression into a CastOp, once.  Every expression, including the ones nested
+        inside it, is cached, so later lookups of the same op cost a dict access."""
+        cast_op = self.compiled.get(functiontext)
+        if cast_op is None:
+            cast_op = self.create_cast_op(functiontext)
+            self.compiled[functiontext] = cast_op
+        return cast_op
+
+    def create_cast_op(self, functiontext):
         #if functiontext.strip()=='':
         #    raise Exception(f"Illegal Argument: '{functiontext}'")
         if '(' in functiontext:
             fname, args = self.unwrap(functiontext)
             if fname == 'output_filter':
-                newargs = [ self.create_function(args[0]), args[1], self.create_function(args[2])]
-                return functools.partial( self.output_filter, *newargs)
+                inner, check = self.compile(args[0]), self.compile(args[2])
+                function = functools.partial( self.output_filter, inner.function, args[1], check.function)
+                return CastOp(functiontext, function, inner, fname, args[1], check.base_op)
             elif fname == 'upcast':
-                newargs = [ self.create_function(args[0]), args[1] ]
-                return functools.partial( self.upcast, *newargs)
+                inner = self.compile(args[0])
+                function = functools.partial( self.upcast, inner.function, args[1])
+                return CastOp(functiontext, function, inner, fname, args[1])
             elif fname == 'input_filter':
-                newargs = [ self.create_function(args[0]), args[1] ]
-                if len(args) == 3:
-                    newargs.append( self.create_function(args[2]))
-                else:
-                    newargs.append(None)
-                return functools.partial( self.input_filter, *newargs)
+                inner = self.compile(args[0])
+                check = self.compile(args[2]) if len(args) == 3 else None
+                function = functools.partial( self.input_filter, inner.function, args[1], check.function if check else None)
+                return CastOp(functiontext, function, inner, fname, args[1], check.base_op if check else None)
             else:
                 raise Exception("Function caster.{} does not exist".format(functiontext))
         else:
             fname = '.'.join(functiontext.split('~'))
-            return operator.attrgetter(fname)(self.core)
+            return CastOp(functiontext, operator.attrgetter(fname)(self.core))
+
+    def create_function(self,functiontext):
+        return self.compile(functiontext).function
 
     def __getattr__(self,attr):
+        if attr.startswith('__') or attr == 'compiled':
+            raise AttributeError(attr)
         logger.debug("getattr: {}".format(attr))
         return self.create_function(attr)
 
+class CastOp:
+    """A parsed cast expression: the function to call, and what it is made of.  A plain op
+    (service~function) has no cast; otherwise cast is input_filter, output_filter or upcast, applied
+    with type (and type_check, the op that checks it) to the inner CastOp."""
+
+    def __init__(self, text, function, inner=None, cast=None, type=None, type_check=None):
+        self.text = text
+        self.function = function
+        self.inner = inner
+        self.cast = cast
+        self.type = type
+        self.type_check = type_check
+        self.base_op = inner.base_op if inner else '.'.join(text.split('~'))
+
+    @property
+    def filters(self):
+        """The casts applied, outermost first."""
+        filters = [ {'cast': self.cast, 'type': self.type, 'type_check': self.type_check} ] if self.cast else []
+        return filters + (self.inner.filters if self.inner else [])
+
+    @property
+    def input_type(self):
+        if self.cast == 'input_filter':
+            return self.type
+        return self.inner.input_type if self.inner else None
+
+    @property
+    def output_type(self):
+        if self.cast in ('output_filter', 'upcast'):
+            return self.type
+        return self.inner.output_type if self.inner else None
@@ -1,7 +1,6 @@
 import logging
-import requests
 from datetime import datetime as dt
-from greent.service import Service
+from greent.service import Service, batch_op
 from greent.graph_components import KNode, LabeledID
 from greent.util import Text, LoggingUtil
 from greent import node_types
@@ -90,11 +89,11 @@ class CTD(Service):
 
     def drugname_string_to_drug_identifier(self,drugname):
         #First, check to see if the name is already an exact name of something
-        chemnamerows = requests.get (f"{self.url}CTD_chemicals_ChemicalName/{drugname}/").json ()
+        chemnamerows = self.http.get(f"{self.url}CTD_chemicals_ChemicalName/{drugname}/", service=self.name).json ()
         keepers = [ x for x in chemnamerows if x['ChemicalName'].upper() == drugname.upper()]
         if len(keepers) == 0:
             #Didn't find exact name match, so now see if there is an exact synonym
-            synonamerows = requests.get (f"{self.url}CTD_chemicals_Synonyms/{drugname}/").json ()
+            synonamerows = self.http.get(f"{self.url}CTD_chemicals_Synonyms/{drugname}/", service=self.name).json ()
             for row in synonamerows:
                 synonyms = [syn.upper() for syn in row['Synonyms'].split('|')]
                 if drugname.upper() in synonyms:
@@ -124,63 +123,93 @@ class CTD(Service):
         renamed = [ f'{b[0]}^{self.term_parents[b[1]]}' for b in breakups]
         return f'CTD:{"|".join(renamed)}'
 
+    @batch_op
     def drug_to_gene(self, drug):
-        output = []
-        identifiers = drug.get_synonyms_by_prefix('MESH')
-        for identifier in identifiers:
-            url=f"{self.url}/CTD_chem_gene_ixns_ChemicalID/{Text.un_curie(identifier)}/"
-            obj = requests.get(url).json ()
-            for r in obj:
-                #Let's only keep humans for now:
-                if r['OrganismID'] != '9606':
-                    continue
-                props = {"description": r[ 'Interaction' ]}
-                predicate_label = r['InteractionActions']
-                predicate = LabeledID(identifier=self.get_ctd_predicate_identifier(predicate_label), label=predicate_label)
-                gene_node = KNode(f"NCBIGENE:{r['GeneID']}", type=node_types.GENE)
-                if sum([s in predicate.identifier for s in self.g2d_strings]) > 0:
-                    subject = gene_node
-                    object = drug
-                else:
-                    subject = drug
-                    object = gene_node
-                edge = self.create_edge(subject,object,'ctd.drug_to_gene',identifier,predicate,
-                                        publications=[f"PMID:{r['PubMedIDs']}"],url=url,properties=props)
-                output.append( (edge,gene_node) )
+        return self.drug_to_gene_batch([drug])[drug.id]
+
+    @drug_to_gene.batch
+    def drug_to_gene_batch(self, drugs):
+        """drug_to_gene for many drugs.  CTD is queried per MESH identifier, so each identifier is
+        fetched once however many of the drugs share it."""
+        responses = {}
+        output = {}
+        for drug in drugs:
+            results = output.setdefault(drug.id, [])
+            for identifier in drug.get_synonyms_by_prefix('MESH'):
+                if identifier not in responses:
+                    url=f"{self.url}/CTD_chem_gene_ixns_ChemicalID/{Text.un_curie(identifier)}/"
+                    responses[identifier] = (url, self.http.get(url, service=self.name).json ())
+                url, obj = responses[identifier]
+                results.extend(self.drug_gene_edges(drug, identifier, url, obj))
         return output
 
+    def drug_gene_edges(self, drug, identifier, url, obj):
+        output = []
+        for r in obj:
+            #Let's only keep humans for now:
+            if r['OrganismID'] != '9606':
+                continue
+            props = {"description": r[ 'Interaction' ]}
+            predicate_label = r['InteractionActions']
+            predicate = LabeledID(identifier=self.get_ctd_predicate_identifier(predicate_label), label=predicate_label)
+            gene_node = KNode(f"NCBIGENE:{r['GeneID']}", type=node_types.GENE)
+            if sum([s in predicate.identifier for s in self.g2d_strings]) > 0:
+                subject = gene_node
+                object = drug
+            else:
+                subject = drug
+                object = gene_node
+            edge = self.create_edge(subject,object,'ctd.drug_to_gene',identifier,predicate,
+                                    publications=[f"PMID:{r['PubMedIDs']}"],url=url,properties=props)
+            output.append( (edge,gene_node) )
+        return output
 
+    @batch_op
     def gene_to_drug(self, gene_node):
+        return self.gene_to_drug_batch([gene_node])[gene_node.id]
+
+    @gene_to_drug.batch
+    def gene_to_drug_batch(self, gene_nodes):
+        """gene_to_drug for many genes, fetching each NCBIGENE identifier once."""
+        responses = {}
+        output = {}
+        for gene_node in gene_nodes:
+            results = output.setdefault(gene_node.id, [])
+            for identifier in gene_node.get_synonyms_by_prefix('NCBIGENE'):
+                if identifier not in responses:
+                    url = f"{self.url}/CTD_chem_gene_ixns_GeneID/{Text.un_curie(identifier)}/"
+                    responses[identifier] = (url, self.http.get(url, service=self.name).json ())
+                url, obj = responses[identifier]
+                results.extend(self.gene_drug_edges(gene_node, identifier, url, obj))
+        return output
+
+    def gene_drug_edges(self, gene_node, identifier, url, obj):
         output = []
-        identifiers = gene_node.get_synonyms_by_prefix('NCBIGENE')
-        for identifier in identifiers:
-            unique = set()
-            geneid = Text.un_curie(identifier)
-            url = f"{self.url}/CTD_chem_gene_ixns_GeneID/{geneid}/"
-            obj = requests.get (url).json ()
-            for r in obj:
-                #Let's only keep humans for now:
-                if r['OrganismID'] != '9606':
-                    continue
-                if r['GeneID'] != geneid:
-                    continue
-                props = {"description": r[ 'Interaction' ]}
-                predicate_label = r['InteractionActions']
-                predicate = LabeledID(identifier=self.get_ctd_predicate_identifier(predicate_label), label=predicate_label)
-                #Should this be substance?
-                drug_node = KNode(f"MESH:{r['ChemicalID']}", type=node_types.DRUG, name=f"{r['ChemicalName']}")
-                if sum([s in predicate.identifier for s in self.g2d_strings]) > 0:
-                    subject = gene_node
-                    obj = drug_node
-                else:
-                    subject = drug_node
-                    obj = gene_node
-                edge = self.create_edge(subject,obj,'ctd.gene_to_drug',identifier,predicate,
-                                        publications=[f"PMID:{r['PubMedIDs']}"],url=url,properties=props)
-                key = (drug_node.id, predicate.label)
-                if key not in unique:
-                    output.append( (edge,drug_node) )
-                    unique.add(key)
+        unique = set()
+        geneid = Text.un_curie(identifier)
+        for r in obj:
+            #Let's only keep humans for now:
+            if r['OrganismID'] != '9606':
+                continue
+            if r['GeneID'] != geneid:
+                continue
+            props = {"description": r[ 'Interaction' ]}
+            predicate_label = r['InteractionActions']
+            predicate = LabeledID(identifier=self.get_ctd_predicate_identifier(predicate_label), label=predicate_label)
+            #Should this be substance?
+            drug_node = KNode(f"MESH:{r['ChemicalID']}", type=node_types.DRUG, name=f"{r['ChemicalName']}")
+            if sum([s in predicate.identifier for s in self.g2d_strings]) > 0:
+                subject = gene_node
+                obj = drug_node
+            else:
+                subject = drug_node
+                obj = gene_node
+            edge = self.create_edge(subject,obj,'ctd.gene_to_drug',identifier,predicate,
+                                    publications=[f"PMID:{r['PubMedIDs']}"],url=url,properties=props)
+            key = (drug_node.id, predicate.label)
+            if key not in unique:
+                output.append( (edge,drug_node) )
+                unique.add(key)
         return output
 
     def disease_to_exposure(self, disease_node):
@@ -189,7 +218,7 @@ class CTD(Service):
         for identifier in identifiers:
             unique = set()
             url = f"{self.url}CTD_exposure_events_diseaseid/{Text.un_curie(identifier)}/"
-            obj = requests.get (url).json ()
+            obj = self.http.get(url, service=self.name).json ()
             for r in obj:
                 predicate_label = r['outcomerelationship']
                 if predicate_label == 'no correlation':
@@ -211,7 +240,7 @@ class CTD(Service):
         for identifier in identifiers:
             unique = set()
             url = f"{self.url}CTD_chemicals_diseases_DiseaseID/{Text.un_curie(identifier)}/"
-            obj = requests.get (url).json ()
+            obj = self.http.get(url, service=self.name).json ()
             for r in obj:
                 predicate_label = r['DirectEvidence']
                 if predicate_label == '':
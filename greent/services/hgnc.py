@@ -1,11 +1,9 @@
-import requests
 from greent import node_types
 from greent.graph_components import LabeledID
 from greent.service import Service
 from greent.util import LoggingUtil
 from builder.question import LabeledID
 
-import time
 import logging
 
 
@@ -33,24 +31,16 @@ class HGNC(Service):
     def __init__(self, context): 
         super(HGNC, self).__init__("hgnc", context)
 
-    #TODO: share the retry logic in Service?
     def query(self,url,headers):
         """if the prefix is malformed, then you get a 400.  If the prefix is ok, but there is no data, you get
-        a valid json response with no entries.  So failures here are most likely timeouts and stuff like that."""
-        done = False
-        num_tries = 0
-        max_tries = 2
-        wait_time = 5 # seconds
+        a valid json response with no entries.  So failures here are most likely timeouts and stuff like that,
+        which the http client retries."""
         logger.debug(f'Try {url}')
-        while num_tries < max_tries:
-            try:
-                response = requests.get(url , headers= headers)
-                return response.json()
-            except Exception as e:
-                logger.error(response)
-                logger.error(f'Threw exception {e}')
-                num_tries += 1
-                time.sleep(wait_time)
+        try:
+            response = self.http.get(url, service=self.name, headers=headers)
+            return response.json()
+        except Exception as e:
+            logger.error(f'Threw exception {e}')
         return None
         
 
@@ -76,11 +66,8 @@ class HGNC(Service):
         return symbol 
 
     def get_synonyms(self, identifier):
-        #HGNC doesn't want to handle more than 10 of these a second (from one IP).  If we think that we're
-        # going to be running in parallel, that means a simple wait should fix it.  ESPECIALLY, since we should
-        # almost never be calling this - everything should be pre-cached.  So this little wait time, which is
-        # terrible, should in the end not matter very much
-        time.sleep(0.2)
+        #HGNC doesn't want to handle more than 10 of these a second (from one IP).  The hgnc entry in the
+        # rate_limits section of greent.conf paces every caller, across processes, to stay under that.
         identifier_parts = identifier.split(':')
         prefix = identifier_parts[0]
         gid = identifier_parts[1]
@@ -1,4 +1,3 @@
-import requests
 from greent import node_types
 from greent.graph_components import KNode, LabeledID
 from greent.service import Service
@@ -22,7 +21,7 @@ class MyChem(Service):
         for cid in chemblids:
             ident = Text.un_curie(cid)
             murl = f'{self.url}query?q=chembl.molecule_hierarchy.molecule_chembl_id:{ident}&fields=aeolus'
-            result = requests.get(murl).json()
+            result = self.http.get(murl, service=self.name).json()
             for hit in result['hits']:
                 #import json
                 #print(json.dumps(hit,indent=4))
@@ -66,7 +65,7 @@ class MyChem(Service):
         for cid in chemblids:
             ident = Text.un_curie(cid)
             murl = f'{self.url}query?q=chembl.molecule_hierarchy.molecule_chembl_id:{ident}&fields=drugcentral'
-            result = requests.get(murl).json()
+            result = self.http.get(murl, service=self.name).json()
             for hit in result['hits']:
                 if 'drugcentral' in hit:
                     dc = hit['drugcentral']
@@ -89,7 +88,7 @@ class MyChem(Service):
         return return_results
 
     def query(self,url):
-        result = requests.get(url).json()
+        result = self.http.get(url, service=self.name).json()
         return result
 
     def page_calls(self,url,nper):
@@ -176,25 +176,21 @@ class OmniCorp(Service):
         return pubmeds
 
     def call_with_retries(self,fnc,args):
-        done = False
-        ntries = 0
-        maxtries = 100
-        rest_time = 10 #seconds
+        """Call at the rate allowed for omnicorp, backing off (with the http client's policy) on errors."""
+        maxtries = 20
         start = datetime.datetime.now()
-        while not done and ntries < maxtries:
+        for ntries in range(maxtries):
+            self.context.rate_limiter.acquire(self.name)
             try:
                 result = fnc(*args)
-                done = True
             except:
                 logger.warn("OmniCorp error, retrying")
-                time.sleep(rest_time)
-                ntries += 1
-        if not done:
-            return None
-        else:
+                time.sleep(self.http.delay(ntries))
+                continue
             end = datetime.datetime.now()
-            logger.debug(f'Total call ntries: {ntries}, time: {end-start}')
+            logger.debug(f'Total call ntries: {ntries+1}, time: {end-start}')
             return result
+        return None
 
     def count_pmids(self, node):
         identifier = self.get_omni_identifier(node)
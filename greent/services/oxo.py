@@ -1,8 +1,6 @@
 import json
-import requests
 from greent.service import Service
 from greent.graph_components import LabeledID
-import time
 from builder.question import LabeledID
 
 
@@ -11,6 +9,8 @@ class OXO(Service):
 
     def __init__(self, context):  # url="https://www.ebi.ac.uk/spot/oxo/api/search?size=500"):
         super(OXO, self).__init__("oxo", context)
+        #How many ids to send in one search.  Should not exceed the page size (size=) in the service url.
+        self.batch_size = int(self.get_config().get("batch_size", 500))
         self.build_valid_curie_prefixes()
 
     def build_valid_curie_prefixes(self):
@@ -33,50 +33,36 @@ class OXO(Service):
         return cp in self.curies or cp.upper() in self.curies
 
     def request(self, url, obj):
-        return requests.post(self.url,
-                             data=json.dumps(obj, indent=2),
-                             headers={"Content-Type": "application/json"})
+        return self.http.post(url,
+                              service=self.name,
+                              data=json.dumps(obj, indent=2),
+                              headers={"Content-Type": "application/json"})
 
     def query(self, ids, distance=2):
-        #Occasionally, OXO will throw an exception in here, maybe due to load?
+        #Occasionally, OXO will throw an exception in here, maybe due to load?  The http client retries those.
         #Calling with an unknown id just returns an empty set, so that's fine
-        done = False
-        num_tries = 0
-        max_tries = 10
-        wait_time = 5 # seconds
-        while num_tries < max_tries:
-            try:
-                res = self.request(
-                    url=self.url,
-                    obj={
-                        "ids": ids,
-                        "mappingTarget": [],
-                        "distance": str(distance),
-                        "size": 10000
-                    })
-                if res.status_code == 200:
-                    return res.json()
-            except Exception as e:
-                num_tries += 1
-                time.sleep(wait_time)
+        try:
+            res = self.request(
+                url=self.url,
+                obj={
+                    "ids": ids,
+                    "mappingTarget": [],
+                    "distance": str(distance),
+                    "size": 10000
+                })
+            if res.status_code == 200:
+                return res.json()
+        except Exception as e:
+            pass
         return None
 
-    #TODO smush with the post version
     def safeget(self, url):
-        #Occasionally, OXO will throw an exception in here, maybe due to load?
-        #Calling with an unknown id just returns an empty set, so that's fine
-        done = False
-        num_tries = 0
-        max_tries = 10
-        wait_time = 5 # seconds
-        while num_tries < max_tries:
-            try:
-                resp = requests.get(url)
-                if resp.status_code == 200:
-                    return resp.json()
-            except Exception as e:
-                num_tries += 1
-                time.sleep(wait_time)
+        try:
+            resp = self.http.get(url, service=self.name)
+            if resp.status_code == 200:
+                return resp.json()
+        except Exception as e:
+            pass
         return None
 
     #This is the main call into here.  It's what the synonymizer uses.
@@ -89,16 +75,26 @@ class OXO(Service):
         synonyms = self.get_synonyms(identifier, distance)
         return set([LabeledID(identifier=x['curie'], label=x['label']) for x in synonyms])
 
+    #Batched version of get_synonymous_curies_and_labels: a map from each identifier to its labeled synonyms
+    def get_synonymous_curies_and_labels_many(self, identifiers, distance=2):
+        synonyms = self.get_synonyms_many(identifiers, distance)
+        return { identifier: set([LabeledID(identifier=x['curie'], label=x['label']) for x in others])
+                 for identifier, others in synonyms.items() }
+
     def get_synonyms(self, identifier, distance=2):
         """ Find all synonyms for a curie for a given distance . """
-        others = []
-        response = self.query(ids=[identifier], distance=distance)
-        try:
-            searchResults = response['_embedded']['searchResults']
-        except KeyError as e:
-            raise e
-        if len(searchResults) > 0 and searchResults[0]['queryId'] == identifier:
-            others = searchResults[0]['mappingResponseList']
+        return self.get_synonyms_many([identifier], distance)[identifier]
+
+    def get_synonyms_many(self, identifiers, distance=2):
+        """ Find all synonyms for many curies, sending up to batch_size of them in each request.
+        Returns a map from each identifier to its synonyms (empty if OXO doesn't know it). """
+        identifiers = list(dict.fromkeys(identifiers))
+        others = { identifier: [] for identifier in identifiers }
+        for start in range(0, len(identifiers), self.batch_size):
+            response = self.query(ids=identifiers[start:start+self.batch_size], distance=distance)
+            for result in response['_embedded']['searchResults']:
+                if result['queryId'] in others:
+                    others[result['queryId']] = result['mappingResponseList']
         return others
 
     #these two functions are used only to get icd9 codes for CDW.
@@ -1,6 +1,5 @@
 import asyncio
 import concurrent.futures
-import requests
 import json
 import logging
 import sys
@@ -27,7 +26,7 @@ class Pharos(Service):
     def request(self, url):
         response = None
         try:
-            response = requests.get(url).json()
+            response = self.http.get(url, service=self.name).json()
         except:
             traceback.print_exc()
         return response
@@ -60,7 +59,7 @@ class Pharos(Service):
         There are numerous other synonyms that we could also cache, but I don't see much benefit here. """
         result = None
         try:
-            r = requests.get('https://pharos.nih.gov/idg/api/v1/targets(%s)/synonyms' % target_id)
+            r = self.http.get('https://pharos.nih.gov/idg/api/v1/targets(%s)/synonyms' % target_id, service=self.name)
             result = r.json()
             for synonym in result:
                 if synonym['label'] == 'HGNC':
@@ -71,13 +70,13 @@ class Pharos(Service):
 
     def drugname_string_to_pharos_info(self, drugname):
         """Exposed for use in name lookups without KNodes"""
-        r = requests.get('https://pharos.nih.gov/idg/api/v1/ligands/search?q={}'.format(drugname)).json()
+        r = self.http.get('https://pharos.nih.gov/idg/api/v1/ligands/search?q={}'.format(drugname), service=self.name).json()
         return_results = set()
         foundany = False
         for contents in r['content']:
             foundany=True
             synonym_href = contents['_synonyms']['href']
-            sres = requests.get(synonym_href).json()
+            sres = self.http.get(synonym_href, service=self.name).json()
             for syno in sres:
                 if syno['href'].startswith('https://www.ebi.ac.uk/chembl/compound/inspect/'):
                     term = syno['href'].split('/')[-1]
@@ -103,7 +102,7 @@ class Pharos(Service):
 
     def drugid_to_identifiers(self,refid):
         url = 'https://pharos.nih.gov/idg/api/v1/ligands(%s)/synonyms' % refid
-        result = requests.get(url).json()
+        result = self.http.get(url, service=self.name).json()
         chemblid = None
         label = None
         for element in result:
@@ -122,7 +121,7 @@ class Pharos(Service):
                 pharosid = Text.un_curie(s)
                 original_edge_nodes = []
                 url = 'https://pharos.nih.gov/idg/api/v1/targets(%s)?view=full' % pharosid
-                r = requests.get(url)
+                r = self.http.get(url, service=self.name)
                 try:
                     result = r.json()
                 except:
@@ -153,7 +152,7 @@ class Pharos(Service):
             pharosid = Text.un_curie(s)
             original_edge_nodes = []
             url = 'https://pharos.nih.gov/idg/api/v1/ligands(%s)?view=full' % pharosid
-            r = requests.get(url)
+            r = self.http.get(url, service=self.name)
             try: 
                 result = r.json()
             except:
@@ -182,7 +181,7 @@ class Pharos(Service):
             logging.getLogger('application').debug("Identifier:" + subject.id)
             original_edge_nodes = []
             url='https://pharos.nih.gov/idg/api/v1/diseases/%s?view=full' % pharosid
-            r = requests.get(url)
+            r = self.http.get(url, service=self.name)
             result = r.json()
             predicate=LabeledID(identifier='PHAROS:gene_involved', label='gene_involved')
             for link in result['links']:
@@ -2,7 +2,7 @@ from string import Template
 import json
 import os
 import logging
-from greent.service import Service
+from greent.service import Service, batch_op
 from greent.triplestore import TripleStore
 from greent.util import LoggingUtil
 from greent.util import Text
@@ -27,6 +27,24 @@ class UberonGraphKS(Service):
         """ Execute and return the result of a SPARQL query. """
         return self.triplestore.execute_query (query)
 
+    def query_values (self, text, variable, curies, outputs):
+        """ Run a query once for many inputs.  text uses $values where the VALUES block binding
+        ?variable to each of curies goes, and variable should be among the outputs, so that each
+        result can be matched back to its input.  Returns {curie: [result]}. """
+        results = { curie : [] for curie in curies }
+        if not curies:
+            return results
+        values = f"VALUES ?{variable} {{ {' '.join(sorted(set(curies)))} }}"
+        for result in self.triplestore.query_template(
+                inputs = { 'values': values },
+                outputs = outputs,
+                template_text = text,
+                post = True):
+            curie = Text.obo_to_curie (result[variable])
+            if curie in results:
+                results[curie].append (result)
+        return results
+
 
     def cell_get_cellname (self, cell_identifier):
         """ Identify label for a cell type
@@ -78,6 +96,31 @@ class UberonGraphKS(Service):
         return results
 
 
+    def get_anatomy_parts_batch(self, anatomy_identifiers):
+        """get_anatomy_parts for many UBERON ids in one query.  Returns {id: [part]}."""
+        curies = [ Text.obo_to_curie(i) if i.startswith('http') else i for i in anatomy_identifiers ]
+        text="""
+        prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+        prefix UBERON: <http://purl.obolibrary.org/obo/UBERON_>
+        prefix BFO: <http://purl.obolibrary.org/obo/BFO_>
+        select distinct ?anatomy_id ?part ?partlabel
+        from <http://reasoner.renci.org/nonredundant> 
+        from <http://example.org/uberon-hp-cl.ttl>
+        where {
+                $values
+                ?anatomy_id BFO:0000051 ?part .
+                graph <http://reasoner.renci.org/redundant> {
+                  ?part rdfs:subClassOf UBERON:0001062 .
+                }
+                ?part rdfs:label ?partlabel .
+        }
+        """
+        results = self.query_values(text, 'anatomy_id', curies, [ 'anatomy_id', 'part', 'partlabel' ])
+        for parts in results.values():
+            for result in parts:
+                result['curie'] = Text.obo_to_curie(result['part'])
+        return { identifier : results[curie] for identifier, curie in zip(anatomy_identifiers, curies) }
+
     def anatomy_to_cell (self, anatomy_identifier):
         """ Identify anatomy terms related to cells.
 
@@ -107,6 +150,26 @@ class UberonGraphKS(Service):
         return results
 
 
+    def anatomy_to_cell_batch (self, anatomy_identifiers):
+        """ anatomy_to_cell for many anatomy terms in one query.  Returns {id: [cell]}. """
+        text = """
+        prefix UBERON: <http://purl.obolibrary.org/obo/UBERON_>
+        prefix CL: <http://purl.obolibrary.org/obo/CL_>
+        prefix BFO: <http://purl.obolibrary.org/obo/BFO_>
+        select distinct ?anatomyID ?cellID ?cellLabel
+        from <http://reasoner.renci.org/nonredundant>
+        from <http://example.org/uberon-hp-cl.ttl>
+        where {
+            $values
+            graph <http://reasoner.renci.org/redundant> {
+                ?cellID rdfs:subClassOf CL:0000000 .
+                ?cellID BFO:0000050 ?anatomyID .
+            }
+            ?cellID rdfs:label ?cellLabel .
+        }
+        """
+        return self.query_values (text, 'anatomyID', anatomy_identifiers, [ 'anatomyID', 'cellID', 'cellLabel' ])
+
     def cell_to_anatomy (self, cell_identifier):
         """ Identify anatomy terms related to cells.
 
@@ -134,6 +197,26 @@ class UberonGraphKS(Service):
         )
         return results
 
+    def cell_to_anatomy_batch (self, cell_identifiers):
+        """ cell_to_anatomy for many cell types in one query.  Returns {id: [anatomy]}. """
+        text = """
+        prefix CL: <http://purl.obolibrary.org/obo/CL_>
+        prefix BFO: <http://purl.obolibrary.org/obo/BFO_>
+        prefix UBERON: <http://purl.obolibrary.org/obo/UBERON_>
+        select distinct ?cellID ?anatomyID ?anatomyLabel
+        from <http://reasoner.renci.org/nonredundant>
+        from <http://example.org/uberon-hp-cl.ttl>
+        where {
+            $values
+            graph <http://reasoner.renci.org/redundant> {
+                ?anatomyID rdfs:subClassOf UBERON:0001062 .
+                ?cellID BFO:0000050 ?anatomyID .
+            }
+            ?anatomyID rdfs:label ?anatomyLabel .
+        }
+        """
+        return self.query_values (text, 'cellID', cell_identifiers, [ 'cellID', 'anatomyID', 'anatomyLabel' ])
+
     def phenotype_to_anatomy (self, hp_identifier):
         """ Identify anatomy terms related to cells.
 
@@ -174,6 +257,33 @@ class UberonGraphKS(Service):
         )
         return results
 
+    def phenotype_to_anatomy_batch (self, hp_identifiers):
+        """ phenotype_to_anatomy for many phenotypes in one query.  Returns {id: [anatomy]}. """
+        text = """
+        prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+        prefix UBERON: <http://purl.obolibrary.org/obo/UBERON_>
+        prefix HP: <http://purl.obolibrary.org/obo/HP_>
+        prefix phenotype_of: <http://purl.obolibrary.org/obo/UPHENO_0000001>
+        select distinct ?HPID ?anatomy_id ?anatomy_label ?input_label
+        from <http://reasoner.renci.org/nonredundant>
+        from <http://example.org/uberon-hp-cl.ttl>
+        where {
+                  $values
+                  graph <http://reasoner.renci.org/redundant> {
+                    ?anatomy_id rdfs:subClassOf UBERON:0001062 .
+                  }
+                  ?anatomy_id rdfs:label ?anatomy_label .
+                  graph <http://reasoner.renci.org/nonredundant> {
+                       ?phenotype phenotype_of: ?anatomy_id .
+                  }
+                  graph <http://reasoner.renci.org/redundant> {
+                    ?HPID rdfs:subClassOf ?phenotype .
+                  }
+                  ?HPID rdfs:label ?input_label .
+              }
+        """
+        return self.query_values (text, 'HPID', hp_identifiers, [ 'HPID', 'anatomy_id', 'anatomy_label', 'input_label' ])
+
     def anatomy_to_phenotype(self, uberon_id):
         text="""
         prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#>
@@ -206,26 +316,63 @@ class UberonGraphKS(Service):
         )
         return results
 
+    def anatomy_to_phenotype_batch(self, uberon_ids):
+        """ anatomy_to_phenotype for many anatomy terms in one query.  Returns {id: [phenotype]}. """
+        text="""
+        prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+        prefix UBERON: <http://purl.obolibrary.org/obo/UBERON_>
+        prefix HP: <http://purl.obolibrary.org/obo/HP_>
+        prefix phenotype_of: <http://purl.obolibrary.org/obo/UPHENO_0000001>
+        select distinct ?UBERONID ?pheno_id ?anatomy_label ?pheno_label
+        from <http://reasoner.renci.org/nonredundant>
+        from <http://example.org/uberon-hp-cl.ttl>
+        where {
+                  $values
+                  ?UBERONID rdfs:label ?anatomy_label .
+                  graph <http://reasoner.renci.org/nonredundant> {
+                       ?phenotype phenotype_of: ?UBERONID .
+                  }
+                  graph <http://reasoner.renci.org/redundant> {
+                    ?pheno_id rdfs:subClassOf ?phenotype .
+                  }
+                  ?pheno_id rdfs:label ?pheno_label .
+              }
+        """
+        return self.query_values (text, 'UBERONID', uberon_ids, [ 'UBERONID', 'pheno_id', 'anatomy_label', 'pheno_label' ])
 
+    @batch_op
     def get_anatomy_by_cell_graph (self, cell_node):
-        anatomies = self.cell_to_anatomy (cell_node.id)
-        results = []
+        return self.get_anatomy_by_cell_graph_batch ([cell_node])[cell_node.id]
+
+    @get_anatomy_by_cell_graph.batch
+    def get_anatomy_by_cell_graph_batch (self, cell_nodes):
+        anatomies = self.cell_to_anatomy_batch ([ cell_node.id for cell_node in cell_nodes ])
+        output = {}
         predicate = LabeledID(identifier='BFO:0000050', label='part_of')
-        for r in anatomies:
-            anatomy_node = KNode (Text.obo_to_curie(r['anatomyID']), type=node_types.ANATOMY, name=r['anatomyLabel'] )
-            edge = self.create_edge(cell_node, anatomy_node, 'uberongraph.get_anatomy_by_cell_graph', cell_node.id, predicate)
-            results.append ( (edge, anatomy_node) )
-        return results
+        for cell_node in cell_nodes:
+            results = output.setdefault (cell_node.id, [])
+            for r in anatomies[cell_node.id]:
+                anatomy_node = KNode (Text.obo_to_curie(r['anatomyID']), type=node_types.ANATOMY, name=r['anatomyLabel'] )
+                edge = self.create_edge(cell_node, anatomy_node, 'uberongraph.get_anatomy_by_cell_graph', cell_node.id, predicate)
+                results.append ( (edge, anatomy_node) )
+        return output
 
+    @batch_op
     def get_cell_by_anatomy_graph (self, anatomy_node):
-        cells = self.anatomy_to_cell(anatomy_node.id)
-        results = []
+        return self.get_cell_by_anatomy_graph_batch ([anatomy_node])[anatomy_node.id]
+
+    @get_cell_by_anatomy_graph.batch
+    def get_cell_by_anatomy_graph_batch (self, anatomy_nodes):
+        cells = self.anatomy_to_cell_batch ([ anatomy_node.id for anatomy_node in anatomy_nodes ])
+        output = {}
         predicate = LabeledID(identifier='BFO:0000050', label='part_of')
-        for r in cells:
-            cell_node = KNode (Text.obo_to_curie(r['cellID']), type=node_types.CELL, name=r['cellLabel'] )
-            edge = self.create_edge(cell_node, anatomy_node, 'uberongraph.get_cell_by_anatomy_graph', anatomy_node.id, predicate)
-            results.append ( (edge, cell_node) )
-        return results
+        for anatomy_node in anatomy_nodes:
+            results = output.setdefault (anatomy_node.id, [])
+            for r in cells[anatomy_node.id]:
+                cell_node = KNode (Text.obo_to_curie(r['cellID']), type=node_types.CELL, name=r['cellLabel'] )
+                edge = self.create_edge(cell_node, anatomy_node, 'uberongraph.get_cell_by_anatomy_graph', anatomy_node.id, predicate)
+                results.append ( (edge, cell_node) )
+        return output
 
     def create_phenotype_anatomy_edge(self, node_id, node_label, input_id ,phenotype_node):
         predicate = LabeledID(identifier='GAMMA:0000002', label='inverse of has phenotype affecting')
@@ -241,33 +388,49 @@ class UberonGraphKS(Service):
         #node.name = node_label
         return edge,phenotype_node
 
+    @batch_op
     def get_anatomy_by_phenotype_graph (self, phenotype_node):
-        results = []
-        for curie in phenotype_node.get_synonyms_by_prefix('HP'):
-            anatomies = self.phenotype_to_anatomy (curie)
-            for r in anatomies:
-                edge, node = self.create_phenotype_anatomy_edge(r['anatomy_id'],r['anatomy_label'],curie,phenotype_node)
-                if phenotype_node.name is None:
-                    phenotype_node.name = r['input_label']
-                results.append ( (edge, node) )
-                #These tend to be very high level terms.  Let's also get their parts to
-                #be more inclusive.
-                #TODO: there ought to be a more principled way to take care of this, but
-                #it highlights the uneasy relationship between the high level world of
-                #smartapi and the low-level sparql-vision.
-                part_results = self.get_anatomy_parts( r['anatomy_id'] )
-                for pr in part_results:
-                    pedge, pnode = self.create_phenotype_anatomy_edge(pr['part'],pr['partlabel'],curie,phenotype_node)
-                    results.append ( (pedge, pnode) )
-        return results
+        return self.get_anatomy_by_phenotype_graph_batch ([phenotype_node])[phenotype_node.id]
+
+    @get_anatomy_by_phenotype_graph.batch
+    def get_anatomy_by_phenotype_graph_batch (self, phenotype_nodes):
+        curies = { phenotype_node.id : phenotype_node.get_synonyms_by_prefix('HP') for phenotype_node in phenotype_nodes }
+        anatomies = self.phenotype_to_anatomy_batch ([ curie for node_curies in curies.values() for curie in node_curies ])
+        #These tend to be very high level terms.  Let's also get their parts to
+        #be more inclusive.
+        #TODO: there ought to be a more principled way to take care of this, but
+        #it highlights the uneasy relationship between the high level world of
+        #smartapi and the low-level sparql-vision.
+        parts = self.get_anatomy_parts_batch (list({ r['anatomy_id'] for rows in anatomies.values() for r in rows }))
+        output = {}
+        for phenotype_node in phenotype_nodes:
+            results = output.setdefault (phenotype_node.id, [])
+            for curie in curies[phenotype_node.id]:
+                for r in anatomies[curie]:
+                    edge, node = self.create_phenotype_anatomy_edge(r['anatomy_id'],r['anatomy_label'],curie,phenotype_node)
+                    if phenotype_node.name is None:
+                        phenotype_node.name = r['input_label']
+                    results.append ( (edge, node) )
+                    for pr in parts[r['anatomy_id']]:
+                        pedge, pnode = self.create_phenotype_anatomy_edge(pr['part'],pr['partlabel'],curie,phenotype_node)
+                        results.append ( (pedge, pnode) )
+        return output
 
+    @batch_op
     def get_phenotype_by_anatomy_graph (self, anatomy_node):
-        results = []
-        for curie in anatomy_node.get_synonyms_by_prefix('UBERON'):
-            phenotypes = self.anatomy_to_phenotype (curie)
-            for r in phenotypes:
-                edge, node = self.create_anatomy_phenotype_edge(r['pheno_id'],r['pheno_label'],curie,anatomy_node)
-                if anatomy_node.name is None:
-                    anatomy_node.name = r['anatomy_label']
-                results.append ( (edge, node) )
-        return results
+        return self.get_phenotype_by_anatomy_graph_batch ([anatomy_node])[anatomy_node.id]
+
+    @get_phenotype_by_anatomy_graph.batch
+    def get_phenotype_by_anatomy_graph_batch (self, anatomy_nodes):
+        curies = { anatomy_node.id : anatomy_node.get_synonyms_by_prefix('UBERON') for anatomy_node in anatomy_nodes }
+        phenotypes = self.anatomy_to_phenotype_batch ([ curie for node_curies in curies.values() for curie in node_curies ])
+        output = {}
+        for anatomy_node in anatomy_nodes:
+            results = output.setdefault (anatomy_node.id, [])
+            for curie in curies[anatomy_node.id]:
+                for r in phenotypes[curie]:
+                    edge, node = self.create_anatomy_phenotype_edge(r['pheno_id'],r['pheno_label'],curie,anatomy_node)
+                    if anatomy_node.name is None:
+                        anatomy_node.name = r['anatomy_label']
+                    results.append ( (edge, node) )
+        return output
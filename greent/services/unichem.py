@@ -1,9 +1,7 @@
-import requests
 import pprint
 from greent.service import Service
 from greent.util import Text
 from greent import node_types
-import time
 
 class UniChem(Service):
 
@@ -16,19 +14,11 @@ class UniChem(Service):
         self.curie_to_sourceid = { 'CHEMBL': '1', 'DRUGBANK': '2', 'CHEBI': '7' , 'PUBCHEM': '22'}
         self.sourceid_to_curie = { v:k for k,v in self.curie_to_sourceid.items()}
 
-    #TODO: share the retry logic in Service?
     def query(self,url):
-        done = False
-        num_tries = 0
-        max_tries = 10
-        wait_time = 5 # seconds
-        while num_tries < max_tries:
-            try:
-                return requests.get(url).json()
-            except:
-                num_tries += 1
-                time.sleep(wait_time)
-        return None
+        try:
+            return self.http.get(url, service=self.name).json()
+        except:
+            return None
  
     # Identifiers going into and coming out from the service are not curies, just identifiers
     def get_synonyms(self, identifier):
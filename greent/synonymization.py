@@ -29,6 +29,15 @@ synonymizers = {
     node_types.ANATOMY:oxo_synonymizer,
 }
 
+#The upstream service each synonymizing module leans on.  Used to bound concurrent synonymization per source.
+synonymizer_sources = {
+    hgnc_synonymizer:'hgnc',
+    disease_synonymizer:'oxo',
+    oxo_synonymizer:'oxo',
+    substance_synonymizer:'oxo',
+    cell_synonymizer:'uberongraph',
+}
+
 logger = LoggingUtil.init_logging(__name__, level=logging.DEBUG, format='medium')
 
 class Synonymizer:
@@ -36,13 +45,57 @@ class Synonymizer:
     def __init__(self, concepts, rosetta):
         self.rosetta = rosetta
         self.concepts = concepts
+        #Local index of equivalent identifiers built by the crawler, checked before any synonymizer goes to the network
+        self.concordance = rosetta.service_context.concordance
         
-    def synonymize(self, node):
-        """Given a node, determine its type and dispatch it to the correct synonymizer"""
+    def get_source(self, node):
+        """Return the name of the service that synonymizing this node will call, or None"""
+        return synonymizer_sources.get(synonymizers.get(node.type))
+
+    def get_cached_synonyms(self, nodes):
+        """Look up the cached synonyms for many nodes in one round trip, then the concordance index for the rest.
+        Returns a map from node id to synonyms, or None where they are not known."""
+        keys = {node.id: f"synonymize({node.id})" for node in nodes}
+        cached = self.rosetta.cache.get_many(list(set(keys.values())))
+        synonyms = {node_id: cached[key] for node_id, key in keys.items()}
+        missing = [node_id for node_id, s in synonyms.items() if s is None]
+        if self.concordance is not None and len(missing) > 0:
+            synonyms.update(self.concordance.get_many(missing))
+        return synonyms
+
+    def synonymize_many(self, nodes, cached):
+        """Synonymize, in batches, the uncached nodes whose synonymizers can work on many nodes at once
+        (those with a synonymize_many), and cache the results.  cached is the map from get_cached_synonyms;
+        returns a copy of it with the new synonyms added.  Other nodes are left for synonymize."""
+        batches = defaultdict(dict)
+        for node in nodes:
+            synonymizer = synonymizers.get(node.type)
+            if cached.get(node.id) is None and hasattr(synonymizer, 'synonymize_many'):
+                batches[synonymizer][node.id] = node
+        cached = dict(cached)
+        for synonymizer, batch in batches.items():
+            batch = list(batch.values())
+            logger.debug(f"exec batch: {synonymizer.__name__} x {len(batch)}")
+            try:
+                results = synonymizer.synonymize_many(batch, self.rosetta.core)
+            except Exception as e:
+                logger.warn(f"Batched synonymization failed, falling back to one node at a time: {e}")
+                continue
+            computed = {node.id: synonyms for node, synonyms in zip(batch, results)}
+            self.rosetta.cache.set_many({f"synonymize({node_id})": synonyms for node_id, synonyms in computed.items()})
+            cached.update(computed)
+        return cached
+
+    def synonymize(self, node, synonyms=None):
+        """Given a node, determine its type and dispatch it to the correct synonymizer.
+        synonyms may be passed in if they have already been pulled from the cache (see get_cached_synonyms)."""
         logger.debug('syn {} {}'.format(node.id, node.type))
         key = f"synonymize({node.id})"
         #check the cache. If it's not in there, try to generate it
-        synonyms = self.rosetta.cache.get(key)
+        if synonyms is None:
+            synonyms = self.rosetta.cache.get(key)
+        if synonyms is None and self.concordance is not None:
+            synonyms = self.concordance.get(node.id)
         if synonyms is not None:
             logger.debug (f"cache hit: {key}")
         else:
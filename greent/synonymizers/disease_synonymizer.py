@@ -17,6 +17,19 @@ def synonymize(node,gt):
     synonyms.update(synonymize_with_OXO(node,gt))
     return synonyms
 
+def synonymize_many(nodes,gt):
+    """synonymize for a batch of nodes.  The OXO lookups for the whole batch share a handful of requests."""
+    all_synonyms = []
+    for node in nodes:
+        synonyms = set()
+        if Text.get_curie(node.id) == 'MONDO':
+            synonyms.update(synonymize_with_MONDO(node,gt))
+            node.synonyms.update(synonyms)
+        all_synonyms.append(synonyms)
+    for node, synonyms, oxo_synonyms in zip(nodes, all_synonyms, oxo_synonymizer.synonymize_many(nodes,gt)):
+        synonyms.update(add_mondos(node,oxo_synonyms,gt))
+    return all_synonyms
+
 def synonymize_with_MONDO(node,gt):
     syns = set([ LabeledID(identifier=x, label="") for x in gt.mondo.mondo_get_doid( node.id )])
     syns.update( set( [ LabeledID(identifier=x, label="") for x in gt.mondo.mondo_get_umls( node.id )]) )
@@ -27,6 +40,9 @@ def synonymize_with_MONDO(node,gt):
 
 def synonymize_with_OXO(node,gt):
     synonyms =  oxo_synonymizer.synonymize(node,gt)
+    return add_mondos(node,synonyms,gt)
+
+def add_mondos(node,synonyms,gt):
     node.synonyms.update(synonyms)
     #Now, if we didn't start with a MONDO id, OXO is not going to give us one.
     #So let's get any doids we have and get a mondo from them
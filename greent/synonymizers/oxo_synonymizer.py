@@ -21,6 +21,15 @@ def synonymize(node, gt):
     node.synonyms.update(synonyms)
     return synonyms
 
+def synonymize_many(nodes, gt):
+    """synonymize for a batch of nodes.  The OXO lookups for the whole batch share a handful of requests."""
+    all_synonyms = []
+    for node, synonyms in zip(nodes, get_synonyms_many(nodes, gt)):
+        synonyms = {s for s in synonyms if not s.identifier.startswith('PMID')}
+        node.synonyms.update(synonyms)
+        all_synonyms.append(synonyms)
+    return all_synonyms
+
 def get_synonyms(node, gt, distance=2):
     #OXO doesn't know about every kind of curie.  So let's see if it knows about our node identifier
     synonyms = get_synonyms_with_curie_check(node.id, gt, distance=distance)
@@ -40,6 +49,23 @@ def get_synonyms_with_curie_check( identifier,gt,distance=2):
         synonyms = set()
     return synonyms
 
+def get_synonyms_many(nodes, gt, distance=2):
+    """get_synonyms for a batch of nodes: all of the node identifiers go to OXO together, then the known
+    synonyms of every node that OXO didn't know about."""
+    found = get_synonyms_with_curie_check_many([node.id for node in nodes], gt, distance=distance)
+    all_synonyms = [set(found[node.id]) for node in nodes]
+    unknown = [i for i, synonyms in enumerate(all_synonyms) if len(synonyms) == 0]
+    known = get_synonyms_with_curie_check_many([s.identifier for i in unknown for s in nodes[i].synonyms], gt, distance=distance)
+    for i in unknown:
+        for s in nodes[i].synonyms:
+            all_synonyms[i].update(known[s.identifier])
+    return all_synonyms
+
+def get_synonyms_with_curie_check_many(identifiers, gt, distance=2):
+    valid = [i for i in identifiers if gt.oxo.is_valid_curie_prefix(Text.get_curie(i))]
+    synonyms = gt.oxo.get_synonymous_curies_and_labels_many(valid, distance=distance) if valid else {}
+    return {i: synonyms.get(i, set()) for i in identifiers}
+
 def double_check_for_mesh( node, new_synonyms, gt):
     all_synonyms = set()
     all_synonyms.update(node.synonyms)
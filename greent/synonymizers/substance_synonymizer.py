@@ -36,6 +36,23 @@ def synonymize(node,gt):
         #synonymize_with_CTD(node,gt)
     return synonyms
 
+def synonymize_many(nodes,gt):
+    """synonymize for a batch of nodes.  Each node calls the services in the same order as in synonymize,
+    but the OXO lookups for the whole batch share a handful of requests."""
+    chembl = [Text.get_curie(node.id) == 'CHEMBL' for node in nodes]
+    all_synonyms = []
+    for node, is_chembl in zip(nodes, chembl):
+        synonyms = set()
+        if is_chembl:
+            synonyms.update(synonymize_with_UniChem(node,gt))
+            node.add_synonyms(synonyms)
+        all_synonyms.append(synonyms)
+    for synonyms, oxo_synonyms in zip(all_synonyms, oxo_synonymizer.synonymize_many(nodes,gt)):
+        synonyms.update(oxo_synonyms)
+    for node, synonyms, is_chembl in zip(nodes, all_synonyms, chembl):
+        if not is_chembl:
+            synonyms.update(synonymize_with_UniChem(node,gt))
+    return all_synonyms
 
 def synonymize_with_OXO(node,gt):
     return oxo_synonymizer.synonymize(node,gt)
@@ -0,0 +1,286 @@
+import operator
+from greent.service import Service, batch_op
+from greent.services.ctd import CTD
+from greent.services.uberongraph import UberonGraphKS
+from greent.graph_components import KNode, KEdge, LabeledID
+from greent import node_types
+from greent.program import Program, SourceLimits
+
+class FakeConfig:
+    def get_service(self, name):
+        return {'url': 'http://example.org/'}
+
+class FakeResponse:
+    def __init__(self, rows):
+        self.rows = rows
+    def json(self):
+        return self.rows
+
+class FakeHttp:
+    def __init__(self, rows):
+        self.rows = rows
+        self.urls = []
+    def get(self, url, service=None):
+        self.urls.append(url)
+        return FakeResponse(self.rows.get(url.rstrip('/').split('/')[-1], []))
+
+class FakeContext:
+    config = FakeConfig()
+    def __init__(self, http=None):
+        self.http = http
+
+class FakeConceptModel:
+    def standardize_relationship(self, predicate):
+        return predicate
+
+class Doubler(Service):
+    def __init__(self):
+        super().__init__('doubler', FakeContext())
+        self.batches = []
+    @batch_op
+    def double(self, node):
+        return self.double_batch([node])[node.id]
+    @double.batch
+    def double_batch(self, nodes):
+        self.batches.append([node.id for node in nodes])
+        return {node.id: [(None, node.id * 2)] for node in nodes}
+    @batch_op
+    def single(self, node):
+        return [(None, node.id)]
+
+def test_batch_op_protocol():
+    service = Doubler()
+    a, b = KNode('A:1', type=node_types.GENE), KNode('B:2', type=node_types.GENE)
+    assert service.double(a) == [(None, 'A:1A:1')]
+    assert service.double.batch([a, b]) == {'A:1': [(None, 'A:1A:1')], 'B:2': [(None, 'B:2B:2')]}
+    assert service.batches == [['A:1'], ['A:1', 'B:2']]
+    assert service.double.__name__ == 'double'
+    # Without a registered batch form the op is a plain method.
+    assert not hasattr(service.single, 'batch')
+    assert service.single(a) == [(None, 'A:1')]
+
+def interaction(chemical, gene, action='increases^expression'):
+    return {'OrganismID': '9606', 'Interaction': 'x', 'InteractionActions': action, 'PubMedIDs': '1',
+            'GeneID': gene, 'ChemicalID': chemical, 'ChemicalName': chemical}
+
+def test_ctd_drug_to_gene_batch_fetches_each_identifier_once():
+    http = FakeHttp({'D001': [interaction('D001', '10'), interaction('D001', '11')], 'D002': [interaction('D002', '12')]})
+    ctd = CTD(FakeContext(http))
+    ctd.concept_model = FakeConceptModel()
+    aspirin = KNode('CHEBI:15365', type=node_types.DRUG)
+    aspirin.add_synonyms(['MESH:D001'])
+    salicylate = KNode('CHEBI:26596', type=node_types.DRUG)
+    salicylate.add_synonyms(['MESH:D001', 'MESH:D002'])
+    results = ctd.drug_to_gene.batch([aspirin, salicylate])
+    assert len(http.urls) == 2
+    assert [node.id for edge, node in results['CHEBI:15365']] == ['NCBIGENE:10', 'NCBIGENE:11']
+    assert sorted(node.id for edge, node in results['CHEBI:26596']) == ['NCBIGENE:10', 'NCBIGENE:11', 'NCBIGENE:12']
+    assert all(edge.source_id == 'CHEBI:26596' for edge, node in results['CHEBI:26596'])
+    # The single form is the batch form on one node.
+    assert [node.id for edge, node in ctd.drug_to_gene(aspirin)] == ['NCBIGENE:10', 'NCBIGENE:11']
+
+def test_ctd_gene_to_drug_batch():
+    http = FakeHttp({'10': [interaction('D001', '10'), interaction('D001', '10'), interaction('D002', '10', 'increases^transport')]})
+    ctd = CTD(FakeContext(http))
+    ctd.concept_model = FakeConceptModel()
+    gene = KNode('HGNC:1', type=node_types.GENE)
+    gene.add_synonyms(['NCBIGENE:10'])
+    other = KNode('HGNC:2', type=node_types.GENE)
+    results = ctd.gene_to_drug.batch([gene, other])
+    assert [node.id for edge, node in results['HGNC:1']] == ['MESH:D001', 'MESH:D002']
+    assert results['HGNC:2'] == []
+    # transport interactions run from the gene to the drug
+    assert results['HGNC:1'][1][0].source_id == 'HGNC:1'
+
+class FakeTripleStore:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+    def query_template(self, template_text, outputs, inputs=[], post=False):
+        self.queries.append(inputs['values'])
+        # select distinct
+        rows = {tuple(row[k] for k in outputs) for row in self.rows}
+        return [dict(zip(outputs, row)) for row in sorted(rows)]
+
+def test_uberongraph_batch_is_one_values_query():
+    obo = 'http://purl.obolibrary.org/obo/'
+    uberon = UberonGraphKS(FakeContext())
+    uberon.concept_model = FakeConceptModel()
+    uberon.triplestore = FakeTripleStore([
+        {'anatomyID': obo + 'UBERON_0002048', 'cellID': obo + 'CL_0000001', 'cellLabel': 'one'},
+        {'anatomyID': obo + 'UBERON_0002048', 'cellID': obo + 'CL_0000002', 'cellLabel': 'two'},
+        {'anatomyID': obo + 'UBERON_0000955', 'cellID': obo + 'CL_0000003', 'cellLabel': 'three'}])
+    lung = KNode('UBERON:0002048', type=node_types.ANATOMY)
+    brain = KNode('UBERON:0000955', type=node_types.ANATOMY)
+    heart = KNode('UBERON:0000948', type=node_types.ANATOMY)
+    results = uberon.get_cell_by_anatomy_graph.batch([lung, brain, heart])
+    assert uberon.triplestore.queries == ['VALUES ?anatomyID { UBERON:0000948 UBERON:0000955 UBERON:0002048 }']
+    assert [(node.id, node.name) for edge, node in results['UBERON:0002048']] == [('CL:0000001', 'one'), ('CL:0000002', 'two')]
+    assert [edge.target_id for edge, node in results['UBERON:0000955']] == ['UBERON:0000955']
+    assert results['UBERON:0000948'] == []
+
+def test_uberongraph_phenotype_batch_looks_up_parts_once():
+    obo = 'http://purl.obolibrary.org/obo/'
+    uberon = UberonGraphKS(FakeContext())
+    uberon.concept_model = FakeConceptModel()
+    uberon.triplestore = FakeTripleStore([
+        {'HPID': obo + 'HP_0000001', 'anatomy_id': obo + 'UBERON_0002048', 'anatomy_label': 'lung', 'input_label': 'p1',
+         'part': obo + 'UBERON_0002185', 'partlabel': 'bronchus'},
+        {'HPID': obo + 'HP_0000002', 'anatomy_id': obo + 'UBERON_0002048', 'anatomy_label': 'lung', 'input_label': 'p2',
+         'part': obo + 'UBERON_0002185', 'partlabel': 'bronchus'}])
+    nodes = [KNode('HP:0000001', type=node_types.PHENOTYPE), KNode('HP:0000002', type=node_types.PHENOTYPE)]
+    results = uberon.get_anatomy_by_phenotype_graph.batch(nodes)
+    assert len(uberon.triplestore.queries) == 2
+    assert uberon.triplestore.queries[1] == 'VALUES ?anatomy_id { UBERON:0002048 }'
+    for node in nodes:
+        assert [n.id for edge, n in results[node.id]] == ['UBERON:0002048', 'UBERON:0002185']
+    assert nodes[1].name == 'p2'
+
+class FakeOpCache(dict):
+    def single_flight(self, key, compute):
+        if key not in self:
+            self[key] = compute()
+        return self[key]
+    def set(self, key, value):
+        self[key] = value
+    def get_many(self, keys):
+        return {key: self.get(key) for key in keys}
+    def set_many(self, mapping):
+        self.update(mapping)
+
+class FakeSynonymizer:
+    def get_source(self, node):
+        return None
+    def get_cached_synonyms(self, nodes):
+        return {node.id: None for node in nodes}
+    def synonymize_many(self, nodes, cached):
+        return cached
+    def synonymize(self, node, synonyms=None):
+        pass
+
+class FakeRosetta:
+    def __init__(self, ops):
+        self.ops = ops
+        self.cache = FakeOpCache()
+        self.synonymizer = FakeSynonymizer()
+    def get_ops(self, name):
+        return operator.attrgetter(name)(self.ops)
+
+def make_program(service):
+    program = Program.__new__(Program)
+    program.rosetta = FakeRosetta(type('Core', (), {'doubler': service})())
+    program.limits = SourceLimits({})
+    return program
+
+def test_failed_batch_runs_nodes_one_at_a_time():
+    class Picky(Doubler):
+        @batch_op
+        def double(self, node):
+            if node.id == 'BAD':
+                raise ValueError(node.id)
+            return [(None, node.id * 2)]
+        @double.batch
+        def double_batch(self, nodes):
+            raise ValueError('one of these is bad')
+    program = make_program(Picky())
+    results = program.run_batch('doubler.double', [KNode('A:1', type=node_types.GENE), KNode('BAD', type=node_types.GENE)])
+    assert results['A:1'] == [(None, 'A:1A:1')]
+    assert isinstance(results['BAD'], ValueError)
+    assert program.rosetta.cache['doubler.double(A:1)'] == [(None, 'A:1A:1')]
+
+def test_unresolvable_op_has_no_batch():
+    program = make_program(Doubler())
+    assert program.has_batch('doubler.double')
+    assert not program.has_batch('doubler.single')
+    assert not program.has_batch('nosuch.op')
+
+class Linker:
+    """ Ops over a small fixed graph: links maps (op, node id) to the ids the op returns for that node. """
+    def __init__(self, links, broken=()):
+        self.links = links
+        self.broken = broken
+        self.calls = []
+    def link(self, op, node, target_type):
+        self.calls.append((op, node.id))
+        if (op, node.id) in self.broken:
+            raise ValueError(f'{op}({node.id})')
+        predicate = LabeledID(identifier='RO:0000000', label='related_to')
+        return [(KEdge(source_id=node.id, target_id=target, provided_by=op, original_predicate=predicate, standard_predicate=predicate),
+                 KNode(target, type=target_type)) for target in self.links.get((op, node.id), [])]
+    def drug_to_gene(self, node):
+        return self.link('drug_to_gene', node, node_types.GENE)
+    def gene_to_drug(self, node):
+        return self.link('gene_to_drug', node, node_types.DRUG)
+    def gene_to_disease(self, node):
+        return self.link('gene_to_disease', node, node_types.DISEASE)
+    def disease_to_phenotype(self, node):
+        return self.link('disease_to_phenotype', node, node_types.PHENOTYPE)
+
+class FakeWriter:
+    def __init__(self):
+        self.written = []
+    def write_node(self, node):
+        self.written.append(node.id)
+    def write_edge(self, edge):
+        self.written.append((edge.source_id, edge.target_id))
+
+class FakeQNode:
+    def __init__(self, id, type, curie=None):
+        self.id, self.type, self.curie, self.name = id, type, curie, None
+
+# drug (0) <-> gene (1) -> disease (2) -> phenotype (3)
+PLAN = {0: {1: [{'op': 'linker.drug_to_gene'}]},
+        1: {0: [{'op': 'linker.gene_to_drug'}], 2: [{'op': 'linker.gene_to_disease'}]},
+        2: {3: [{'op': 'linker.disease_to_phenotype'}]}}
+QNODES = [FakeQNode(0, node_types.DRUG, 'CHEBI:1'), FakeQNode(1, node_types.GENE), FakeQNode(2, node_types.DISEASE), FakeQNode(3, node_types.PHENOTYPE)]
+LINKS = {('drug_to_gene', 'CHEBI:1'): ['NCBIGENE:1', 'NCBIGENE:2'],
+         ('gene_to_drug', 'NCBIGENE:1'): ['CHEBI:1', 'CHEBI:2'],
+         ('drug_to_gene', 'CHEBI:2'): ['NCBIGENE:2', 'NCBIGENE:3'],
+         ('gene_to_disease', 'NCBIGENE:1'): ['MONDO:1'],
+         ('gene_to_disease', 'NCBIGENE:2'): ['MONDO:1', 'MONDO:2'],
+         ('gene_to_disease', 'NCBIGENE:3'): ['MONDO:2'],
+         ('disease_to_phenotype', 'MONDO:1'): ['HP:1', 'HP:2'],
+         ('disease_to_phenotype', 'MONDO:2'): ['HP:2']}
+
+def make_plan_program(linker):
+    program = Program.__new__(Program)
+    program.program_number = 0
+    program.concept_nodes = QNODES
+    program.transitions = PLAN
+    program.rosetta = FakeRosetta(type('Core', (), {'linker': linker})())
+    program.limits = SourceLimits({})
+    program.workers = 4
+    program.batch_size = 50
+    program.cache = FakeOpCache()
+    program.writer = FakeWriter()
+    return program
+
+def test_frontier_executor_writes_what_depth_first_does():
+    depth_first = make_plan_program(Linker(LINKS))
+    depth_first.initialize_instance_nodes()
+    frontier = make_plan_program(Linker(LINKS))
+    frontier.run_frontiers()
+    assert sorted(frontier.writer.written, key=str) == sorted(depth_first.writer.written, key=str)
+    assert sorted(frontier.rosetta.ops.linker.calls) == sorted(depth_first.rosetta.ops.linker.calls)
+    assert ('MONDO:2', 'HP:2') in frontier.writer.written
+
+def test_frontier_expands_a_node_once_however_it_is_reached():
+    program = make_plan_program(Linker(LINKS))
+    program.run_frontiers()
+    # MONDO:1 is reached from NCBIGENE:1 and NCBIGENE:2 in the same frontier, but only expanded once.
+    assert program.cache['MONDO:1'] == {3}
+    assert program.writer.written.count(('MONDO:1', 'HP:1')) == 1
+    assert program.writer.written.count('MONDO:1') == 1
+    assert program.writer.written.count(('NCBIGENE:1', 'MONDO:1')) == 1
+    assert program.writer.written.count(('NCBIGENE:2', 'MONDO:1')) == 1
+    assert program.rosetta.ops.linker.calls.count(('disease_to_phenotype', 'MONDO:1')) == 1
+
+def test_failing_op_leaves_the_rest_of_the_frontier():
+    program = make_plan_program(Linker(LINKS, broken={('gene_to_disease', 'NCBIGENE:2')}))
+    program.run_frontiers()
+    written = program.writer.written
+    assert 'MONDO:2' not in written
+    # The rest of NCBIGENE:2's frontier still runs, and so do the frontiers after it.
+    assert ('NCBIGENE:1', 'MONDO:1') in written
+    assert ('MONDO:1', 'HP:1') in written
+    assert ('MONDO:1', 'HP:2') in written
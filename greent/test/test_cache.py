@@ -0,0 +1,255 @@
+import pickle
+import pytest
+import threading
+import time
+from greent.cache import CompactCacheSerializer, JSONCacheSerializer, PickleCacheSerializer
+from greent.cache import Cache, ExpiryPolicy, MemoryTier, UnreadableRecord, entry_size
+from greent.graph_components import KNode, KEdge, LabeledID
+from greent import node_types
+
+@pytest.fixture()
+def results():
+    drug = KNode('CHEBI:15365', type=node_types.DRUG, name='aspirin')
+    gene = KNode('NCBIGENE:5743', type=node_types.GENE, name='PTGS2')
+    gene.add_synonyms( set( [LabeledID(identifier='HGNC:9605', label='PTGS2')] ) )
+    predicate = LabeledID(identifier='CTD:decreases_activity_of', label='decreases^activity')
+    edge = KEdge(source_id=drug.id, target_id=gene.id, provided_by='ctd.drug_to_gene', ctime=1529000000.0,
+                 original_predicate=predicate, standard_predicate=predicate, input_id='MESH:D001241',
+                 publications=['PMID:1234'], properties={'description': 'aspirin results in decreased PTGS2'})
+    return [ (edge, gene) ]
+
+def check_results(expected, actual):
+    assert len(actual) == len(expected)
+    for (e_edge, e_node), (a_edge, a_node) in zip(expected, actual):
+        assert vars(a_edge) == vars(e_edge)
+        assert a_node.id == e_node.id
+        assert a_node.name == e_node.name
+        assert a_node.synonyms == e_node.synonyms
+
+def test_results_roundtrip(results):
+    serializer = CompactCacheSerializer()
+    check_results(results, serializer.loads(serializer.dumps(results)))
+
+def test_json_roundtrip(results):
+    serializer = JSONCacheSerializer()
+    check_results(results, serializer.loads(serializer.dumps(results)))
+
+def test_synonyms_and_completed():
+    serializer = CompactCacheSerializer()
+    synonyms = set( [LabeledID(identifier='HGNC:9605', label='PTGS2'), LabeledID(identifier='NCBIGENE:5743', label=None)] )
+    assert serializer.loads(serializer.dumps(synonyms)) == synonyms
+    completed = set([1, 3])
+    assert serializer.loads(serializer.dumps(completed)) == completed
+
+def test_compression(results):
+    serializer = CompactCacheSerializer(compression_threshold=10)
+    packed = serializer.dumps(results * 50)
+    assert len(packed) < len(pickle.dumps(results * 50))
+    check_results(results * 50, serializer.loads(packed))
+
+def test_reads_pickle(results):
+    """Entries written by the pickle serializer can still be read"""
+    serializer = CompactCacheSerializer()
+    check_results(results, serializer.loads(PickleCacheSerializer().dumps(results)))
+    assert not serializer.is_native(pickle.dumps(results))
+
+def test_unknown_type_falls_back_to_pickle():
+    serializer = CompactCacheSerializer()
+    value = {'raw': b'bytes'}
+    assert serializer.loads(serializer.dumps(value)) == value
+
+def test_ints_too_big_for_msgpack_fall_back_to_pickle():
+    serializer = CompactCacheSerializer()
+    value = {'big': 2 ** 70}
+    assert serializer.loads(serializer.dumps(value)) == value
+
+def test_record_compressed_with_a_missing_codec_is_a_miss(monkeypatch, results, tmp_path):
+    pytest.importorskip('zstandard')
+    rec = CompactCacheSerializer(compression='zstd', compression_threshold=0).dumps(results)
+    monkeypatch.setattr('greent.cache.zstandard', None)
+    with pytest.raises(UnreadableRecord):
+        CompactCacheSerializer().loads(rec)
+    monkeypatch.setattr('redis.StrictRedis', lambda **kwargs: None)
+    cache = Cache(serializer=CompactCacheSerializer(), cache_path=str(tmp_path))
+    assert cache.decode('ctd.drug_to_gene(MESH:D001241)', rec) is None
+
+def test_expiry_longest_prefix():
+    policy = ExpiryPolicy([{'prefix': 'ctd.', 'ttl': 100}, {'prefix': 'ctd.drug_to_gene(', 'ttl': 10},
+                           {'prefix': 'synonymize(', 'ttl': 0}], default=1000)
+    assert policy.ttl('ctd.drug_to_gene(MESH:D001241)') == 10
+    assert policy.ttl('ctd.gene_to_drug(NCBIGENE:5743)') == 100
+    assert policy.ttl('synonymize(HGNC:9605)') is None
+    assert policy.ttl('biolink.gene_get_disease(HGNC:9605)') == 1000
+
+def test_memory_tier_bounded_by_bytes():
+    tier = MemoryTier(max_bytes=100)
+    for i in range(10):
+        tier.put(f'k{i}', i, 20)
+    assert tier.size <= 100
+    assert tier.get('k0') == (False, None)
+    assert tier.get('k9') == (True, 9)
+    assert tier.stats.evictions == 5
+
+def test_entries_are_sized_by_live_memory(results):
+    # Live objects take far more memory than their compressed records.
+    assert entry_size('k', results * 50) > 10 * len(CompactCacheSerializer().dumps(results * 50))
+    assert entry_size('k', None) < 100
+
+def test_misses_are_remembered_briefly(monkeypatch, tmp_path):
+    now = [1000.0]
+    monkeypatch.setattr('time.time', lambda: now[0])
+    monkeypatch.setattr('redis.StrictRedis', lambda **kwargs: None)
+    cache = Cache(serializer=CompactCacheSerializer(), cache_path=str(tmp_path), negative_ttl=60)
+    assert cache.get('synonymize(HGNC:1)') is None
+    # Written by another process, e.g. to the shared tier.
+    cache.disk.put('synonymize(HGNC:1)', cache.serializer.dumps(set(['HGNC:1'])))
+    assert cache.get('synonymize(HGNC:1)') is None
+    now[0] += 61
+    assert cache.get('synonymize(HGNC:1)') == set(['HGNC:1'])
+
+def test_bulk_set_serializes_each_value_once(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    monkeypatch.setattr('redis.StrictRedis', lambda **kwargs: fakeredis.FakeStrictRedis())
+    cache = Cache(serializer=CompactCacheSerializer())
+    dumps = []
+    original = cache.serializer.dumps
+    cache.serializer.dumps = lambda value: dumps.append(value) or original(value)
+    shared = set(['CHEBI:1', 'MESH:2'])
+    totals = cache.bulk_set([ (['synonymize(CHEBI:1)', 'synonymize(MESH:2)'], shared),
+                              (['synonymize(UNII:3)'], set(['UNII:3'])) ], chunk_size=2)
+    assert len(dumps) == 2
+    assert totals['keys'] == 3
+    assert totals['values'] == 2
+    assert cache.get('synonymize(MESH:2)') == shared
+    assert cache.get_many(['synonymize(CHEBI:1)', 'synonymize(UNII:3)'])['synonymize(UNII:3)'] == set(['UNII:3'])
+
+@pytest.fixture
+def shared_redis(monkeypatch):
+    """ Every Cache made in the test connects to the same fake redis server, as workers would. """
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr('redis.StrictRedis', lambda **kwargs: fakeredis.FakeStrictRedis(server=server))
+    return server
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+def test_disabled_cache_computes(tmp_path):
+    cache = Cache(enabled=False, cache_path=str(tmp_path))
+    assert cache.single_flight('ctd.drug_to_gene(CHEBI:1)', lambda: ['result']) == ['result']
+    assert cache.get('ctd.drug_to_gene(CHEBI:1)') is None
+
+def test_single_flight_coalesces_misses(shared_redis):
+    holder, waiter = Cache(serializer=CompactCacheSerializer()), Cache(serializer=CompactCacheSerializer())
+    key = 'ctd.drug_to_gene(CHEBI:1)'
+    release = threading.Event()
+    calls = []
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return set(['NCBIGENE:1'])
+    computing = threading.Thread(target=lambda: holder.single_flight(key, compute))
+    computing.start()
+    wait_until(lambda: calls)
+    results = []
+    waiting = threading.Thread(target=lambda: results.append(waiter.single_flight(key, compute)))
+    waiting.start()
+    time.sleep(0.1)
+    release.set()
+    computing.join()
+    waiting.join()
+    assert results == [set(['NCBIGENE:1'])]
+    assert len(calls) == 1
+    assert (holder.coalesced.hits, holder.coalesced.misses) == (0, 1)
+    assert (waiter.coalesced.hits, waiter.coalesced.misses) == (1, 0)
+    assert waiter.stats()['redis']['coalesced'] == 1
+
+def test_waiter_takes_over_from_a_failed_computation(shared_redis):
+    holder, waiter = Cache(serializer=CompactCacheSerializer()), Cache(serializer=CompactCacheSerializer())
+    key = 'ctd.drug_to_gene(CHEBI:1)'
+    release = threading.Event()
+    def fail():
+        release.wait(5)
+        raise IOError('service unavailable')
+    errors = []
+    def hold():
+        try:
+            holder.single_flight(key, fail)
+        except IOError as e:
+            errors.append(e)
+    computing = threading.Thread(target=hold)
+    computing.start()
+    wait_until(lambda: holder.redis.get(f'inflight:{key}') is not None)
+    results = []
+    waiting = threading.Thread(target=lambda: results.append(waiter.single_flight(key, lambda: set(['NCBIGENE:2']))))
+    waiting.start()
+    time.sleep(0.1)
+    release.set()
+    computing.join()
+    waiting.join()
+    assert len(errors) == 1
+    assert results == [set(['NCBIGENE:2'])]
+    assert waiter.coalesced.misses == 1
+    # The holder remembers its own miss in memory for a while; the shared tier has the waiter's result.
+    assert holder.load(key) == set(['NCBIGENE:2'])
+
+def test_waiter_takes_over_an_expired_lock(shared_redis):
+    cache = Cache(serializer=CompactCacheSerializer())
+    key = 'ctd.drug_to_gene(CHEBI:1)'
+    # A worker that took the lock and died.
+    assert cache.redis.lock(f'inflight:{key}', timeout=0.3).acquire(blocking=False)
+    started = time.time()
+    assert cache.single_flight(key, lambda: set(['NCBIGENE:3'])) == set(['NCBIGENE:3'])
+    assert time.time() - started >= 0.3
+    assert cache.coalesced.misses == 1
+
+def test_reserialized_entries_keep_their_ttl(shared_redis, results):
+    cache = Cache(serializer=CompactCacheSerializer())
+    cache.redis.set('ctd.drug_to_gene(MESH:D001241)', pickle.dumps(results), ex=100)
+    cache.redis.set('synonymize(HGNC:9605)', pickle.dumps(set(['HGNC:9605'])))
+    assert cache.reserialize() == 2
+    assert cache.serializer.is_native(cache.redis.get('ctd.drug_to_gene(MESH:D001241)'))
+    assert 0 < cache.redis.ttl('ctd.drug_to_gene(MESH:D001241)') <= 100
+    assert cache.redis.ttl('synonymize(HGNC:9605)') == -1
+    check_results(results, cache.load('ctd.drug_to_gene(MESH:D001241)'))
+    assert cache.reserialize() == 0
+
+def test_get_many_reads_each_tier(shared_redis, results, tmp_path):
+    cache = Cache(serializer=CompactCacheSerializer(), disk_path=str(tmp_path))
+    serializer = cache.serializer
+    cache.set('synonymize(HGNC:1)', set(['HGNC:1']))
+    cache.disk.put('synonymize(HGNC:2)', serializer.dumps(set(['HGNC:2'])))
+    cache.redis.set('ctd.drug_to_gene(MESH:D001241)', serializer.dumps(results))
+    # A record from a newer version of the codec, which this reader can't decode.
+    newer = serializer.MAGIC + bytes([serializer.VERSION + 1]) + b'jn[]'
+    cache.redis.set('synonymize(HGNC:3)', newer)
+    keys = ['synonymize(HGNC:1)', 'synonymize(HGNC:2)', 'ctd.drug_to_gene(MESH:D001241)', 'synonymize(HGNC:3)', 'synonymize(HGNC:4)']
+    values = cache.get_many(keys)
+    assert list(values) == keys
+    assert values['synonymize(HGNC:1)'] == set(['HGNC:1'])
+    assert values['synonymize(HGNC:2)'] == set(['HGNC:2'])
+    check_results(results, values['ctd.drug_to_gene(MESH:D001241)'])
+    assert values['synonymize(HGNC:3)'] is None
+    assert values['synonymize(HGNC:4)'] is None
+    # Only the keys in neither the memory nor the disk tier are fetched from redis, and its hits are kept on disk.
+    assert (cache.redis_stats.hits, cache.redis_stats.misses) == (2, 1)
+    assert cache.disk.get('ctd.drug_to_gene(MESH:D001241)') is not None
+    assert cache.cache.stats.hits == 1
+    # Everything read, misses included, is now in the memory tier.
+    assert cache.get_many(keys) == values
+    assert (cache.redis_stats.hits, cache.redis_stats.misses) == (2, 1)
+
+def test_set_many_applies_ttls_by_prefix(shared_redis, results):
+    expiry = ExpiryPolicy([{'prefix': 'ctd.', 'ttl': 100}, {'prefix': 'synonymize(', 'ttl': 0}], default=1000)
+    cache = Cache(serializer=CompactCacheSerializer(), expiry=expiry)
+    cache.set_many({'ctd.drug_to_gene(MESH:D001241)': results, 'synonymize(HGNC:1)': set(['HGNC:1']),
+                    'biolink.gene_get_disease(HGNC:1)': [], 'ctd.gene_to_drug(NCBIGENE:1)': None})
+    assert 0 < cache.redis.ttl('ctd.drug_to_gene(MESH:D001241)') <= 100
+    assert cache.redis.ttl('synonymize(HGNC:1)') == -1
+    assert 100 < cache.redis.ttl('biolink.gene_get_disease(HGNC:1)') <= 1000
+    assert not cache.redis.exists('ctd.gene_to_drug(NCBIGENE:1)')
+    check_results(results, cache.load('ctd.drug_to_gene(MESH:D001241)'))
+    assert cache.load('biolink.gene_get_disease(HGNC:1)') == []
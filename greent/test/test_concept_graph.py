@@ -0,0 +1,166 @@
+import pytest
+import threading
+from greent.graph import BulkGraphDB, ConceptGraph, TypeGraph, traversable
+from builder.question import Question
+
+EDGES = [
+    {'source': 'chemical_substance', 'target': 'gene', 'predicate': 'interacts_with', 'op': 'ctd.drug_to_gene'},
+    {'source': 'chemical_substance', 'target': 'gene', 'predicate': 'interacts_with', 'op': 'pharos.drug_get_gene'},
+    {'source': 'gene', 'target': 'chemical_substance', 'predicate': 'interacts_with', 'op': 'ctd.gene_to_drug'},
+    {'source': 'gene', 'target': 'disease', 'predicate': 'gene_associated_with_condition', 'op': 'biolink.gene_get_disease'},
+    {'source': 'disease', 'target': 'gene', 'predicate': 'gene_associated_with_condition', 'op': 'biolink.disease_get_gene'},
+    {'source': 'disease', 'target': 'phenotypic_feature', 'predicate': 'has_phenotype', 'op': 'biolink.disease_get_phenotype'},
+]
+
+def question(nodes, edges):
+    return Question({'machine_question': {'nodes': nodes, 'edges': edges}}).machine_question
+
+def ops(plan, source, target):
+    return sorted(t['op'] for t in plan[source][target])
+
+def test_one_hop_from_named_node():
+    q = question([{'id': 0, 'type': 'chemical_substance', 'curie': 'CHEBI:15365'}, {'id': 1, 'type': 'gene'}],
+                 [{'source_id': 0, 'target_id': 1}])
+    plans = ConceptGraph(EDGES).plans(q['nodes'], q['edges'])
+    # Only the forward direction reaches the gene from the named drug.
+    assert len(plans) == 1
+    assert ops(plans[0], 0, 1) == ['ctd.drug_to_gene', 'pharos.drug_get_gene']
+    assert ops(plans[0], 1, 0) == []
+
+def test_both_ends_named_meet_in_the_middle():
+    q = question([{'id': 0, 'type': 'chemical_substance', 'curie': 'CHEBI:15365'}, {'id': 1, 'type': 'gene'},
+                  {'id': 2, 'type': 'disease', 'curie': 'MONDO:0005148'}],
+                 [{'source_id': 0, 'target_id': 1}, {'source_id': 1, 'target_id': 2}])
+    plans = ConceptGraph(EDGES).plans(q['nodes'], q['edges'])
+    directions = {(bool(p[0][1]), bool(p[1][2])) for p in plans}
+    # Every direction reaches the gene from one end or the other, except gene -> drug with gene -> disease.
+    assert directions == {(True, True), (True, False), (False, False)}
+    assert all(ops(p, 2, 1) == ['biolink.disease_get_gene'] for p in plans if not p[1][2])
+
+def test_untyped_node_binds_any_concept():
+    q = question([{'id': 0, 'type': 'disease', 'curie': 'MONDO:0005148'}, {'id': 1}],
+                 [{'source_id': 0, 'target_id': 1}])
+    plans = ConceptGraph(EDGES).plans(q['nodes'], q['edges'])
+    assert sorted(op for p in plans for op in ops(p, 0, 1)) == ['biolink.disease_get_gene', 'biolink.disease_get_phenotype']
+
+def test_no_named_node_no_plans():
+    q = question([{'id': 0, 'type': 'chemical_substance'}, {'id': 1, 'type': 'gene'}], [{'source_id': 0, 'target_id': 1}])
+    assert ConceptGraph(EDGES).plans(q['nodes'], q['edges']) == []
+
+def test_multi_hop_edges_are_rejected():
+    q = question([{'id': 0, 'type': 'chemical_substance', 'curie': 'CHEBI:1'}, {'id': 1, 'type': 'disease'}],
+                 [{'source_id': 0, 'target_id': 1, 'min_length': 1, 'max_length': 2}])
+    with pytest.raises(ValueError):
+        ConceptGraph(EDGES).plans(q['nodes'], q['edges'])
+
+def test_traversable():
+    assert traversable((0, 1, 2), ((0, 1), (2, 1)), (0, 2))
+    assert not traversable((0, 1, 2), ((0, 1), (2, 1)), (0,))
+
+def test_plans_are_cached_by_shape(monkeypatch):
+    class FakeTypeGraph:
+        def __init__(self):
+            self.graph = ConceptGraph(EDGES)
+            self.graph.version = 'v1'
+        def concept_graph(self):
+            return self.graph
+    class FakeCache(dict):
+        def set(self, key, value):
+            self[key] = value
+    class FakeRosetta:
+        def __init__(self):
+            self.type_graph = FakeTypeGraph()
+            self.cache = FakeCache()
+    monkeypatch.setattr('greent.program.Program', lambda plan, nodes, rosetta, number: plan)
+    rosetta = FakeRosetta()
+    aspirin = Question({'machine_question': {'nodes': [{'id': 0, 'type': 'chemical_substance', 'curie': 'CHEBI:15365'}, {'id': 1, 'type': 'gene'}],
+                                             'edges': [{'source_id': 0, 'target_id': 1}]}})
+    ibuprofen = Question({'machine_question': {'nodes': [{'id': 1, 'type': 'gene'}, {'id': 0, 'type': 'chemical_substance', 'curie': 'CHEBI:5855'}],
+                                               'edges': [{'source_id': 0, 'target_id': 1}]}})
+    assert aspirin.shape == ibuprofen.shape
+    plan = aspirin.compile(rosetta)[0]
+    assert len(rosetta.cache) == 1
+    rosetta.type_graph.graph.plans = None
+    assert ibuprofen.compile(rosetta)[0] is plan
+    # A rebuilt type graph has a new version, so the plan is compiled again.
+    rosetta.type_graph.graph = ConceptGraph(EDGES[:1])
+    rosetta.type_graph.graph.version = 'v2'
+    assert [t['op'] for t in aspirin.compile(rosetta)[0][0][1]] == ['ctd.drug_to_gene']
+    assert len(rosetta.cache) == 2
+
+class FakeResult(list):
+    def single(self):
+        return self[0] if self else None
+
+class FakeNeo4j:
+    """ A driver, session and transaction over a stored version and list of transitions. """
+    def __init__(self, version, edges):
+        self.version = version
+        self.edges = edges
+        self.loads = 0
+    def session(self):
+        return self
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        pass
+    def read_transaction(self, work):
+        return work(self)
+    def run(self, query, parameters=None):
+        if 'g.version AS version' in query:
+            return FakeResult([{'version': self.version}] if self.version else [])
+        self.loads += 1
+        return FakeResult(self.edges)
+
+def type_graph_over(driver):
+    type_graph = TypeGraph.__new__(TypeGraph)
+    type_graph.compiled = None
+    type_graph.compiled_version = None
+    type_graph.version_checked = 0
+    type_graph.version_check_interval = 30
+    type_graph.compile_lock = threading.Lock()
+    type_graph.driver = driver
+    return type_graph
+
+def test_concept_graph_reloads_when_the_type_graph_is_rebuilt(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('greent.graph.time.time', lambda: clock[0])
+    type_graph = type_graph_over(FakeNeo4j('v1', EDGES))
+    graph = type_graph.concept_graph()
+    assert graph.version == 'v1' and len(graph.links('chemical_substance', 'gene')) == 2
+    # Another process rebuilds the type graph; it is not noticed until the next version check.
+    type_graph.driver.version, type_graph.driver.edges = 'v2', EDGES[:1]
+    clock[0] += 10
+    assert type_graph.concept_graph() is graph
+    clock[0] += 30
+    rebuilt = type_graph.concept_graph()
+    assert rebuilt.version == 'v2' and len(rebuilt.links('chemical_substance', 'gene')) == 1
+    # An unchanged version is not loaded again.
+    clock[0] += 30
+    assert type_graph.concept_graph() is rebuilt
+    assert type_graph.driver.loads == 2
+
+def test_unversioned_type_graph_is_keyed_by_content():
+    type_graph = type_graph_over(FakeNeo4j(None, EDGES))
+    assert type_graph.concept_graph().version == ConceptGraph(EDGES).digest()
+
+def test_bulk_graph_db_groups_statements():
+    db = BulkGraphDB()
+    for name in ('gene', 'disease'):
+        if not db.get_node({'name': name}, 'Concept').peek():
+            db.create_node({'name': name}, 'Concept')
+            db.add_label({'name': name}, 'Concept', name)
+    db.create_type({'name': 'NCBIGENE', 'iri': None})
+    db.add_label({'name': 'NCBIGENE'}, 'Type', 'gene')
+    db.create_relationship('gene', 'Concept', {'name': 'is_a'}, 'NCBIGENE', 'Type')
+    for op in ('biolink.gene_get_disease', 'biolink.gene_get_disease', 'pharos.gene_get_disease'):
+        db.create_relationship('gene', 'Concept', {'name': 'associated', 'predicate': 'associated', 'op': op, 'enabled': True}, 'disease', 'Concept')
+    statements = list(db.statements())
+    assert db.get_node({'name': 'gene'}, 'Concept').peek() is not None
+    assert len(statements) == 5
+    assert statements[0] == ("UNWIND $rows AS row MERGE (n:`Concept` {name: row.name}) SET n += row SET n:`gene`", {'rows': [{'name': 'gene'}]})
+    assert statements[2][1] == {'rows': [{'name': 'NCBIGENE'}]}
+    cypher, parameters = statements[4]
+    assert 'MERGE (a)-[:`associated` {enabled: row.properties.enabled, op: row.properties.op, predicate: row.properties.predicate}]->(b)' in cypher
+    assert [row['properties']['op'] for row in parameters['rows']] == ['biolink.gene_get_disease', 'pharos.gene_get_disease']
+    assert 'MERGE (a)-[:`is_a`]->(b)' in statements[3][0]
@@ -0,0 +1,34 @@
+from greent.concordance import ConcordanceStore
+from greent.graph_components import LabeledID
+from crawler.crawl_util import glom
+
+def test_lookup(tmp_path):
+    store = ConcordanceStore(str(tmp_path / 'concord.db'))
+    concord = {}
+    glom(concord, [('CHEBI:1', 'CHEMBL:2'), ('CHEMBL:2', 'MESH:3'), ('CHEBI:9', 'PUBCHEM:8')])
+    assert store.update(concord) == 5
+    assert store.get('MESH:3') == {'CHEBI:1', 'CHEMBL:2', 'MESH:3'}
+    assert store.get('UNII:0') is None
+    found = store.get_many(['CHEBI:1', 'PUBCHEM:8', 'UNII:0'])
+    assert found['CHEBI:1'] == {'CHEBI:1', 'CHEMBL:2', 'MESH:3'}
+    assert found['PUBCHEM:8'] == {'CHEBI:9', 'PUBCHEM:8'}
+    assert found['UNII:0'] is None
+
+def test_labels(tmp_path):
+    store = ConcordanceStore(str(tmp_path / 'concord.db'))
+    idset = {LabeledID(identifier='HGNC:1', label='A1BG'), LabeledID(identifier='NCBIGENE:1', label='A1BG')}
+    store.update({'HGNC:1': idset, 'NCBIGENE:1': idset})
+    assert store.get('NCBIGENE:1') == idset
+    assert {s.label for s in store.get('HGNC:1')} == {'A1BG'}
+
+def test_incremental_update(tmp_path):
+    path = str(tmp_path / 'concord.db')
+    store = ConcordanceStore(path)
+    store.update({'A:1': {'A:1', 'B:1'}, 'B:1': {'A:1', 'B:1'}})
+    merged = {'A:1', 'B:1', 'C:1'}
+    store.update({'A:1': merged, 'B:1': merged, 'C:1': merged})
+    # A second process opening the same index sees the merged set, and the old set is gone.
+    reopened = ConcordanceStore(path)
+    assert reopened.get('B:1') == merged
+    assert reopened.count() == 3
+    assert reopened.connection().execute('SELECT COUNT(*) FROM sets').fetchone()[0] == 1
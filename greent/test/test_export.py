@@ -0,0 +1,459 @@
+import csv
+import io
+import json
+import re
+import time
+from neo4j.v1 import TransientError
+from pika.exceptions import NackError
+from greent.export import export_edge_chunk, export_node_chunk, BufferedWriter, CSVWriter, LabelQueue, MessagePublisher, WriterConsumer, encode_message, log_message, message_elements, replay_messages, writer_queues
+from greent.fingerprints import shard_for
+from greent.graph_components import KNode, KEdge, LabeledID
+from greent import node_types
+
+class FakeResult(list):
+    def __init__(self, records, created):
+        super().__init__(records)
+        self.created = created
+    def summary(self):
+        counters = type('Counters', (), {'nodes_created': self.created, 'relationships_created': self.created})()
+        return type('Summary', (), {'counters': counters})()
+
+class FakeWriteTransaction:
+    """Logs each export as (export function, label, node ids or edge endpoints), writing every row."""
+    def __init__(self, log, failures):
+        self.log = log
+        self.failures = failures
+        self.pending = []
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.log.extend(self.pending)
+    def run(self, cypher, parameters):
+        rows = parameters['batches']
+        if 'MERGE (a:' in cypher:
+            function, label = 'export_node_chunk', re.search(r'set a:(\w+)', cypher).group(1)
+            records = [{'id': row['id'], 'node_id': None} for row in rows]
+            ids = [row['id'] for row in rows]
+        else:
+            function, label = 'export_edge_chunk', re.search(r'\[r:(\w+)', cypher).group(1)
+            records = [{'index': row['index'], 'source_id': row['source_id'], 'source_node': None,
+                        'target_id': row['target_id'], 'target_node': None} for row in rows]
+            ids = [(row['source_id'], row['target_id']) for row in rows]
+        if self.failures.get(label):
+            self.failures[label] -= 1
+            raise TransientError('deadlock')
+        self.pending.append((function, label, ids))
+        return FakeResult(records, 1)
+
+class FakeSession:
+    def __init__(self, log, failures):
+        self.log = log
+        self.failures = failures
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        pass
+    def begin_transaction(self):
+        return FakeWriteTransaction(self.log, self.failures)
+
+class FakeDriver:
+    def __init__(self):
+        self.log = []
+        self.failures = {}
+    def session(self):
+        return FakeSession(self.log, self.failures)
+
+class FakeRosetta:
+    def __init__(self, writer_config):
+        self.type_graph = type('TypeGraph', (), {'driver': FakeDriver()})()
+        self.service_context = type('Context', (), {'config': {'writer': writer_config}})()
+
+def make_edge(source, target):
+    predicate = LabeledID(identifier='RO:0002434', label='interacts with')
+    return KEdge(source_id=source.id, target_id=target.id, provided_by='ctd.drug_to_gene', ctime=0,
+                 original_predicate=predicate, standard_predicate=predicate, input_id=source.id, publications=[])
+
+def test_buffers_until_flush():
+    rosetta = FakeRosetta({'batch_size': 100, 'max_latency': 100})
+    writer = BufferedWriter(rosetta)
+    drug = KNode('CHEBI:15365', type=node_types.DRUG, name='aspirin')
+    gene = KNode('NCBIGENE:5743', type=node_types.GENE, name='PTGS2')
+    writer.write_node(drug)
+    writer.write_node(gene)
+    writer.write_edge(make_edge(drug, gene))
+    writer.write_node(drug)
+    assert rosetta.type_graph.driver.log == []
+    writer.flush()
+    log = rosetta.type_graph.driver.log
+    assert [entry[0] for entry in log] == ['export_node_chunk', 'export_node_chunk', 'export_edge_chunk']
+    writer.flush()
+    assert len(log) == 3
+
+def test_full_queue_writes_nodes_before_edges():
+    rosetta = FakeRosetta({'batch_size': 100, 'max_latency': 100, 'min_batch_size': 1,
+                           'labels': {'interacts_with': {'batch_size': 1}}})
+    writer = BufferedWriter(rosetta)
+    drug = KNode('CHEBI:15365', type=node_types.DRUG, name='aspirin')
+    gene = KNode('NCBIGENE:5743', type=node_types.GENE, name='PTGS2')
+    writer.write_node(drug)
+    writer.write_node(gene)
+    writer.write_edge(make_edge(drug, gene))
+    assert [entry[0] for entry in rosetta.type_graph.driver.log] == ['export_node_chunk', 'export_node_chunk', 'export_edge_chunk']
+
+def test_max_latency(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('time.time', lambda: now[0])
+    rosetta = FakeRosetta({'max_latency': 5})
+    writer = BufferedWriter(rosetta)
+    writer.write_node(KNode('CHEBI:1', type=node_types.DRUG, name='one'))
+    assert rosetta.type_graph.driver.log == []
+    now[0] += 6
+    writer.write_node(KNode('CHEBI:2', type=node_types.DRUG, name='two'))
+    assert rosetta.type_graph.driver.log == [('export_node_chunk', node_types.DRUG, ['CHEBI:1', 'CHEBI:2'])]
+
+def test_flush_thread():
+    rosetta = FakeRosetta({'max_latency': 0.2, 'flush_thread': True})
+    with BufferedWriter(rosetta) as writer:
+        writer.write_node(KNode('CHEBI:1', type=node_types.DRUG, name='one'))
+        time.sleep(0.6)
+        assert rosetta.type_graph.driver.log == [('export_node_chunk', node_types.DRUG, ['CHEBI:1'])]
+
+def test_batch_size_tuning():
+    queue = LabelQueue(batch_size=100, min_batch_size=10, max_batch_size=1000, target_seconds=1)
+    queue.tune(100, 0.1)
+    assert queue.batch_size == 550
+    queue.tune(550, 5.5)
+    assert queue.batch_size == 325
+    queue.tune(10, 10)
+    assert queue.batch_size == 325
+    for i in range(10):
+        queue.tune(queue.batch_size, 0.01)
+    assert queue.batch_size == 1000
+
+def test_parallel_labels_write_nodes_before_edges():
+    rosetta = FakeRosetta({'workers': 4, 'max_latency': 100})
+    writer = BufferedWriter(rosetta)
+    drugs = [KNode(f'CHEBI:{i}', type=node_types.DRUG, name='drug') for i in range(5)]
+    genes = [KNode(f'NCBIGENE:{i}', type=node_types.GENE, name='gene') for i in range(5)]
+    diseases = [KNode(f'MONDO:{i}', type=node_types.DISEASE, name='disease') for i in range(5)]
+    for drug, gene, disease in zip(drugs, genes, diseases):
+        writer.write_node(drug)
+        writer.write_node(gene)
+        writer.write_node(disease)
+        writer.write_edge(make_edge(drug, gene))
+        predicate = LabeledID(identifier='RO:0002200', label='has phenotype')
+        writer.write_edge(KEdge(source_id=gene.id, target_id=disease.id, provided_by='biolink.gene_get_disease', ctime=0,
+                                original_predicate=predicate, standard_predicate=predicate, publications=[]))
+    writer.close()
+    kinds = [entry[0] for entry in rosetta.type_graph.driver.log]
+    assert kinds == ['export_node_chunk'] * 3 + ['export_edge_chunk'] * 2
+    assert {entry[1] for entry in rosetta.type_graph.driver.log[3:]} == {'interacts_with', 'has_phenotype'}
+
+def test_transient_errors_are_retried(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    rosetta = FakeRosetta({'max_latency': 100, 'retries': 2})
+    rosetta.type_graph.driver.failures[node_types.DRUG] = 2
+    with BufferedWriter(rosetta) as writer:
+        writer.write_node(KNode('CHEBI:1', type=node_types.DRUG, name='one'))
+    assert rosetta.type_graph.driver.log == [('export_node_chunk', node_types.DRUG, ['CHEBI:1'])]
+
+def test_failed_background_write_is_kept_and_raised(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    rosetta = FakeRosetta({'max_latency': 0.1, 'retries': 0, 'flush_thread': True})
+    rosetta.type_graph.driver.failures[node_types.DRUG] = 1
+    writer = BufferedWriter(rosetta)
+    writer.write_node(KNode('CHEBI:1', type=node_types.DRUG, name='one'))
+    deadline = time.time() + 5
+    while writer.failure is None and time.time() < deadline:
+        time.sleep(0.01)
+    writer.stopped.set()
+    writer.flusher.join()
+    assert rosetta.type_graph.driver.log == []
+    try:
+        writer.flush()
+        assert False, 'flush should raise the background failure'
+    except TransientError:
+        pass
+    # The batch went back on its queue, and was written by that flush.
+    assert rosetta.type_graph.driver.log == [('export_node_chunk', node_types.DRUG, ['CHEBI:1'])]
+    writer.flush()
+
+def test_csv_files_for_neo4j_admin_import(tmp_path):
+    drug = KNode('CHEBI:15365', type=node_types.DRUG, name='aspirin')
+    drug.add_synonyms(['CHEMBL:CHEMBL25'])
+    gene = KNode('NCBIGENE:5743', type=node_types.GENE, name='PTGS2')
+    with CSVWriter(str(tmp_path)) as writer:
+        writer.write_node(drug)
+        writer.write_node(gene)
+        writer.write_node(drug)
+        writer.write_edge(make_edge(drug, gene))
+        writer.write_edge(make_edge(drug, gene))
+    with open(tmp_path / f'nodes_{node_types.DRUG}.csv') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == CSVWriter.NODE_HEADER
+    assert len(rows) == 2
+    assert rows[1][:2] == ['CHEBI:15365', 'aspirin']
+    assert set(rows[1][2].split(';')) == {'CHEBI:15365', 'CHEMBL:CHEMBL25'}
+    assert rows[1][3] == f'{node_types.ROOT_ENTITY};{node_types.DRUG}'
+    with open(tmp_path / 'edges_interacts_with.csv') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == CSVWriter.EDGE_HEADER
+    assert rows[1][:4] == ['CHEBI:15365', 'NCBIGENE:5743', 'interacts_with', 'ctd.drug_to_gene']
+    assert len(rows) == 2
+    command = writer.import_command()
+    assert f'--nodes={tmp_path}/nodes_{node_types.GENE}.csv' in command
+    assert f'--relationships={tmp_path}/edges_interacts_with.csv' in command
+
+def test_replay_message_log(tmp_path):
+    drug = KNode('CHEBI:15365', type=node_types.DRUG, name='aspirin')
+    drug.add_synonyms(['CHEMBL:CHEMBL25'])
+    gene = KNode('NCBIGENE:5743', type=node_types.GENE, name='PTGS2')
+    log = [json.dumps({'nodes': [drug.dump()], 'edges': []}),
+           json.dumps({'nodes': [gene.dump()], 'edges': [make_edge(drug, gene).dump()]}),
+           'flush']
+    with CSVWriter(str(tmp_path)) as writer:
+        replay_messages(log, writer)
+    with open(tmp_path / f'nodes_{node_types.DRUG}.csv') as f:
+        rows = list(csv.reader(f))
+    assert set(rows[1][2].split(';')) == {'CHEBI:15365', 'CHEMBL:CHEMBL25'}
+    with open(tmp_path / 'edges_interacts_with.csv') as f:
+        assert len(list(csv.reader(f))) == 2
+
+class FakeChannel:
+    def __init__(self, nacks=0):
+        self.bodies = []
+        self.confirming = False
+        self.nacks = nacks
+        self.published = []
+        self.acked = None
+        self.rejected = []
+    def confirm_delivery(self):
+        self.confirming = True
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if self.nacks:
+            self.nacks -= 1
+            # pika 1.x raises for a nack; 0.x returns False.
+            if self.nacks % 2:
+                raise NackError([])
+            return False
+        self.bodies.append(body)
+        self.published.append((routing_key, body, properties))
+        return True
+    def queue_declare(self, queue, durable=False, arguments=None):
+        pass
+    def basic_qos(self, prefetch_count):
+        self.prefetch_count = prefetch_count
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acked = delivery_tag
+    def basic_reject(self, delivery_tag, requeue=True):
+        self.rejected.append((delivery_tag, requeue))
+
+def test_publisher_batches_messages():
+    channel = FakeChannel(nacks=2)
+    drug = KNode('CHEBI:15365', type=node_types.DRUG, name='aspirin')
+    drug.add_synonyms(['CHEMBL:CHEMBL25'])
+    gene = KNode('NCBIGENE:5743', type=node_types.GENE, name='PTGS2')
+    with MessagePublisher(channel, {'batch_size': 2, 'max_latency': 100}) as publisher:
+        publisher.write_node(drug)
+        assert channel.bodies == []
+        publisher.write_node(gene)
+        publisher.write_edge(make_edge(drug, gene))
+        assert len(channel.bodies) == 1
+    assert channel.confirming
+    assert len(channel.bodies) == 3 and channel.bodies[-1] == 'flush'
+    nodes, edges = message_elements(channel.bodies[0])
+    assert [node.id for node in nodes] == ['CHEBI:15365', 'NCBIGENE:5743']
+    assert {s.identifier for s in nodes[0].synonyms} == {'CHEBI:15365', 'CHEMBL:CHEMBL25'}
+    nodes, edges = message_elements(channel.bodies[1])
+    assert nodes == [] and edges[0].target_id == 'NCBIGENE:5743'
+
+def test_publisher_max_latency(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('time.time', lambda: now[0])
+    channel = FakeChannel()
+    publisher = MessagePublisher(channel, {'batch_size': 100, 'max_latency': 0.2, 'confirm': False})
+    publisher.write_node(KNode('CHEBI:1', type=node_types.DRUG, name='one'))
+    now[0] += 0.5
+    publisher.write_node(KNode('CHEBI:2', type=node_types.DRUG, name='two'))
+    assert not channel.confirming
+    assert [node.id for node in message_elements(channel.bodies[0])[0]] == ['CHEBI:1', 'CHEBI:2']
+
+def test_write_many_from_message():
+    rosetta = FakeRosetta({'batch_size': 100, 'max_latency': 100})
+    writer = BufferedWriter(rosetta)
+    drug = KNode('CHEBI:15365', type=node_types.DRUG, name='aspirin')
+    gene = KNode('NCBIGENE:5743', type=node_types.GENE, name='PTGS2')
+    body = encode_message([drug, gene, drug], [make_edge(drug, gene)])
+    writer.write_many(*message_elements(body))
+    assert rosetta.type_graph.driver.log == []
+    writer.close()
+    assert [entry[0] for entry in rosetta.type_graph.driver.log] == ['export_node_chunk', 'export_node_chunk', 'export_edge_chunk']
+
+def test_replay_binary_message_log(tmp_path):
+    drug = KNode('CHEBI:15365', type=node_types.DRUG, name='aspirin')
+    gene = KNode('NCBIGENE:5743', type=node_types.GENE, name='PTGS2')
+    log = [log_message(encode_message([drug, gene], [make_edge(drug, gene)])), log_message(b'flush')]
+    with CSVWriter(str(tmp_path)) as writer:
+        replay_messages(log, writer)
+    with open(tmp_path / 'edges_interacts_with.csv') as f:
+        assert len(list(csv.reader(f))) == 2
+
+def test_publisher_shards_nodes_by_id():
+    channel = FakeChannel()
+    queues = writer_queues(4)
+    nodes = [KNode(f'NCBIGENE:{i}', type=node_types.GENE, name='gene') for i in range(100)]
+    with MessagePublisher(channel, {'batch_size': 1000, 'max_latency': 100}, queues) as publisher:
+        for node in nodes:
+            publisher.write_node(node)
+    sent = {queue: [node.id for node in message_elements(body)[0]] for queue, body, properties in channel.published if body != 'flush'}
+    assert set(sent) == set(queues)
+    assert sorted(sum(sent.values(), [])) == sorted(node.id for node in nodes)
+    for queue, ids in sent.items():
+        assert {queues[shard_for(i, 4)] for i in ids} == {queue}
+    assert [queue for queue, body, properties in channel.published if body == 'flush'] == queues
+
+class FakeMethod:
+    def __init__(self, delivery_tag):
+        self.delivery_tag = delivery_tag
+
+class FakeProperties:
+    def __init__(self, headers=None):
+        self.headers = headers
+
+def test_consumer_acks_after_writing_and_retries_missing_endpoints():
+    rosetta = FakeRosetta({'max_latency': 100})
+    writer = BufferedWriter(rosetta)
+    drug = KNode('CHEBI:15365', type=node_types.DRUG, name='aspirin')
+    gene = KNode('NCBIGENE:5743', type=node_types.GENE, name='PTGS2')
+    edge = make_edge(drug, gene)
+    written = []
+    def write_batch(session, export, batch, label, counts=None):
+        written.append(label)
+        # The gene lives on another shard and hasn't been written yet.
+        return batch if export.__name__ == 'export_edge_chunk' else None
+    writer.write_batch = write_batch
+    channel = FakeChannel()
+    consumer = WriterConsumer(channel, 'neo4j.0', writer, {'prefetch': 2, 'edge_retries': 1})
+    assert channel.prefetch_count == 2
+    consumer.handle(FakeMethod(1), FakeProperties(), encode_message([drug], [edge]))
+    assert written == [] and channel.acked is None
+    consumer.handle(FakeMethod(2), FakeProperties(), b'flush')
+    assert written == [node_types.DRUG, 'interacts_with']
+    assert channel.acked == 2
+    queue, body, properties = channel.published[-1]
+    assert queue == 'neo4j.0.retry' and properties.headers == {'attempts': 1}
+    # The retried edge is written again, even though the writer has seen it, and dropped after edge_retries.
+    consumer.handle(FakeMethod(3), FakeProperties(properties.headers), body)
+    consumer.commit()
+    assert written[-1] == 'interacts_with'
+    assert channel.acked == 3
+    assert len(channel.published) == 1
+    # The dropped edge is forgotten, so a later copy is written.
+    consumer.handle(FakeMethod(4), FakeProperties(), encode_message([], [make_edge(drug, gene)]))
+    consumer.commit()
+    assert written.count('interacts_with') == 3
+
+def test_consumer_does_not_ack_failed_writes(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    rosetta = FakeRosetta({'max_latency': 100, 'retries': 0})
+    rosetta.type_graph.driver.failures[node_types.DRUG] = 1
+    channel = FakeChannel()
+    consumer = WriterConsumer(channel, 'neo4j.0', BufferedWriter(rosetta), {'prefetch': 10})
+    assert channel.confirming
+    consumer.handle(FakeMethod(1), FakeProperties(), encode_message([KNode('CHEBI:1', type=node_types.DRUG, name='one')], []))
+    try:
+        consumer.commit()
+        assert False, 'commit should raise'
+    except TransientError:
+        pass
+    assert channel.acked is None
+    # The batch is still queued, and is written and acknowledged by the next commit.
+    consumer.commit()
+    assert channel.acked == 1
+    assert rosetta.type_graph.driver.log == [('export_node_chunk', node_types.DRUG, ['CHEBI:1'])]
+
+def test_consumer_rejects_messages_it_cannot_decode():
+    rosetta = FakeRosetta({'max_latency': 100})
+    channel = FakeChannel()
+    message_log = io.StringIO()
+    consumer = WriterConsumer(channel, 'neo4j.0', BufferedWriter(rosetta), {'prefetch': 10}, message_log)
+    drug = KNode('CHEBI:1', type=node_types.DRUG, name='one')
+    truncated = encode_message([drug], [])[:8]
+    for tag, body in enumerate([truncated, b'\xff\xfe not a message', b'{"nodes": [', encode_message([drug], [])], 1):
+        consumer.handle(FakeMethod(tag), FakeProperties(), body)
+    assert channel.rejected == [(1, False), (2, False), (3, False)]
+    assert consumer.pending == [4]
+    consumer.commit()
+    assert channel.acked == 4
+    assert rosetta.type_graph.driver.log == [('export_node_chunk', node_types.DRUG, ['CHEBI:1'])]
+    assert len(message_log.getvalue().splitlines()) == 4
+
+class FakeTransaction:
+    """Runs export queries against a dict of nodes: curie -> internal id."""
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.queries = []
+    def run(self, cypher, parameters):
+        rows = parameters['batches']
+        if 'MERGE (a:' in cypher:
+            self.queries.append('node')
+            return [{'id': row['id'], 'node_id': self.nodes[row['id']]} for row in rows]
+        by_id = 'id(a) = row.source_node' in cypher
+        self.queries.append('edge by id' if by_id else 'edge by curie')
+        records = []
+        for row in rows:
+            if by_id:
+                found = self.nodes.get(row['source_id']) == row['source_node'] and self.nodes.get(row['target_id']) == row['target_node']
+            else:
+                found = row['source_id'] in self.nodes and row['target_id'] in self.nodes
+            if found:
+                records.append({'index': row['index'], 'source_id': row['source_id'], 'source_node': self.nodes[row['source_id']],
+                                'target_id': row['target_id'], 'target_node': self.nodes[row['target_id']]})
+        return records
+
+def test_edges_bind_endpoints_by_internal_id():
+    drug = KNode('CHEBI:15365', type=node_types.DRUG, name='aspirin')
+    genes = [KNode(f'NCBIGENE:{i}', type=node_types.GENE, name='gene') for i in range(3)]
+    tx = FakeTransaction({'CHEBI:15365': 1, 'NCBIGENE:0': 2, 'NCBIGENE:1': 3})
+    node_ids = {}
+    export_node_chunk(tx, [drug, genes[0]], node_types.DRUG, node_ids)
+    assert node_ids == {'CHEBI:15365': 1, 'NCBIGENE:0': 2}
+    # NCBIGENE:1 was written by someone else and has to be MATCHed; NCBIGENE:2 isn't in the graph.
+    unmatched = export_edge_chunk(tx, [make_edge(drug, gene) for gene in genes], 'interacts_with', node_ids)
+    assert tx.queries == ['node', 'edge by id', 'edge by curie']
+    assert [edge.target_id for edge in unmatched] == ['NCBIGENE:2']
+    assert node_ids['NCBIGENE:1'] == 3
+    # A stale internal id falls back to MATCHing by curie.
+    tx.nodes['NCBIGENE:0'] = 7
+    tx.queries = []
+    assert export_edge_chunk(tx, [make_edge(drug, genes[0])], 'interacts_with', node_ids) == []
+    assert tx.queries == ['edge by id', 'edge by curie']
+    assert node_ids['NCBIGENE:0'] == 7
+
+def test_write_stats():
+    rosetta = FakeRosetta({'max_latency': 100, 'batch_size': 2, 'min_batch_size': 1, 'target_seconds': 0})
+    writer = BufferedWriter(rosetta)
+    for i in range(5):
+        writer.write_node(KNode(f'CHEBI:{i}', type=node_types.DRUG, name='drug'))
+    assert writer.queue_depths() == {'nodes': {node_types.DRUG: 1}, 'edges': {}}
+    writer.close()
+    stats = writer.stats.as_dict()['nodes'][node_types.DRUG]
+    assert stats['batches'] == 3 and stats['rows'] == 5
+    assert stats['created'] == 3 and stats['matched'] == 2
+    assert sum(stats['latency_ms'].values()) == 3
+
+def test_write_stats_count_unmatched_edges_separately():
+    rosetta = FakeRosetta({'max_latency': 100})
+    writer = BufferedWriter(rosetta)
+    drug = KNode('CHEBI:15365', type=node_types.DRUG, name='aspirin')
+    genes = [KNode(f'NCBIGENE:{i}', type=node_types.GENE, name='gene') for i in range(3)]
+    def write_batch(session, export, batch, label, counts=None):
+        counts['created'] = 1
+        return batch[1:]
+    writer.write_batch = write_batch
+    for gene in genes:
+        writer.write_edge(make_edge(drug, gene))
+    writer.close()
+    stats = writer.stats.as_dict()['edges']['interacts_with']
+    assert (stats['rows'], stats['created'], stats['matched'], stats['unmatched']) == (3, 1, 0, 2)
@@ -0,0 +1,62 @@
+from greent.fingerprints import FingerprintLRU, ScalableBloomFilter, fingerprint, edge_fingerprint, fingerprint_set, shard_for
+from greent.graph_components import KEdge, LabeledID
+
+def test_edge_fingerprint_matches_edge_equality():
+    predicate = LabeledID(identifier='CTD:increases_expression_of', label='increases^expression')
+    e1 = KEdge(source_id='CHEBI:1', target_id='NCBIGENE:2', provided_by='ctd.drug_to_gene', ctime=1,
+               original_predicate=predicate, standard_predicate=predicate, publications=['PMID:1'])
+    e2 = KEdge(source_id='CHEBI:1', target_id='NCBIGENE:2', provided_by='ctd.drug_to_gene', ctime=2,
+               original_predicate=predicate, standard_predicate=predicate, publications=[])
+    e3 = KEdge(source_id='CHEBI:1', target_id='NCBIGENE:2', provided_by='pharos.drug_get_gene', ctime=1,
+               original_predicate=predicate, standard_predicate=predicate)
+    assert e1 == e2
+    assert edge_fingerprint(e1) == edge_fingerprint(e2)
+    assert edge_fingerprint(e1) != edge_fingerprint(e3)
+
+def test_lru_forgets_oldest():
+    seen = FingerprintLRU(max_entries=2)
+    assert seen.add(1)
+    assert seen.add(2)
+    assert not seen.add(1)
+    assert seen.add(3)
+    assert len(seen) == 2
+    assert not seen.add(1)
+    assert seen.add(2)
+
+def test_bloom_grows_and_keeps_error_rate():
+    seen = ScalableBloomFilter(initial_capacity=1000, error_rate=0.001)
+    fps = [fingerprint(f'NCBIGENE:{i}') for i in range(10000)]
+    assert sum(1 for fp in fps if seen.add(fp)) > 9980
+    assert not any(seen.add(fp) for fp in fps)
+    assert len(seen.filters) > 1
+    false_positives = sum(1 for i in range(10000) if not seen.add(fingerprint(f'HGNC:{i}')))
+    assert false_positives < 20
+
+def test_bloom_max_bytes():
+    seen = ScalableBloomFilter(initial_capacity=1000, error_rate=0.001, max_bytes=8000)
+    for i in range(20000):
+        seen.add(fingerprint(i))
+    assert seen.nbytes() <= 8000 or len(seen.filters) == 1
+
+def test_discard():
+    for seen in (FingerprintLRU(), ScalableBloomFilter(initial_capacity=1000, error_rate=0.001)):
+        assert seen.add(1)
+        seen.discard(1)
+        seen.discard(2)
+        assert seen.add(1)
+        assert not seen.add(1)
+        assert seen.add(2)
+
+def test_config():
+    assert isinstance(fingerprint_set({'method': 'bloom'}), ScalableBloomFilter)
+    assert isinstance(fingerprint_set(), FingerprintLRU)
+
+def test_shards_are_stable_and_balanced():
+    ids = [f'NCBIGENE:{i}' for i in range(10000)]
+    four = [shard_for(i, 4) for i in ids]
+    assert four == [shard_for(i, 4) for i in ids]
+    assert all(2200 < four.count(s) < 2800 for s in range(4))
+    five = [shard_for(i, 5) for i in ids]
+    # Adding a shard only moves identifiers into it.
+    assert all(a == b or b == 4 for a, b in zip(four, five))
+    assert shard_for('NCBIGENE:1', 1) == 0
@@ -0,0 +1,67 @@
+import pytest
+import requests
+from greent.config import Config
+from greent.httpclient import HttpClient, HttpError
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+def client_with(responses, **config):
+    """ A client whose session returns (or raises) the given responses in order. """
+    config.setdefault('backoff', 0)
+    client = HttpClient(config)
+    calls = []
+    def fake_request(method, url, **kwargs):
+        calls.append((method, url, kwargs))
+        r = responses.pop(0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+    client.session('example.org').request = fake_request
+    return client, calls
+
+def test_retries_throttling_then_succeeds(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda s: None)
+    client, calls = client_with([FakeResponse(503), requests.exceptions.ConnectionError(), FakeResponse(200)])
+    r = client.get('http://example.org/x', service='svc')
+    assert r.status_code == 200
+    assert len(calls) == 3
+    stats = client.stats()['svc']
+    assert stats['calls'] == 3
+    assert stats['errors'] == 2
+    assert stats['retries'] == 2
+
+def test_server_error_is_not_retried():
+    client, calls = client_with([FakeResponse(500)])
+    assert client.get('http://example.org/x').status_code == 500
+    assert len(calls) == 1
+
+def test_gives_up_after_max_tries(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda s: None)
+    client, calls = client_with([requests.exceptions.Timeout()] * 3, max_tries=3)
+    with pytest.raises(HttpError):
+        client.get('http://example.org/x')
+    assert len(calls) == 3
+
+def test_per_host_timeout():
+    client, calls = client_with([FakeResponse(200)], timeout=10, hosts=[{'host': 'example.org', 'timeout': 2}])
+    client.get('http://example.org/x')
+    assert calls[0][2]['timeout'] == 2
+
+def test_retry_after():
+    client = HttpClient({'max_backoff': 30})
+    assert client.delay(0, FakeResponse(429, {'Retry-After': '7'})) == 7
+    assert client.delay(0, FakeResponse(429, {'Retry-After': '120'})) == 30
+    assert 0 <= client.delay(3) <= 4
+    assert client.delay(0, FakeResponse(429, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})) == 0
+    for malformed in ('soon', 'Wed, 99 Foo 2015', 'nan', '-5'):
+        assert 0 <= client.delay(0, FakeResponse(429, {'Retry-After': malformed})) <= 0.5
+
+def test_config_is_used():
+    # Config keeps its data out of the dict itself, so it is always falsy.
+    config = Config({'timeout': 3, 'max_tries': 2})
+    assert not config
+    client = HttpClient(config)
+    assert (client.timeout, client.max_tries) == (3, 2)
@@ -0,0 +1,61 @@
+from greent.opregistry import OpRegistry
+from greent.services.caster import Caster
+from greent.graph_components import KNode
+from greent import node_types
+
+class FakeConfig:
+    def get_service(self, name):
+        return {}
+
+class FakeContext:
+    config = FakeConfig()
+    http = None
+
+class FakeBiolink:
+    def __init__(self):
+        self.calls = 0
+    def gene_get_disease(self, node):
+        self.calls += 1
+        return [(None, KNode('MONDO:0007455', type=node_types.DISEASE)), (None, KNode('MONDO:0001106', type=node_types.DISEASE))]
+
+class FakeMondo:
+    def is_genetic_disease(self, node):
+        return node.id == 'MONDO:0007455'
+
+class FakeCore:
+    def __init__(self):
+        self.biolink = FakeBiolink()
+        self.mondo = FakeMondo()
+        self.caster = Caster(FakeContext(), self)
+
+CAST = 'caster.output_filter(upcast(biolink~gene_get_disease,disease),genetic_condition,mondo~is_genetic_disease)'
+
+def test_ops_are_resolved_once():
+    core = FakeCore()
+    registry = OpRegistry(core)
+    assert registry.get('biolink.gene_get_disease') == core.biolink.gene_get_disease
+    function = registry.get(CAST)
+    assert registry.get(CAST) is function
+    assert len(registry) == 2
+    results = function(KNode('HGNC:9236', type=node_types.GENE))
+    assert [(node.id, node.type) for edge, node in results] == [('MONDO:0007455', node_types.GENETIC_CONDITION)]
+
+def test_casts_are_parsed_once():
+    core = FakeCore()
+    first = core.caster.compile(CAST[len('caster.'):])
+    assert core.caster.compile(CAST[len('caster.'):]) is first
+    # Nested expressions are cached too.
+    assert core.caster.compile('upcast(biolink~gene_get_disease,disease)') is first.inner
+
+def test_describe():
+    registry = OpRegistry(FakeCore())
+    info = registry.describe(CAST)
+    assert info['source'] == 'biolink'
+    assert info['base_op'] == 'biolink.gene_get_disease'
+    assert info['output_type'] == 'genetic_condition'
+    assert info['input_type'] is None
+    assert info['filters'] == [{'cast': 'output_filter', 'type': 'genetic_condition', 'type_check': 'mondo.is_genetic_disease'},
+                               {'cast': 'upcast', 'type': 'disease', 'type_check': None}]
+    assert registry.describe('ctd.drug_to_gene')['filters'] == []
+    info = registry.describe('caster.input_filter(biolink~gene_get_disease,gene)')
+    assert info['input_type'] == 'gene' and info['filters'][0]['type_check'] is None
@@ -45,3 +45,11 @@ def test_synonyms_hp(oxo):
     for result in all_results:
         assert 'label' in result
 
+
+def test_synonyms_many(oxo):
+    ids = ['EFO:0000764', 'HP:0000726', 'EFO:9999999']
+    all_results = oxo.get_synonyms_many(ids)
+    assert set(all_results.keys()) == set(ids)
+    assert len(all_results['EFO:9999999']) == 0
+    for identifier in ids[:2]:
+        assert {x['curie'] for x in all_results[identifier]} == oxo.get_synonymous_curies(identifier)
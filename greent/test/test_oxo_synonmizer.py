@@ -33,3 +33,11 @@ def test_names(rosetta):
     assert ms.identifier == 'MedDRA:10016173'
     assert ms.label == 'Fall'
 
+
+def test_synonymize_many(rosetta):
+    from greent.synonymizers.oxo_synonymizer import synonymize_many
+    nodes = [KNode("CL:0000540", type=node_types.CELL), KNode("MEDDRA:10014408", type=node_types.PHENOTYPE)]
+    all_synonyms = synonymize_many(nodes, rosetta.core)
+    for node, synonyms in zip(nodes, all_synonyms):
+        single = KNode(node.id, type=node.type)
+        assert synonyms == synonymize(single, rosetta.core)
@@ -0,0 +1,36 @@
+import time
+import pytest
+from greent.ratelimit import RateLimiter, TokenBucket, RedisTokenBucket
+
+def test_bucket_allows_burst_then_paces():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+def test_acquire_runs_at_rate():
+    bucket = TokenBucket(rate=50, burst=1)
+    start = time.time()
+    for i in range(6):
+        bucket.acquire()
+    assert time.time() - start == pytest.approx(0.1, abs=0.05)
+
+def test_unconfigured_sources_are_not_limited():
+    limiter = RateLimiter({'hgnc': {'rate': 10}})
+    assert limiter.get('ctd') is None
+    assert limiter.get(None) is None
+    assert limiter.acquire('ctd') == 0
+    assert isinstance(limiter.get('hgnc'), TokenBucket)
+    assert limiter.get('hgnc') is limiter.get('hgnc')
+
+def test_shared_bucket_is_shared_across_limiters():
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    redis = fakeredis.FakeStrictRedis()
+    config = {'hgnc': {'rate': 1, 'burst': 1, 'shared': True}}
+    a = RateLimiter(config, redis=redis).get('hgnc')
+    b = RateLimiter(config, redis=redis).get('hgnc')
+    assert isinstance(a, RedisTokenBucket)
+    assert a.reserve() == 0
+    assert b.reserve() == pytest.approx(1, abs=0.2)
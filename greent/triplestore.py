@@ -1,4 +1,5 @@
 import os
+import threading
 import traceback
 from greent.util import LoggingUtil
 from pprint import pprint
@@ -11,10 +12,21 @@ logger = LoggingUtil.init_logging(__name__)
 
 
 class TripleStore(object):
-    """ Connect to a SPARQL endpoint and provide services for loading and executing queries."""
+    """ Connect to a SPARQL endpoint and provide services for loading and executing queries.
+    A SPARQLWrapper holds the query it is about to run, so each thread gets a wrapper of its own:
+    the frontier executor calls a service's ops from several threads at once. """
 
     def __init__(self, hostname):
-        self.service =  SPARQLWrapper2 (hostname)
+        self.hostname = hostname
+        self.local = threading.local ()
+
+    @property
+    def service (self):
+        """ This thread's SPARQLWrapper. """
+        service = getattr (self.local, 'service', None)
+        if service is None:
+            service = self.local.service = SPARQLWrapper2 (self.hostname)
+        return service
 
     def get_template (self, query_name):
         """ Load a template given a template name """
@@ -35,12 +47,14 @@ class TripleStore(object):
         :param query: A SPARQL query.
         :return: Returns a JSON formatted object.
         """
+        # Setting POST would stick to the wrapper, so a POST query gets a wrapper of its own.
+        service = SPARQLWrapper2 (self.hostname) if post else self.service
         if post:
-            self.service.setRequestMethod(POSTDIRECTLY)
-            self.service.setMethod(POST)
-        self.service.setQuery (query)
-        self.service.setReturnFormat (JSON)
-        return self.service.query().convert ()
+            service.setRequestMethod(POSTDIRECTLY)
+            service.setMethod(POST)
+        service.setQuery (query)
+        service.setReturnFormat (JSON)
+        return service.query().convert ()
     
     def query (self, query_text, outputs, flat=False, post = False):
         """ Execute a fully formed query and return results. """